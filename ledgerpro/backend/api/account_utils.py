@@ -1,9 +1,78 @@
-from .models import Account, Organization  # Assuming models are in the same app level
+from .models import Account, AccountBalanceSnapshot, Organization  # Assuming models are in the same app level
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, When
+from decimal import Decimal
+from cachetools import TTLCache
+import threading
 import logging
+import uuid
 # Not strictly used in this snippet but good for financial utilities
 
 logger = logging.getLogger(__name__)
 
+# Resolved default accounts per (organization_id, type, substring, default_name), kept as raw
+# column values so a hit rebuilds the Account without touching the database.
+# Entries for an organization are dropped whenever one of its accounts is saved or deleted (see signals.py).
+DEFAULT_ACCOUNT_CACHE_TTL = 300
+# Account.from_db() expects values in model field order.
+_DEFAULT_ACCOUNT_FIELDS = tuple(f.attname for f in Account._meta.concrete_fields if f.attname in ('id', 'organization_id', 'name', 'type'))
+_default_account_cache = TTLCache(maxsize=1024, ttl=DEFAULT_ACCOUNT_CACHE_TTL)
+_default_account_cache_lock = threading.Lock()
+
+# Net debit per (account_id, date_to, version) for Account.get_balance(). Writes bump the account's
+# version instead of scanning the cache, so bulk imports don't pay per-entry evictions (see apply_journal_entry_to_snapshots).
+# Versions live in Django's cache, shared by every web and Celery worker, so a posting in one process
+# retires the balances every other process memoized; the memoized values themselves stay local.
+BALANCE_CACHE_TTL = 60
+_balance_cache = TTLCache(maxsize=10_000, ttl=BALANCE_CACHE_TTL)
+_balance_cache_lock = threading.Lock()
+
+
+def invalidate_default_account_cache(organization_id=None):
+    '''Drops cached default accounts for one organization, or for all organizations.'''
+    with _default_account_cache_lock:
+        if organization_id is None:
+            _default_account_cache.clear()
+            return
+        for key in [key for key in _default_account_cache if key[0] == organization_id]:
+            _default_account_cache.pop(key, None)
+
+
+def _cache_default_account(key, account):
+    values = tuple(getattr(account, field) for field in _DEFAULT_ACCOUNT_FIELDS)
+    with _default_account_cache_lock:
+        _default_account_cache[key] = values
+
+
+def _balance_version_key(account_id):
+    return f'account-balance-version:{account_id}'
+
+
+def invalidate_balance_cache(account_id):
+    version_key = _balance_version_key(account_id)
+    try:
+        cache.incr(version_key)
+    except ValueError:  # No version yet, or it was evicted; any change from what readers keyed on will do
+        cache.set(version_key, uuid.uuid4().int, timeout=None)
+
+
+def cached_account_net_debit(account_id, date_to, compute):
+    '''
+    Returns compute() for the account and date, memoized until the account's next journal activity in any process.
+    Values read inside a transaction may include uncommitted writes, so they are served but never stored.
+    '''
+    key = (account_id, date_to, cache.get(_balance_version_key(account_id), 0))
+    with _balance_cache_lock:
+        value = _balance_cache.get(key)
+    if value is not None:
+        return value
+    value = compute()
+    if not transaction.get_connection().in_atomic_block:
+        with _balance_cache_lock:
+            _balance_cache[key] = value
+    return value
+
 
 def get_or_create_default_account(
     organization: Organization,
@@ -11,37 +80,113 @@ def get_or_create_default_account(
     account_name_substring: str,
     default_name: str,
     default_description_suffix: str = 'account'
+):
+    '''
+    Cached front for _resolve_default_account(); see there for matching rules.
+    Results are cached only once the surrounding transaction commits, so rolled-back creates are never served.
+    '''
+    key = (organization.id, account_type, account_name_substring, default_name)
+    with _default_account_cache_lock:
+        values = _default_account_cache.get(key)
+    if values is not None:
+        return Account.from_db('default', _DEFAULT_ACCOUNT_FIELDS, values)
+
+    account = _resolve_default_account(organization, account_type, account_name_substring, default_name, default_description_suffix)
+    transaction.on_commit(lambda: _cache_default_account(key, account))
+    return account
+
+
+def _resolve_default_account(
+    organization: Organization,
+    account_type: str,
+    account_name_substring: str,
+    default_name: str,
+    default_description_suffix: str = 'account'
 ):
     '''
     Helper function to find an account by a name substring or create a default one.
     If multiple accounts match the substring, logs a warning and returns the first one found by exact default_name, then by substring.
+    An existing account is returned with only id, name, type and organization loaded.
     '''
-    try:
-        # First, try to find by an exact match of the default_name, as it's more specific
-        account = Account.objects.get(organization=organization, type=account_type, name=default_name, is_active=True)
-    except Account.DoesNotExist:
+    # One round-trip: exact default_name matches rank ahead of substring matches.
+    # Two rows are enough to tell whether the winning match is ambiguous.
+    rows = list(
+        Account.objects
+        .filter(organization=organization, type=account_type, is_active=True)
+        .filter(Q(name=default_name) | Q(name__icontains=account_name_substring))
+        # Callers only link journal entries to the account; skip description and timestamps.
+        .only('id', 'name', 'type', 'organization')
+        .annotate(rank=Case(When(name=default_name, then=0), default=1, output_field=IntegerField()))
+        .order_by('rank', 'pk')[:2]
+    )
+    if not rows:
+        logger.info(
+            'Default account with name "%s" or substring "%s" not found for %s in org %s. Creating "%s".',
+            default_name, account_name_substring, account_type, organization.name, default_name
+        )
         try:
-            # If exact default_name not found, try by substring
-            account = Account.objects.get(organization=organization, type=account_type, name__icontains=account_name_substring, is_active=True)
-            logger.info(f'Found account "{account.name}" for {account_type} using substring "{account_name_substring}" for default "{default_name}" in org {organization.name}.')
-        except Account.DoesNotExist:
-            logger.info(f'Default account with name "{default_name}" or substring "{account_name_substring}" not found for {account_type} in org {organization.name}. Creating "{default_name}".')
-            account = Account.objects.create(
-                organization=organization,
-                name=default_name,
-                type=account_type,
-                description=f'Default {default_description_suffix} for {organization.name}. Auto-created.'
-            )
-        except Account.MultipleObjectsReturned:
+            # Savepoint so a lost race doesn't poison the caller's transaction.
+            with transaction.atomic():
+                return Account.objects.create(
+                    organization=organization,
+                    name=default_name,
+                    type=account_type,
+                    description=f'Default {default_description_suffix} for {organization.name}. Auto-created.'
+                )
+        except IntegrityError:
+            # The uq_account_org_name_type constraint rejected the insert: a concurrent caller
+            # created the account first, or an inactive account already holds the name.
+            account = Account.objects.get(organization=organization, type=account_type, name=default_name)
+            if not account.is_active:
+                logger.warning('Default account "%s" for %s in org %s exists but is inactive. Using it anyway.', default_name, account_type, organization.name)
+            return account
+
+    account = rows[0]
+    ambiguous = len(rows) > 1 and rows[1].rank == account.rank
+    if account.rank == 0:
+        if ambiguous:
             logger.warning(
-                f'Multiple accounts found for org {organization.name} with type {account_type} and substring "{account_name_substring}" '
-                f'when searching for default "{default_name}". Using the first one found by substring.'
+                'Multiple accounts found for org %s with exact name "%s" for type %s. '
+                'Using the first one found. Please ensure unique default account names.',
+                organization.name, default_name, account_type
             )
-            account = Account.objects.filter(organization=organization, type=account_type, name__icontains=account_name_substring, is_active=True).first()
-    except Account.MultipleObjectsReturned:
+    elif ambiguous:
         logger.warning(
-            f'Multiple accounts found for org {organization.name} with exact name "{default_name}" for type {account_type}. '
-            f'Using the first one found. Please ensure unique default account names.'
+            'Multiple accounts found for org %s with type %s and substring "%s" '
+            'when searching for default "%s". Using the first one found by substring.',
+            organization.name, account_type, account_name_substring, default_name
+        )
+    else:
+        logger.info(
+            'Found account "%s" for %s using substring "%s" for default "%s" in org %s.',
+            account.name, account_type, account_name_substring, default_name, organization.name
         )
-        account = Account.objects.filter(organization=organization, type=account_type, name=default_name, is_active=True).first()
     return account
+
+
+def apply_journal_entry_to_snapshots(account_id, entry_date, debit_amount, credit_amount):
+    '''
+    Adds a journal entry's amounts (negated to remove one) to the account's running-total snapshots:
+    the snapshot for entry_date, created from the previous one if missing, and every later snapshot.
+    '''
+    if not debit_amount and not credit_amount:
+        return
+    # Again on commit, so a concurrent read that cached the old balance in between is not served afterwards.
+    invalidate_balance_cache(account_id)
+    transaction.on_commit(lambda: invalidate_balance_cache(account_id))
+    with transaction.atomic():
+        # Serializes snapshot maintenance per account so two writers can't both create the same day's row.
+        list(Account.objects.select_for_update().filter(pk=account_id).values_list('pk', flat=True))
+        snapshots = AccountBalanceSnapshot.objects.filter(account_id=account_id)
+        if not snapshots.filter(as_of_date=entry_date).exists():
+            previous = snapshots.filter(as_of_date__lt=entry_date).order_by('-as_of_date').values('running_debit', 'running_credit').first()
+            AccountBalanceSnapshot.objects.create(
+                account_id=account_id,
+                as_of_date=entry_date,
+                running_debit=previous['running_debit'] if previous else Decimal('0.00'),
+                running_credit=previous['running_credit'] if previous else Decimal('0.00'),
+            )
+        snapshots.filter(as_of_date__gte=entry_date).update(
+            running_debit=F('running_debit') + debit_amount,
+            running_credit=F('running_credit') + credit_amount,
+        )
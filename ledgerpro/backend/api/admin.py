@@ -8,23 +8,55 @@ from .models import (
     PayslipDeduction  # Added Payroll models
 )
 
-admin.site.register(Organization)
-admin.site.register(User)
-admin.site.register(Role)
-admin.site.register(Membership)
-admin.site.register(Account)
-admin.site.register(Transaction)
-admin.site.register(JournalEntry)
-admin.site.register(AuditLog)
-admin.site.register(Customer)
-admin.site.register(Invoice)
-admin.site.register(InvoiceItem)
-admin.site.register(Vendor)
-admin.site.register(PlaidItem)
-admin.site.register(StagedBankTransaction)
-admin.site.register(ReconciliationRule)
-admin.site.register(Employee)
-admin.site.register(PayRun)
-admin.site.register(Payslip)
-admin.site.register(DeductionType)
-admin.site.register(PayslipDeduction)
+# Change-list options per model. list_select_related covers every FK the list columns
+# (including __str__) read, so each list page is a single JOINed query instead of N+1.
+ADMIN_SPECS = {
+    Membership: {'list_select_related': ('user', 'organization', 'role'),
+                 'list_display': ('user', 'organization', 'role', 'date_joined')},
+    Account: {'list_select_related': ('organization',),
+              'list_display': ('name', 'type', 'organization', 'is_active')},
+    Transaction: {'list_select_related': ('organization', 'created_by'),
+                  'list_display': ('__str__', 'date', 'description', 'created_by')},
+    JournalEntry: {'list_select_related': ('transaction__organization', 'account'),
+                   'list_display': ('transaction', 'account', 'debit_amount', 'credit_amount')},
+    AuditLog: {'list_select_related': ('user', 'organization'),
+               'list_display': ('action', 'user', 'organization', 'timestamp')},
+    Customer: {'list_select_related': ('organization',),
+               'list_display': ('name', 'email', 'organization')},
+    Invoice: {'list_select_related': ('customer', 'organization'),
+              'list_display': ('invoice_number', 'customer', 'organization', 'status', 'total_amount')},
+    InvoiceItem: {'list_select_related': ('invoice__customer',),
+                  'list_display': ('description', 'invoice', 'quantity', 'amount')},
+    Vendor: {'list_select_related': ('organization',),
+             'list_display': ('name', 'email', 'organization')},
+    PlaidItem: {'list_select_related': ('organization', 'user'),
+                'list_display': ('institution_name', 'organization', 'user', 'last_successful_sync')},
+    StagedBankTransaction: {'list_select_related': ('organization',),
+                            'list_display': ('name', 'date', 'amount', 'organization', 'reconciliation_status')},
+    ReconciliationRule: {'list_select_related': ('organization',),
+                         'list_display': ('name', 'organization', 'priority', 'is_active')},
+    Employee: {'list_select_related': ('organization',),
+               'list_display': ('__str__', 'email', 'pay_type', 'is_active')},
+    PayRun: {'list_select_related': ('organization',),
+             'list_display': ('__str__', 'payment_date', 'status')},
+    DeductionType: {'list_select_related': ('organization',),
+                    'list_display': ('name', 'organization', 'tax_treatment', 'is_active')},
+    Payslip: {'list_select_related': ('employee__organization', 'pay_run'),
+              'list_display': ('__str__', 'gross_pay', 'total_deductions', 'net_pay')},
+    PayslipDeduction: {'list_select_related': ('deduction_type', 'payslip__employee__organization'),
+                       'list_display': ('__str__', 'amount')},
+}
+
+
+class LedgerProModelAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        # No list column shows the wide text/JSON columns; a change form loads them on first access.
+        queryset = super().get_queryset(request)
+        return queryset.without_bulky() if hasattr(self.model, 'BULKY_FIELDS') else queryset
+
+
+for model, spec in ADMIN_SPECS.items():
+    admin.site.register(model, type(f'{model.__name__}Admin', (LedgerProModelAdmin,), spec))
+
+for model in (Organization, User, Role):
+    admin.site.register(model)
@@ -0,0 +1,42 @@
+import logging
+
+from django.db import transaction as db_transaction
+from rest_framework.request import Request
+
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+
+def queue(request, **fields):
+    '''
+    Records an AuditLog for this request without inserting it on the write path. The row joins the
+    request's batch once the surrounding database transaction commits, so a rolled-back write leaves
+    no audit behind, and AuditLogMiddleware writes the batch in one INSERT. Outside a request the
+    middleware has seen (a shell, a task, a serializer given a stand-in request) it is saved now.
+    '''
+    entry = AuditLog(**fields)
+    http_request = request._request if isinstance(request, Request) else request
+    pending = vars(http_request).get('_audit_queue') if http_request is not None else None
+    if pending is None:
+        entry.save()
+    else:
+        db_transaction.on_commit(lambda: pending.append(entry))
+
+
+class AuditLogMiddleware:
+    '''Gives each request an audit batch for queue() and writes it once the response is ready.'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._audit_queue = []
+        response = self.get_response(request)
+        if request._audit_queue:
+            try:
+                AuditLog.objects.bulk_create(request._audit_queue)
+            except Exception as e:
+                # The audited writes are already committed; failing the response would not undo them.
+                logger.error(f'Failed to write {len(request._audit_queue)} audit log entries for {request.path}: {e}')
+        return response
@@ -1,16 +1,70 @@
 from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+from sendgrid.helpers.mail import Mail, Personalization, Substitution, To
 from django.conf import settings
+from django.db.models import Prefetch
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from markupsafe import escape
+from itertools import islice
+from pathlib import Path
+from collections import defaultdict
+import asyncio
+import httpx
 import logging
+from .models import Invoice, InvoiceItem
 
 logger = logging.getLogger(__name__)
 
+# SendGrid accepts up to 1000 personalizations per request; 200 keeps payloads small.
+BULK_EMAIL_BATCH_SIZE = 200
+# Requests in flight at once during a bulk send; also the size of the async client's connection pool.
+BULK_EMAIL_MAX_CONCURRENCY = 64
+SENDGRID_MAIL_SEND_URL = 'https://api.sendgrid.com/v3/mail/send'
+SENDGRID_REQUEST_TIMEOUT = 30
+# Each personalization gets its own pre-rendered body through this substitution tag.
+HTML_BODY_SUBSTITUTION_TAG = '-html_body-'
+# SendGrid rejects personalizations whose substitutions exceed 10,000 bytes in total.
+MAX_SUBSTITUTION_BYTES = 10000
+# Rows fetched per round-trip when streaming the items of an invoice that wasn't prefetched.
+INVOICE_ITEM_CHUNK_SIZE = 500
+
+# Basic HTML template (very rudimentary), loaded from templates/emails/invoice.html.
+# Items are plain mappings (see INVOICE_EMAIL_ITEM_FIELDS); subscript lookups skip Jinja's getattr-first fallback.
+INVOICE_EMAIL_ITEM_FIELDS = ('description', 'quantity', 'unit_price', 'amount')
+INVOICE_EMAIL_TEMPLATE_NAME = 'emails/invoice.html'
+
+# Compiled once per process; autoescape matches Django's template defaults.
+# The bytecode cache lets recycled workers skip recompiling, and auto_reload=False skips the per-render mtime check.
+_INVOICE_EMAIL_ENV = Environment(
+    loader=FileSystemLoader(Path(__file__).resolve().parent / 'templates'),
+    bytecode_cache=FileSystemBytecodeCache(settings.JINJA_BYTECODE_CACHE_DIR),
+    auto_reload=False,
+    autoescape=True
+)
+_INVOICE_EMAIL_TEMPLATE = _INVOICE_EMAIL_ENV.get_template(INVOICE_EMAIL_TEMPLATE_NAME)
+
+
+# Built lazily and reused by every send; rebuilt only if the configured key changes.
+_SG_CLIENT = None
+_SG_CLIENT_KEY = None
+
+
+def _sg():
+    global _SG_CLIENT, _SG_CLIENT_KEY
+    if _SG_CLIENT is None or _SG_CLIENT_KEY != settings.SENDGRID_API_KEY:
+        _SG_CLIENT = SendGridAPIClient(settings.SENDGRID_API_KEY)
+        _SG_CLIENT_KEY = settings.SENDGRID_API_KEY
+    return _SG_CLIENT
+
+
+def _sendgrid_configured():
+    return bool(settings.SENDGRID_API_KEY) and settings.SENDGRID_API_KEY != 'YOUR_SENDGRID_API_KEY_PLACEHOLDER'
+
 
 def send_email(to_email, subject, html_content, from_email=None):
     if from_email is None:
         from_email = settings.DEFAULT_FROM_EMAIL
 
-    if not settings.SENDGRID_API_KEY or settings.SENDGRID_API_KEY == 'YOUR_SENDGRID_API_KEY_PLACEHOLDER':
+    if not _sendgrid_configured():
         logger.error('SendGrid API Key not configured. Email not sent.')
         # In a real app, you might raise an error or handle this differently.
         # For dev, we might just log and return True to not block flow.
@@ -24,82 +78,266 @@ def send_email(to_email, subject, html_content, from_email=None):
         html_content=html_content
     )
     try:
-        sg = SendGridAPIClient(settings.SENDGRID_API_KEY)
-        response = sg.send(message)
-        logger.info(f'Email sent to {to_email}, status code: {response.status_code}')
+        response = _sg().send(message)
+        logger.info('Email sent to %s, status code: %s', to_email, response.status_code)
         return response.status_code in [200, 202]  # 202 Accepted
     except Exception as e:
-        logger.error(f'Error sending email to {to_email}: {e}')
+        logger.error('Error sending email to %s: %s', to_email, e)
         return False
 
 
-def send_invoice_email(invoice):
+def _sendgrid_async_client():
+    '''Builds the httpx.AsyncClient used for one bulk send; requests go straight to SendGrid's v3 REST endpoint.'''
+    return httpx.AsyncClient(
+        headers={'Authorization': f'Bearer {settings.SENDGRID_API_KEY}'},
+        limits=httpx.Limits(max_connections=BULK_EMAIL_MAX_CONCURRENCY),
+        timeout=SENDGRID_REQUEST_TIMEOUT
+    )
+
+
+async def send_email_async(to_email, subject, html_content, *, client, from_email=None):
+    '''Async counterpart of send_email() for concurrent fan-out; client comes from _sendgrid_async_client().'''
+    if from_email is None:
+        from_email = settings.DEFAULT_FROM_EMAIL
+
+    message = Mail(
+        from_email=from_email,
+        to_emails=to_email,
+        subject=subject,
+        html_content=html_content
+    )
+    try:
+        response = await client.post(SENDGRID_MAIL_SEND_URL, json=message.get())
+        logger.info('Email sent to %s, status code: %s', to_email, response.status_code)
+        return response.status_code in [200, 202]  # 202 Accepted
+    except Exception as e:
+        logger.error('Error sending email to %s: %s', to_email, e)
+        return False
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _build_bulk_mail(batch, from_email):
+    '''Builds one Mail with a Personalization (recipient, subject and body) per message.'''
+    mail = Mail(from_email=from_email, html_content=HTML_BODY_SUBSTITUTION_TAG)
+    for message in batch:
+        personalization = Personalization()
+        personalization.add_to(To(message['to_email']))
+        personalization.subject = message['subject']
+        personalization.add_substitution(Substitution(HTML_BODY_SUBSTITUTION_TAG, message['html_content']))
+        mail.add_personalization(personalization)
+    return mail
+
+
+async def _send_bulk_batch_async(batch, from_email, client):
+    try:
+        response = await client.post(SENDGRID_MAIL_SEND_URL, json=_build_bulk_mail(batch, from_email).get())
+        logger.info('Bulk email batch of %d sent, status code: %s', len(batch), response.status_code)
+        return response.status_code in [200, 202]  # 202 Accepted
+    except Exception as e:
+        logger.error('Error sending bulk email batch of %d: %s', len(batch), e)
+        return False
+
+
+async def _send_bulk_async(singles, batches, from_email):
+    '''Sends every single message and batch concurrently on one connection pool; returns (single_results, batch_results).'''
+    semaphore = asyncio.Semaphore(BULK_EMAIL_MAX_CONCURRENCY)
+
+    async def limited(send):
+        async with semaphore:
+            return await send
+
+    async with _sendgrid_async_client() as client:
+        results = await asyncio.gather(
+            *(limited(send_email_async(m['to_email'], m['subject'], m['html_content'], client=client, from_email=from_email)) for m in singles),
+            *(limited(_send_bulk_batch_async(batch, from_email, client)) for batch in batches)
+        )
+    return results[:len(singles)], results[len(singles):]
+
+
+def send_bulk_email(messages, from_email=None):
+    '''
+    Sends many emails using one SendGrid request per batch of BULK_EMAIL_BATCH_SIZE messages.
+    All requests are issued concurrently from a single event loop rather than a thread each.
+
+    Args:
+        messages (list): Dicts with 'to_email', 'subject' and 'html_content' keys.
+        from_email (str): Sender address, defaults to settings.DEFAULT_FROM_EMAIL.
+
+    Returns:
+        list: One bool per message, in the same order, telling whether it was accepted.
+    '''
+    if from_email is None:
+        from_email = settings.DEFAULT_FROM_EMAIL
+    if not messages:
+        return []
+
+    if not _sendgrid_configured():
+        logger.error('SendGrid API Key not configured. Emails not sent.')
+        for message in messages:
+            logger.info('SIMULATED EMAIL: To: %s, Subject: %s', message['to_email'], message['subject'])
+            logger.debug('SIMULATED EMAIL body for %s:\n%s', message['to_email'], message['html_content'])
+        return [True] * len(messages)  # Simulate success if no key
+
+    results = [False] * len(messages)
+    singles = []
+    batchable = []
+    for index, message in enumerate(messages):
+        if len(message['html_content'].encode('utf-8')) > MAX_SUBSTITUTION_BYTES:
+            # Too large for a substitution; fall back to a dedicated request.
+            singles.append((index, message))
+        else:
+            batchable.append((index, message))
+
+    batches = list(_chunked(batchable, BULK_EMAIL_BATCH_SIZE))
+    single_results, batch_results = asyncio.run(
+        _send_bulk_async([m for _, m in singles], [[m for _, m in batch] for batch in batches], from_email)
+    )
+    for (index, _), sent in zip(singles, single_results):
+        results[index] = sent
+    for batch, sent in zip(batches, batch_results):
+        for index, _ in batch:
+            results[index] = sent
+    return results
+
+
+def prepare_invoices_for_email(queryset, prefetch_items=True):
+    '''
+    Eager-loads everything the invoice email reads (customer, organization and line items),
+    so rendering N invoices costs a fixed number of queries instead of 4N+1.
+
+    With prefetch_items=False the items are streamed in chunks at render time instead, which keeps
+    memory flat for a single very large invoice.
+    '''
+    queryset = queryset.select_related('customer', 'organization').without_bulky()
+    if prefetch_items:
+        queryset = queryset.prefetch_related(Prefetch('items', queryset=InvoiceItem.objects.only('invoice', *INVOICE_EMAIL_ITEM_FIELDS)))
+    return queryset
+
+
+def _iter_invoice_item_rows(invoice):
+    '''Yields the invoice's items as dicts; uses prefetched items when present, otherwise streams them from the DB.'''
+    if 'items' in getattr(invoice, '_prefetched_objects_cache', {}):
+        for item in invoice.items.all():
+            yield {field: getattr(item, field) for field in INVOICE_EMAIL_ITEM_FIELDS}
+    else:
+        # iterator() would ignore a prefetch cache, so it is only used on this path.
+        yield from invoice.items.values(*INVOICE_EMAIL_ITEM_FIELDS).iterator(chunk_size=INVOICE_ITEM_CHUNK_SIZE)
+
+
+def _render_invoice_email(invoice_id, invoice_number, issue_date, due_date, total_amount, customer_name, organization_name, items):
+    '''Renders the subject and HTML body for an invoice email from plain field values; items is an iterable of dicts keyed by INVOICE_EMAIL_ITEM_FIELDS.'''
     # Prepare context for the email template
     # This should match ST-103: Email includes a link to view and pay the invoice online.
     # Payment link is future, for now, just a view link placeholder.
+    # Header strings are escaped once here; the resulting Markup passes through autoescape untouched on each use.
     context = {
-        'invoice': invoice,
-        'customer_name': invoice.customer.name,
-        'invoice_number': invoice.invoice_number,
-        'issue_date': invoice.issue_date.strftime('%Y-%m-%d'),
-        'due_date': invoice.due_date.strftime('%Y-%m-%d'),
-        'total_amount': invoice.total_amount,
-        'items': invoice.items.all(),
-        'organization_name': invoice.organization.name,
-        'view_invoice_url': f'https://app.ledgerpro.example.com/invoices/{invoice.id}'  # Placeholder URL
+        'customer_name': escape(customer_name),
+        'invoice_number': escape(invoice_number),
+        'issue_date': issue_date.strftime('%Y-%m-%d'),
+        'due_date': due_date.strftime('%Y-%m-%d'),
+        'total_amount': total_amount,
+        'items': items,
+        'organization_name': escape(organization_name),
+        'view_invoice_url': f'https://app.ledgerpro.example.com/invoices/{invoice_id}'  # Placeholder URL
     }
 
-    # Render HTML content from a template
-    # For MVP, template is basic and included here.
-    # In a real app, this would be a separate .html file.
-    # Basic HTML template (very rudimentary)
-    html_template_string = """
-    <html>
-        <body>
-            <p>Dear {{ customer_name }},</p>
-            <p>Please find attached your invoice {{ invoice_number }} from {{ organization_name }}.</p>
-            <p><strong>Invoice Summary:</strong></p>
-            <ul>
-                <li>Invoice Number: {{ invoice_number }}</li>
-                <li>Issue Date: {{ issue_date }}</li>
-                <li>Due Date: {{ due_date }}</li>
-                <li>Total Amount: {{ total_amount }}</li>
-            </ul>
-            <p><strong>Items:</strong></p>
-            <table border='1' cellpadding='5' cellspacing='0'>
-                <thead>
-                    <tr><th>Description</th><th>Quantity</th><th>Unit Price</th><th>Amount</th></tr>
-                </thead>
-                <tbody>
-                {% for item in items %}
-                    <tr>
-                        <td>{{ item.description }}</td>
-                        <td>{{ item.quantity }}</td>
-                        <td>{{ item.unit_price }}</td>
-                        <td>{{ item.amount }}</td>
-                    </tr>
-                {% endfor %}
-                </tbody>
-            </table>
-            <p>You can view the invoice online here: <a href='{{ view_invoice_url }}'>View Invoice</a></p>
-            <p>Thank you for your business!</p>
-            <p>Sincerely,<br/>The {{ organization_name }} Team</p>
-        </body>
-    </html>
-    """
-    # Using Django's template rendering for the string
-    from django.template import Context, Template
-    template = Template(html_template_string)
-    html_content = template.render(Context(context))
-
-    subject = f'Invoice {invoice.invoice_number} from {invoice.organization.name}'
-
-    if not invoice.customer.email:
-        logger.warning(f'Customer {invoice.customer.name} has no email address. Invoice {invoice.invoice_number} not sent.')
-        return False
+    # Rendered in a single pass, so items may be a one-shot iterator.
+    html_content = ''.join(_INVOICE_EMAIL_TEMPLATE.generate(**context))
 
-    return send_email(
-        to_email=invoice.customer.email,
-        subject=subject,
-        html_content=html_content
+    subject = f'Invoice {invoice_number} from {organization_name}'
+    return subject, html_content
+
+
+def _build_invoice_email(invoice):
+    '''Renders the subject and HTML body for an invoice email.'''
+    return _render_invoice_email(
+        invoice.id, invoice.invoice_number, invoice.issue_date, invoice.due_date, invoice.total_amount,
+        invoice.customer.name, invoice.organization.name, _iter_invoice_item_rows(invoice)
+    )
+
+
+def iter_invoice_email_payloads(invoice_ids):
+    '''
+    Yields one send_bulk_email() message dict (plus 'invoice_id') per invoice, built from .values() rows.
+    Invoices whose customer has no email are yielded with subject and html_content set to None, unrendered.
+
+    Uses two queries in total (invoices joined to customer/organization, then all their items) and
+    never instantiates model objects, which keeps large bulk sends cheap.
+    '''
+    invoice_ids = list(invoice_ids)
+    items_by_invoice = defaultdict(list)
+    item_rows = InvoiceItem.objects.filter(invoice_id__in=invoice_ids).values('invoice_id', *INVOICE_EMAIL_ITEM_FIELDS)
+    # iterator() skips the queryset result cache, so the rows are held once, in items_by_invoice.
+    for item in item_rows.iterator(chunk_size=INVOICE_ITEM_CHUNK_SIZE):
+        items_by_invoice[item['invoice_id']].append(item)
+
+    invoice_rows = Invoice.objects.filter(id__in=invoice_ids).values(
+        'id', 'invoice_number', 'issue_date', 'due_date', 'total_amount',
+        'customer__name', 'customer__email', 'organization__name'
     )
+    for row in invoice_rows:
+        if not row['customer__email']:
+            yield {'invoice_id': row['id'], 'to_email': row['customer__email'], 'subject': None, 'html_content': None}
+            continue
+        subject, html_content = _render_invoice_email(
+            row['id'], row['invoice_number'], row['issue_date'], row['due_date'], row['total_amount'],
+            row['customer__name'], row['organization__name'], items_by_invoice[row['id']]
+        )
+        yield {'invoice_id': row['id'], 'to_email': row['customer__email'], 'subject': subject, 'html_content': html_content}
+
+
+def send_invoice_emails_by_id(invoice_ids):
+    '''
+    Bulk-sends invoice emails by id without loading model instances.
+
+    Returns a dict mapping invoice id to whether its email was accepted; invoices whose customer
+    has no email are reported as False.
+    '''
+    results = {}
+    messages = []
+    for payload in iter_invoice_email_payloads(invoice_ids):
+        if not payload['to_email']:
+            logger.warning('Invoice %s customer has no email address. Invoice not sent.', payload['invoice_id'])
+            results[payload['invoice_id']] = False
+            continue
+        messages.append(payload)
+
+    for message, sent in zip(messages, send_bulk_email(messages)):
+        results[message['invoice_id']] = sent
+    return results
+
+
+def send_invoice_emails_bulk(invoices):
+    '''
+    Sends invoice emails for many invoices, batching them into as few SendGrid requests as possible.
+
+    invoices should come from prepare_invoices_for_email() to avoid per-invoice queries.
+    Returns a list with one bool per invoice; invoices whose customer has no email are not sent.
+    '''
+    invoices = list(invoices)
+    results = [False] * len(invoices)
+    messages = []
+    message_indexes = []
+    for index, invoice in enumerate(invoices):
+        # Checked before rendering so invoices that can't be sent cost no template work.
+        if not invoice.customer.email:
+            logger.warning('Customer %s has no email address. Invoice %s not sent.', invoice.customer.name, invoice.invoice_number)
+            continue
+
+        subject, html_content = _build_invoice_email(invoice)
+        messages.append({'to_email': invoice.customer.email, 'subject': subject, 'html_content': html_content})
+        message_indexes.append(index)
+
+    for index, sent in zip(message_indexes, send_bulk_email(messages)):
+        results[index] = sent
+    return results
+
+
+def send_invoice_email(invoice):
+    '''Sends a single invoice email. The invoice should be loaded via prepare_invoices_for_email().'''
+    return send_invoice_emails_bulk([invoice])[0]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.2 on 2026-10-14 19:30
+
+from django.db import migrations, models
+
+
+# Django compiles name__icontains to UPPER("name") LIKE UPPER(...) on PostgreSQL,
+# so the trigram index is built on that expression. Other backends skip it.
+def create_account_name_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS acct_name_trgm ON api_account USING gin (UPPER(name) gin_trgm_ops)')
+
+
+def drop_account_name_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS acct_name_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='user',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['organization', 'type', 'is_active', 'name'], name='acct_org_type_act_name'),
+        ),
+        migrations.RunPython(create_account_name_trigram_index, drop_account_name_trigram_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.2 on 2026-10-15 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_account_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='journalentry',
+            index=models.Index(fields=['account', 'transaction'], name='je_account_txn'),
+        ),
+    ]
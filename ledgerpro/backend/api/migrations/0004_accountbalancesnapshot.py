@@ -0,0 +1,55 @@
+# Generated by Django 5.2.2 on 2026-10-15 10:05
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+# Builds the running totals for entries that predate the snapshot signals.
+def backfill_account_balance_snapshots(apps, schema_editor):
+    JournalEntry = apps.get_model('api', 'JournalEntry')
+    AccountBalanceSnapshot = apps.get_model('api', 'AccountBalanceSnapshot')
+    daily_totals = (
+        JournalEntry.objects
+        .values('account_id', 'transaction__date')
+        .annotate(debit=Sum('debit_amount'), credit=Sum('credit_amount'))
+        .order_by('account_id', 'transaction__date')
+    )
+    snapshots = []
+    account_id, running_debit, running_credit = None, Decimal('0.00'), Decimal('0.00')
+    for row in daily_totals:
+        if row['account_id'] != account_id:
+            account_id, running_debit, running_credit = row['account_id'], Decimal('0.00'), Decimal('0.00')
+        running_debit += row['debit'] or Decimal('0.00')
+        running_credit += row['credit'] or Decimal('0.00')
+        snapshots.append(AccountBalanceSnapshot(
+            account_id=account_id, as_of_date=row['transaction__date'],
+            running_debit=running_debit, running_credit=running_credit
+        ))
+    AccountBalanceSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_journalentry_account_txn_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of_date', models.DateField()),
+                ('running_debit', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=19)),
+                ('running_credit', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=19)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='api.account')),
+            ],
+            options={
+                'unique_together': {('account', 'as_of_date')},
+            },
+        ),
+        migrations.RunPython(backfill_account_balance_snapshots, migrations.RunPython.noop),
+    ]
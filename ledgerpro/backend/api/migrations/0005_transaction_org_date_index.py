@@ -0,0 +1,25 @@
+# Generated by Django 5.2.2 on 2026-10-15 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_accountbalancesnapshot'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='journalentry',
+            name='je_account_txn',
+        ),
+        migrations.AddIndex(
+            model_name='journalentry',
+            index=models.Index(fields=['account', 'transaction'], include=['debit_amount', 'credit_amount'], name='je_account_txn'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['organization', 'date'], name='txn_org_date'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.2 on 2026-10-15 11:48
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_transaction_org_date_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoiceitem',
+            name='id',
+            field=models.UUIDField(default=api.models.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='journalentry',
+            name='id',
+            field=models.UUIDField(default=api.models.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='payslip',
+            name='id',
+            field=models.UUIDField(default=api.models.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='payslipdeduction',
+            name='id',
+            field=models.UUIDField(default=api.models.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='stagedbanktransaction',
+            name='id',
+            field=models.UUIDField(default=api.models.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.2 on 2026-10-15 12:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_transaction_organization(apps, schema_editor):
+    JournalEntry = apps.get_model('api', 'JournalEntry')
+    Transaction = apps.get_model('api', 'Transaction')
+    JournalEntry.objects.update(
+        organization_id=Subquery(Transaction.objects.filter(pk=OuterRef('transaction_id')).values('organization_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_time_ordered_uuid_pks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journalentry',
+            name='organization',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='journal_entries', to='api.organization'),
+        ),
+        migrations.RunPython(copy_transaction_organization, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='journalentry',
+            name='organization',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='journal_entries', to='api.organization'),
+        ),
+        migrations.AddIndex(
+            model_name='journalentry',
+            index=models.Index(fields=['organization', 'account'], name='je_org_account'),
+        ),
+    ]
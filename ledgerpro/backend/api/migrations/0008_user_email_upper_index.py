@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-15 12:52
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_journalentry_organization'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.db.models.functions.text.Upper('email'), name='user_email_upper'),
+        ),
+    ]
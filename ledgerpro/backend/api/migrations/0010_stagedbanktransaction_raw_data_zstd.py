@@ -0,0 +1,52 @@
+# Generated by Django 5.2.2 on 2026-10-15 13:45
+
+import json
+
+import zstandard
+from django.db import migrations, models
+
+
+def compress_raw_data(apps, schema_editor):
+    StagedBankTransaction = apps.get_model('api', 'StagedBankTransaction')
+    compressor = zstandard.ZstdCompressor(level=3)
+    batch = []
+    for staged in StagedBankTransaction.objects.exclude(raw_data=None).only('pk', 'raw_data').iterator(chunk_size=1000):
+        staged.raw_data_zstd = compressor.compress(json.dumps(staged.raw_data).encode())
+        batch.append(staged)
+        if len(batch) == 1000:
+            StagedBankTransaction.objects.bulk_update(batch, ['raw_data_zstd'])
+            batch = []
+    StagedBankTransaction.objects.bulk_update(batch, ['raw_data_zstd'])
+
+
+def decompress_raw_data(apps, schema_editor):
+    StagedBankTransaction = apps.get_model('api', 'StagedBankTransaction')
+    decompressor = zstandard.ZstdDecompressor()
+    batch = []
+    for staged in StagedBankTransaction.objects.exclude(raw_data_zstd=None).only('pk', 'raw_data_zstd').iterator(chunk_size=1000):
+        staged.raw_data = json.loads(decompressor.decompress(bytes(staged.raw_data_zstd)))
+        batch.append(staged)
+        if len(batch) == 1000:
+            StagedBankTransaction.objects.bulk_update(batch, ['raw_data'])
+            batch = []
+    StagedBankTransaction.objects.bulk_update(batch, ['raw_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_journalentry_amount_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stagedbanktransaction',
+            name='raw_data_zstd',
+            field=models.BinaryField(blank=True, editable=False, help_text='Raw data from Plaid or CSV for auditing/debugging, zstd-compressed JSON', null=True),
+        ),
+        migrations.RunPython(compress_raw_data, decompress_raw_data),
+        migrations.RemoveField(
+            model_name='stagedbanktransaction',
+            name='raw_data',
+        ),
+    ]
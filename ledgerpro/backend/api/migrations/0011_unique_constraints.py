@@ -0,0 +1,93 @@
+# Generated by Django 5.2.2 on 2026-10-15 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_stagedbanktransaction_raw_data_zstd'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='membership',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='account',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='accountbalancesnapshot',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='customer',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='invoice',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='vendor',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stagedbanktransaction',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='employee',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='deductiontype',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='payslip',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='membership',
+            constraint=models.UniqueConstraint(fields=('user', 'organization'), name='uq_membership_user_org'),
+        ),
+        migrations.AddConstraint(
+            model_name='account',
+            constraint=models.UniqueConstraint(fields=('organization', 'name', 'type'), name='uq_account_org_name_type'),
+        ),
+        migrations.AddConstraint(
+            model_name='accountbalancesnapshot',
+            constraint=models.UniqueConstraint(fields=('account', 'as_of_date'), include=('running_debit', 'running_credit'), name='uq_snapshot_account_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='customer',
+            constraint=models.UniqueConstraint(fields=('organization', 'name'), name='uq_customer_org_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='invoice',
+            constraint=models.UniqueConstraint(fields=('organization', 'invoice_number'), name='uq_invoice_number'),
+        ),
+        migrations.AddConstraint(
+            model_name='vendor',
+            constraint=models.UniqueConstraint(fields=('organization', 'name'), name='uq_vendor_org_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='stagedbanktransaction',
+            constraint=models.UniqueConstraint(fields=('organization', 'transaction_id_source'), name='uq_staged_txn_source_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='employee',
+            constraint=models.UniqueConstraint(fields=('organization', 'email'), name='uq_employee_org_email'),
+        ),
+        migrations.AddConstraint(
+            model_name='deductiontype',
+            constraint=models.UniqueConstraint(fields=('organization', 'name'), name='uq_deduction_type_org_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='payslip',
+            constraint=models.UniqueConstraint(fields=('pay_run', 'employee'), name='uq_payslip_run_employee'),
+        ),
+    ]
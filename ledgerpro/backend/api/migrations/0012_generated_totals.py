@@ -0,0 +1,41 @@
+# Generated by Django 5.2.2 on 2026-10-15 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_unique_constraints'),
+    ]
+
+    # A column can't be altered into a generated one; each is dropped and re-added, and the database fills it in.
+    operations = [
+        migrations.RemoveField(
+            model_name='invoice',
+            name='total_amount',
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='total_amount',
+            field=models.GeneratedField(db_persist=True, expression=models.F('subtotal') + models.F('total_tax'), output_field=models.DecimalField(decimal_places=2, max_digits=19)),
+        ),
+        migrations.RemoveField(
+            model_name='invoiceitem',
+            name='amount',
+        ),
+        migrations.AddField(
+            model_name='invoiceitem',
+            name='amount',
+            field=models.GeneratedField(db_persist=True, expression=models.F('quantity') * models.F('unit_price'), output_field=models.DecimalField(decimal_places=2, max_digits=19)),
+        ),
+        migrations.RemoveField(
+            model_name='payslip',
+            name='net_pay',
+        ),
+        migrations.AddField(
+            model_name='payslip',
+            name='net_pay',
+            field=models.GeneratedField(db_persist=True, expression=models.F('gross_pay') - models.F('total_deductions'), output_field=models.DecimalField(decimal_places=2, max_digits=19)),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.2 on 2026-10-15 15:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_transaction_date(apps, schema_editor):
+    JournalEntry = apps.get_model('api', 'JournalEntry')
+    Transaction = apps.get_model('api', 'Transaction')
+    JournalEntry.objects.update(
+        transaction_date=Subquery(Transaction.objects.filter(pk=OuterRef('transaction_id')).values('date')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_generated_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journalentry',
+            name='transaction_date',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.RunPython(copy_transaction_date, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='journalentry',
+            name='transaction_date',
+            field=models.DateField(editable=False),
+        ),
+        migrations.RemoveIndex(
+            model_name='journalentry',
+            name='je_account_txn',
+        ),
+        migrations.AddIndex(
+            model_name='journalentry',
+            index=models.Index(fields=['account', 'transaction_date'], include=['debit_amount', 'credit_amount'], name='je_account_date'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.2 on 2026-10-15 15:40
+
+from django.db import migrations
+
+
+# Every transaction's journal entries must net to zero. The check is a deferred constraint
+# trigger, so it runs once per touched row at COMMIT, after all of a transaction's entries
+# are in place. PostgreSQL only; other backends rely on the application-side checks.
+CREATE_BALANCE_TRIGGER = '''
+CREATE OR REPLACE FUNCTION api_journalentry_check_balanced() RETURNS trigger AS $$
+DECLARE
+    txn_id uuid;
+    difference numeric;
+BEGIN
+    FOREACH txn_id IN ARRAY (CASE TG_OP
+        WHEN 'INSERT' THEN ARRAY[NEW.transaction_id]
+        WHEN 'DELETE' THEN ARRAY[OLD.transaction_id]
+        ELSE ARRAY[OLD.transaction_id, NEW.transaction_id]
+    END) LOOP
+        SELECT COALESCE(SUM(debit_amount), 0) - COALESCE(SUM(credit_amount), 0) INTO difference
+        FROM api_journalentry WHERE transaction_id = txn_id;
+        IF difference <> 0 THEN
+            RAISE EXCEPTION 'Transaction % is unbalanced: debits exceed credits by %', txn_id, difference
+                USING ERRCODE = 'check_violation';
+        END IF;
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE CONSTRAINT TRIGGER je_transaction_balanced
+    AFTER INSERT OR UPDATE OF transaction_id, debit_amount, credit_amount OR DELETE ON api_journalentry
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION api_journalentry_check_balanced();
+'''
+
+DROP_BALANCE_TRIGGER = '''
+DROP TRIGGER IF EXISTS je_transaction_balanced ON api_journalentry;
+DROP FUNCTION IF EXISTS api_journalentry_check_balanced();
+'''
+
+
+def create_balance_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(CREATE_BALANCE_TRIGGER, params=None)  # No params: the SQL's % signs are PL/pgSQL, not placeholders
+
+
+def drop_balance_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(DROP_BALANCE_TRIGGER, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_journalentry_transaction_date'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_balance_trigger, drop_balance_trigger),
+    ]
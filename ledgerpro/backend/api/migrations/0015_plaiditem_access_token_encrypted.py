@@ -0,0 +1,48 @@
+# Generated by Django 5.2.2 on 2026-10-15 16:20
+
+from django.db import migrations, models
+
+import api.models
+
+
+def encrypt_access_tokens(apps, schema_editor):
+    PlaidItem = apps.get_model('api', 'PlaidItem')
+    items = list(PlaidItem.objects.only('pk', 'item_id', 'access_token'))
+    for item in items:
+        item.access_token_encrypted = api.models.encrypt_token(item.access_token, item.item_id)
+    PlaidItem.objects.bulk_update(items, ['access_token_encrypted'], batch_size=1000)
+
+
+def decrypt_access_tokens(apps, schema_editor):
+    PlaidItem = apps.get_model('api', 'PlaidItem')
+    items = list(PlaidItem.objects.only('pk', 'item_id', 'access_token_encrypted'))
+    for item in items:
+        item.access_token = api.models.decrypt_token(item.access_token_encrypted, item.item_id)
+    PlaidItem.objects.bulk_update(items, ['access_token'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_journalentry_balance_trigger'),
+    ]
+
+    operations = [
+        # Nullable and non-unique while both columns exist, so the migration also reverses cleanly.
+        migrations.AlterField(
+            model_name='plaiditem',
+            name='access_token',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='plaiditem',
+            name='access_token_encrypted',
+            field=models.TextField(default='', editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(encrypt_access_tokens, decrypt_access_tokens),
+        migrations.RemoveField(
+            model_name='plaiditem',
+            name='access_token',
+        ),
+    ]
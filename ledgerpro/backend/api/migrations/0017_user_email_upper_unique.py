@@ -0,0 +1,22 @@
+# Generated by Django 5.2.2 on 2026-10-15 17:10
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_plaiditem_access_token_encrypted'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='user',
+            name='user_email_upper',
+        ),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Upper('email'), name='user_email_upper_unique'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.2 on 2026-10-15 19:20
+
+import django.db.models.functions.math
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_user_email_upper_unique'),
+    ]
+
+    # A generated column's expression can't be altered; it is dropped and re-added, and the database fills it in.
+    operations = [
+        migrations.RemoveField(
+            model_name='invoiceitem',
+            name='amount',
+        ),
+        migrations.AddField(
+            model_name='invoiceitem',
+            name='amount',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.math.Round(models.F('quantity') * models.F('unit_price'), 2), output_field=models.DecimalField(decimal_places=2, max_digits=19)),
+        ),
+    ]
@@ -1,12 +1,85 @@
-from django.db import models
+from django.db import models, transaction as db_transaction
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.conf import settings
-from django.db.models import Sum, Q
+from django.db.models import F, Prefetch, Sum, Q
+from django.db.models.functions import Round, Upper
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+import base64
+import functools
+import json
+import os
+import time
 import uuid
+import zstandard
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from collections import defaultdict
 from decimal import Decimal  # Added for get_period_activity
 
 
+def uuid7():
+    '''
+    Time-ordered UUID (RFC 9562 version 7): a 48-bit Unix millisecond timestamp followed by random bits.
+    Used as the primary key default on high-insert tables so new rows land at the right edge of the index.
+    '''
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = (value & ~(0xF << 76)) | (0x7 << 76)  # version
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)  # RFC 4122 variant
+    return uuid.UUID(int=value)
+
+
+# Money columns are DecimalField(max_digits=19, decimal_places=2). PostgreSQL stores a numeric by the digits
+# the value actually has, not by its declared precision, so a smaller max_digits would not narrow any row.
+def to_cents(amount):
+    '''Converts a money amount with at most two decimal places to integer cents, for summing many amounts as ints.'''
+    return int(amount * 100)
+
+
+def from_cents(cents):
+    '''Converts integer cents back to a two-place Decimal.'''
+    return Decimal(cents).scaleb(-2)
+
+
+def pack_json(payload):
+    '''Serializes payload to zstd-compressed JSON for write-mostly audit blobs; None stays None.'''
+    if payload is None:
+        return None
+    return zstandard.ZstdCompressor(level=3).compress(json.dumps(payload, cls=DjangoJSONEncoder).encode())
+
+
+def unpack_json(blob):
+    if blob is None:
+        return None
+    return json.loads(zstandard.ZstdDecompressor().decompress(bytes(blob)))
+
+
+@functools.lru_cache(maxsize=2)
+def _token_cipher(key):
+    return AESGCM(base64.b64decode(key))
+
+
+def encrypt_token(token, associated_data):
+    '''AES-GCM encrypts a secret under PLAID_TOKEN_KEY; returns base64(nonce + ciphertext), bound to associated_data.'''
+    nonce = os.urandom(12)
+    ciphertext = _token_cipher(settings.PLAID_TOKEN_KEY).encrypt(nonce, token.encode(), associated_data.encode())
+    return base64.b64encode(nonce + ciphertext).decode()
+
+
+def decrypt_token(sealed, associated_data):
+    raw = base64.b64decode(sealed)
+    return _token_cipher(settings.PLAID_TOKEN_KEY).decrypt(raw[:12], raw[12:], associated_data.encode()).decode()
+
+
+class DisplayQuerySet(models.QuerySet):
+    def with_display(self):
+        '''Joins the relations the model's __str__ reads (its DISPLAY_RELATED), so listing rows doesn't cost a query each.'''
+        return self.select_related(*self.model.DISPLAY_RELATED)
+
+    def without_bulky(self):
+        '''Defers the model's wide text/JSON columns (its BULKY_FIELDS), for code paths that never read them.'''
+        return self.defer(*self.model.BULKY_FIELDS)
+
+
 class Organization(models.Model):
     """Represents a business entity using LedgerPro."""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -75,6 +148,11 @@ class User(AbstractUser):
         return self.email
 
     class Meta:
+        constraints = [
+            # Foo@x.com and foo@x.com are the same mailbox. Also backs email__iexact lookups, which
+            # compile to UPPER("email") = UPPER(...) on PostgreSQL.
+            models.UniqueConstraint(Upper('email'), name='user_email_upper_unique'),
+        ]
         app_label = 'api'
 
 
@@ -83,9 +161,11 @@ class Membership(models.Model):
     organization = models.ForeignKey(Organization, on_delete=models.CASCADE)
     role = models.ForeignKey(Role, on_delete=models.SET_NULL, null=True, blank=True)
     date_joined = models.DateField(auto_now_add=True)
+    DISPLAY_RELATED = ('user', 'organization', 'role')
+    objects = DisplayQuerySet.as_manager()
 
     class Meta:
-        unique_together = ('user', 'organization')
+        constraints = [models.UniqueConstraint(fields=['user', 'organization'], name='uq_membership_user_org')]
         app_label = 'api'
 
     def __str__(self):
@@ -112,41 +192,47 @@ class Account(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        unique_together = ('organization', 'name', 'type')
+        constraints = [models.UniqueConstraint(fields=['organization', 'name', 'type'], name='uq_account_org_name_type')]
+        indexes = [
+            # Default-account lookups filter on all four columns (see account_utils).
+            models.Index(fields=['organization', 'type', 'is_active', 'name'], name='acct_org_type_act_name'),
+        ]
         app_label = 'api'
 
     def __str__(self):
         return f'{self.name} ({self.get_type_display()})'
 
     def get_balance(self, date_to=None):
-        debit_sum = self.journal_entries.filter(
-            Q(transaction__date__lte=date_to) if date_to else Q()
-        ).aggregate(total=Sum('debit_amount'))['total'] or Decimal('0.00')
-        credit_sum = self.journal_entries.filter(
-            Q(transaction__date__lte=date_to) if date_to else Q()
-        ).aggregate(total=Sum('credit_amount'))['total'] or Decimal('0.00')
+        '''
+        Balance as of date_to (or now), read from the running-total snapshots. They are kept up to date by
+        JournalEntry and Transaction save/delete signals and JournalEntry.bulk_create_validated(); QuerySet.update()
+        and bulk_update() on JournalEntry bypass both, so amounts or dates changed that way are not reflected here.
+        '''
+        from .account_utils import cached_account_net_debit  # account_utils imports this module
+
+        net_debit = cached_account_net_debit(self.id, date_to, lambda: self._snapshot_net_debit(date_to))
         if self.type in [self.ASSET, self.EXPENSE]:
-            return debit_sum - credit_sum
+            return net_debit
         else:
-            return credit_sum - debit_sum
+            return Decimal('0.00') - net_debit
+
+    def _snapshot_net_debit(self, date_to):
+        # Reads the latest running-total snapshot instead of summing the account's whole history.
+        snapshots = self.balance_snapshots.filter(as_of_date__lte=date_to) if date_to else self.balance_snapshots.all()
+        snapshot = snapshots.order_by('-as_of_date').values('running_debit', 'running_credit').first()
+        return snapshot['running_debit'] - snapshot['running_credit'] if snapshot else Decimal('0.00')
 
     def get_period_activity(self, date_from, date_to):
+        '''One aggregate query per call; for many accounts use reporting_service._period_activity_by_account().'''
         if not (date_from and date_to):
             raise ValueError('Both date_from and date_to are required for period activity.')
-        debits_in_period = self.journal_entries.filter(
-            transaction__date__gte=date_from, transaction__date__lte=date_to
-        ).aggregate(total=Sum('debit_amount'))['total'] or Decimal('0.00')
-        credits_in_period = self.journal_entries.filter(
-            transaction__date__gte=date_from, transaction__date__lte=date_to
-        ).aggregate(total=Sum('credit_amount'))['total'] or Decimal('0.00')
-        if self.type == self.REVENUE:
-            return credits_in_period - debits_in_period
-        elif self.type == self.EXPENSE:
-            return debits_in_period - credits_in_period
-        elif self.type == self.ASSET:
-            return debits_in_period - credits_in_period
-        elif self.type in [self.LIABILITY, self.EQUITY]:
-            return credits_in_period - debits_in_period
+        net_debit = self.journal_entries.filter(
+            transaction_date__gte=date_from, transaction_date__lte=date_to
+        ).aggregate(net=Sum(F('debit_amount') - F('credit_amount')))['net'] or Decimal('0.00')
+        if self.type in [self.ASSET, self.EXPENSE]:
+            return net_debit
+        elif self.type in [self.REVENUE, self.LIABILITY, self.EQUITY]:
+            return Decimal('0.00') - net_debit
         return Decimal('0.00')
 
 
@@ -165,31 +251,54 @@ class Transaction(models.Model):
 
     def clean(self):
         super().clean()
-        if hasattr(self, 'journal_entries_set'):
-            entries = self.journal_entries_set.all()
-            if entries.exists():
-                total_debits = entries.aggregate(total=Sum('debit_amount'))['total'] or Decimal('0.00')
-                total_credits = entries.aggregate(total=Sum('credit_amount'))['total'] or Decimal('0.00')
-                if total_debits != total_credits:
-                    raise ValidationError('Debits must equal Credits for the transaction.')
+        if self._state.adding:
+            return  # No entries can point at an unsaved transaction.
+        # One scalar query; None means the transaction has no entries yet.
+        difference = self.journal_entries_set.aggregate(
+            difference=Sum(F('debit_amount') - F('credit_amount'))
+        )['difference']
+        if difference is not None and difference != Decimal('0.00'):
+            raise ValidationError('Debits must equal Credits for the transaction.')
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
 
     class Meta:
+        indexes = [
+            # Ledger listings and date-bounded reports filter an organization's transactions by date.
+            models.Index(fields=['organization', 'date'], name='txn_org_date'),
+        ]
         app_label = 'api'
 
 
 class JournalEntry(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='journal_entries_set')
+    # Copied from transaction.organization on save so per-organization ledger queries skip the Transaction join.
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='journal_entries', editable=False)
+    # Likewise copied from transaction.date (and kept in step by signals.py) so date-range ledger queries need no join.
+    transaction_date = models.DateField(editable=False)
     account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='journal_entries')
     debit_amount = models.DecimalField(max_digits=19, decimal_places=2, default=Decimal('0.00'))
     credit_amount = models.DecimalField(max_digits=19, decimal_places=2, default=Decimal('0.00'))
     description = models.CharField(max_length=255, blank=True, null=True)
+    DISPLAY_RELATED = ('account', 'transaction')
+    objects = DisplayQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = 'Journal Entries'
+        indexes = [
+            # Account activity sums an account's entries over a date range;
+            # on PostgreSQL the amounts are included so the sums are read from the index alone.
+            models.Index(fields=['account', 'transaction_date'], include=['debit_amount', 'credit_amount'], name='je_account_date'),
+            models.Index(fields=['organization', 'account'], name='je_org_account'),
+        ]
+        # The same rules as clean(), enforced by the database so save() and bulk_create() need not re-check them.
+        constraints = [
+            models.CheckConstraint(condition=Q(debit_amount__gte=0) & Q(credit_amount__gte=0), name='je_nonneg'),
+            models.CheckConstraint(condition=~(Q(debit_amount__gt=0) & Q(credit_amount__gt=0)), name='je_not_both'),
+            models.CheckConstraint(condition=Q(debit_amount__gt=0) | Q(credit_amount__gt=0), name='je_one_nonzero'),
+        ]
         app_label = 'api'
 
     def __str__(self):
@@ -207,9 +316,59 @@ class JournalEntry(models.Model):
             raise ValidationError('Either debit or credit amount must be provided.')
 
     def save(self, *args, **kwargs):
-        self.clean()
+        self.organization_id = self.transaction.organization_id
+        self.transaction_date = self.transaction.date
         super().save(*args, **kwargs)
 
+    @classmethod
+    def bulk_create_validated(cls, entries, batch_size=1000):
+        '''
+        Creates many entries in batched INSERTs, validating them all before anything is written.
+        bulk_create() skips save() and its signals, so the balance snapshots are updated here,
+        once per (account, date) instead of once per entry. Entries need their transaction set as an instance.
+        '''
+        from .account_utils import apply_journal_entry_to_snapshots  # account_utils imports this module
+
+        entries = list(entries)
+        for entry in entries:
+            entry.clean()
+            entry.organization_id = entry.transaction.organization_id
+            entry.transaction_date = entry.transaction.date
+        # Summed as integer cents; converted back once per (account, date).
+        deltas = defaultdict(lambda: [0, 0])
+        for entry in entries:
+            delta = deltas[(entry.account_id, entry.transaction_date)]
+            delta[0] += to_cents(entry.debit_amount)
+            delta[1] += to_cents(entry.credit_amount)
+        with db_transaction.atomic():
+            created = cls.objects.bulk_create(entries, batch_size=batch_size)
+            # Accounts are locked in one order for every writer, so two concurrent batches can't deadlock.
+            for (account_id, entry_date), (debit_cents, credit_cents) in sorted(deltas.items()):
+                apply_journal_entry_to_snapshots(account_id, entry_date, from_cents(debit_cents), from_cents(credit_cents))
+        return created
+
+
+class AccountBalanceSnapshot(models.Model):
+    '''
+    Running debit/credit totals of an account up to and including as_of_date.
+    There is one row per account for every date with journal activity; it is kept current by the
+    JournalEntry and Transaction signals (see account_utils.apply_journal_entry_to_snapshots).
+    '''
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='balance_snapshots')
+    as_of_date = models.DateField()
+    running_debit = models.DecimalField(max_digits=19, decimal_places=2, default=Decimal('0.00'))
+    running_credit = models.DecimalField(max_digits=19, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        constraints = [
+            # get_balance() reads the running totals of the latest snapshot; on PostgreSQL they come from the index alone.
+            models.UniqueConstraint(fields=['account', 'as_of_date'], include=['running_debit', 'running_credit'], name='uq_snapshot_account_date'),
+        ]
+        app_label = 'api'
+
+    def __str__(self):
+        return f'{self.account.name} as of {self.as_of_date}: Dr {self.running_debit} / Cr {self.running_credit}'
+
 
 class AuditLog(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
@@ -217,6 +376,9 @@ class AuditLog(models.Model):
     action = models.CharField(max_length=255)
     timestamp = models.DateTimeField(auto_now_add=True)
     details = models.JSONField(blank=True, null=True)
+    DISPLAY_RELATED = ('user',)
+    BULKY_FIELDS = ('details',)
+    objects = DisplayQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.action} by {self.user.email if self.user else "System"} at {self.timestamp}'
@@ -235,7 +397,7 @@ class Customer(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        unique_together = ('organization', 'name')
+        constraints = [models.UniqueConstraint(fields=['organization', 'name'], name='uq_customer_org_name')]
         ordering = ['name']
         app_label = 'api'
 
@@ -261,42 +423,96 @@ class Invoice(models.Model):
     notes = models.TextField(blank=True, null=True)
     subtotal = models.DecimalField(max_digits=19, decimal_places=2, default=Decimal('0.00'))
     total_tax = models.DecimalField(max_digits=19, decimal_places=2, default=Decimal('0.00'))
-    total_amount = models.DecimalField(max_digits=19, decimal_places=2, default=Decimal('0.00'))
+    total_amount = models.GeneratedField(
+        expression=F('subtotal') + F('total_tax'),
+        output_field=models.DecimalField(max_digits=19, decimal_places=2),
+        db_persist=True,
+    )
     transaction = models.OneToOneField(
         Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='invoice_origin'
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='created_invoices')
+    DISPLAY_RELATED = ('customer',)
+    BULKY_FIELDS = ('notes',)
+    objects = DisplayQuerySet.as_manager()
 
     class Meta:
-        unique_together = ('organization', 'invoice_number')
+        constraints = [models.UniqueConstraint(fields=['organization', 'invoice_number'], name='uq_invoice_number')]
         ordering = ['-issue_date', '-invoice_number']
         app_label = 'api'
 
     def __str__(self):
         return f'Invoice {self.invoice_number} for {self.customer.name}'
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # The database computes total_amount on write; drop the in-memory copy so the next read reloads it.
+        self.__dict__.pop('total_amount', None)
+
     def calculate_totals(self):
-        items = self.items.all()
-        self.subtotal = sum(item.amount for item in items if item.amount is not None)
-        self.total_tax = sum(item.tax_amount for item in items if item.tax_amount is not None)
-        self.total_amount = self.subtotal + self.total_tax
+        if 'items' in getattr(self, '_prefetched_objects_cache', {}):
+            # Already in memory (the invoice views prefetch them), so summed here without a query.
+            items = self.items.all()
+            self.subtotal = sum((item.amount for item in items), Decimal('0.00'))
+            self.total_tax = sum((item.tax_amount for item in items), Decimal('0.00'))
+            return
+        # Summed in the database; the items themselves are never loaded.
+        totals = self.items.aggregate(subtotal=Sum('amount'), total_tax=Sum('tax_amount'))
+        self.subtotal = totals['subtotal'] or Decimal('0.00')
+        self.total_tax = totals['total_tax'] or Decimal('0.00')
 
 
 class InvoiceItem(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='items')
     description = models.CharField(max_length=255)
     quantity = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('1.00'))
     unit_price = models.DecimalField(max_digits=19, decimal_places=2)
-    amount = models.DecimalField(max_digits=19, decimal_places=2)
+    # Rounded to cents by the database's ROUND(), which takes halves away from zero (0.50 x 0.25 = 0.125 -> 0.13).
+    # Before this was a generated column, Django's save() rounded halves to even.
+    amount = models.GeneratedField(
+        expression=Round(F('quantity') * F('unit_price'), 2),
+        output_field=models.DecimalField(max_digits=19, decimal_places=2),
+        db_persist=True,
+    )
     tax_amount = models.DecimalField(max_digits=19, decimal_places=2, default=Decimal('0.00'))
 
-    def save(self, *args, **kwargs):
-        if self.quantity is not None and self.unit_price is not None:
-            self.amount = self.quantity * self.unit_price
-        super().save(*args, **kwargs)
+    EDITABLE_FIELDS = ('description', 'quantity', 'unit_price', 'tax_amount')
+
+    @classmethod
+    def bulk_create_for_invoice(cls, invoice, rows, batch_size=1000):
+        '''Creates an invoice's items from dicts of field values in batched INSERTs.'''
+        return cls.objects.bulk_create([cls(invoice=invoice, **row) for row in rows], batch_size=batch_size)
+
+    @classmethod
+    def replace_for_invoice(cls, invoice, rows, batch_size=1000):
+        '''
+        Makes an invoice's items match dicts of field values. A row carrying the id of one of the invoice's
+        items updates that item (only if a value differs), other rows are inserted, and items no row names
+        are deleted, so unchanged items keep their ids and cost no writes.
+        '''
+        existing = {item.id: item for item in invoice.items.all()}
+        to_create = []
+        to_update = []
+        for row in rows:
+            row = dict(row)
+            item = existing.pop(row.pop('id', None), None)
+            if item is None:
+                to_create.append(cls(invoice=invoice, **row))
+                continue
+            # Like a re-created item, one whose row leaves a field out gets the field's default.
+            values = {field: row[field] if field in row else cls._meta.get_field(field).get_default() for field in cls.EDITABLE_FIELDS}
+            if any(getattr(item, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(item, field, value)
+                to_update.append(item)
+        if existing:
+            cls.objects.filter(pk__in=existing).delete()
+        if to_update:
+            cls.objects.bulk_update(to_update, cls.EDITABLE_FIELDS, batch_size=batch_size)
+        cls.objects.bulk_create(to_create, batch_size=batch_size)
 
     def __str__(self):
         return f'{self.description} (Qty: {self.quantity})'
@@ -315,7 +531,7 @@ class Vendor(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        unique_together = ('organization', 'name')
+        constraints = [models.UniqueConstraint(fields=['organization', 'name'], name='uq_vendor_org_name')]
         ordering = ['name']
         app_label = 'api'
 
@@ -327,7 +543,8 @@ class PlaidItem(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='plaid_items')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, help_text='User who linked this item')
-    access_token = models.CharField(max_length=255, unique=True)
+    # Encrypted at rest and bound to item_id; use the access_token property.
+    access_token_encrypted = models.TextField(editable=False)
     item_id = models.CharField(max_length=255, unique=True)
     institution_id = models.CharField(max_length=255, blank=True, null=True)
     institution_name = models.CharField(max_length=255, blank=True, null=True)
@@ -339,6 +556,14 @@ class PlaidItem(models.Model):
     def __str__(self):
         return f'{self.institution_name} for {self.organization.name} (Item ID: {self.item_id})'
 
+    @property
+    def access_token(self):
+        return decrypt_token(self.access_token_encrypted, self.item_id)
+
+    @access_token.setter
+    def access_token(self, token):
+        self.access_token_encrypted = encrypt_token(token, self.item_id)
+
     class Meta:
         app_label = 'api'
 
@@ -347,7 +572,7 @@ class StagedBankTransaction(models.Model):
     PENDING = 'PENDING'
     POSTED = 'POSTED'
     STATUS_CHOICES = [(PENDING, 'Pending'), (POSTED, 'Posted'), ]
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='staged_bank_transactions')
     plaid_item = models.ForeignKey(PlaidItem, on_delete=models.CASCADE, null=True, blank=True, related_name='staged_transactions', help_text='Associated Plaid item if imported via Plaid')
     transaction_id_source = models.CharField(max_length=255, unique=True, help_text='Unique ID from Plaid or bank statement line')
@@ -372,18 +597,30 @@ class StagedBankTransaction(models.Model):
     reconciliation_status = models.CharField(max_length=30, choices=RECON_STATUS_CHOICES, default=RECON_UNMATCHED)
     linked_transaction = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='matched_bank_transactions')
     applied_rule = models.ForeignKey('ReconciliationRule', on_delete=models.SET_NULL, null=True, blank=True, related_name='applied_to_transactions')
-    raw_data = models.JSONField(null=True, blank=True, help_text='Raw data from Plaid or CSV for auditing/debugging')
+    # Never filtered on, only read back one row at a time, so it is stored compressed; use the raw_data property.
+    raw_data_zstd = models.BinaryField(null=True, blank=True, editable=False, help_text='Raw data from Plaid or CSV for auditing/debugging, zstd-compressed JSON')
     imported_at = models.DateTimeField(auto_now_add=True)
     source = models.CharField(max_length=10, choices=[('PLAID', 'Plaid'), ('CSV', 'CSV'), ('QBO', 'QBO')], default='PLAID')
+    DISPLAY_RELATED = ('plaid_item', 'linked_transaction')
+    BULKY_FIELDS = ('raw_data_zstd',)
+    objects = DisplayQuerySet.as_manager()
 
     class Meta:
         ordering = ['-date', '-imported_at']
-        unique_together = ('organization', 'transaction_id_source')
+        constraints = [models.UniqueConstraint(fields=['organization', 'transaction_id_source'], name='uq_staged_txn_source_id')]
         app_label = 'api'
 
     def __str__(self):
         return f'{self.name} ({self.amount} {self.currency_code}) on {self.date}'
 
+    @property
+    def raw_data(self):
+        return unpack_json(self.raw_data_zstd)
+
+    @raw_data.setter
+    def raw_data(self, payload):
+        self.raw_data_zstd = pack_json(payload)
+
 
 class ReconciliationRule(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -434,7 +671,7 @@ class Employee(models.Model):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='created_employees')
 
     class Meta:
-        unique_together = ('organization', 'email')
+        constraints = [models.UniqueConstraint(fields=['organization', 'email'], name='uq_employee_org_email')]
         ordering = ['organization', 'last_name', 'first_name']
         app_label = 'api'
 
@@ -442,6 +679,14 @@ class Employee(models.Model):
         return f'{self.first_name} {self.last_name} ({self.organization.name})'
 
 
+class PayRunQuerySet(models.QuerySet):
+    def with_payslips(self):
+        '''Loads everything PayRunSerializer nests (processor, payslips, their employees and deductions) in three queries.'''
+        return self.select_related('processed_by').prefetch_related(
+            Prefetch('payslips', queryset=Payslip.objects.with_display().with_deductions())
+        )
+
+
 class PayRun(models.Model):
     """Represents a payroll cycle for a group of employees."""
     DRAFT = 'DRAFT'
@@ -466,6 +711,7 @@ class PayRun(models.Model):
     processed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='processed_pay_runs')
     processed_at = models.DateTimeField(null=True, blank=True)
     gl_transaction = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='pay_run_source', help_text='Link to the General Ledger transaction for this pay run')
+    objects = PayRunQuerySet.as_manager()
 
     class Meta:
         ordering = ['organization', '-payment_date']
@@ -489,15 +735,23 @@ class DeductionType(models.Model):
     is_active = models.BooleanField(default=True)
 
     class Meta:
-        unique_together = ('organization', 'name')
+        constraints = [models.UniqueConstraint(fields=['organization', 'name'], name='uq_deduction_type_org_name')]
         app_label = 'api'
 
     def __str__(self):
         return f'{self.name} ({self.get_tax_treatment_display()})'
 
 
+class PayslipQuerySet(DisplayQuerySet):
+    def with_deductions(self):
+        # One query for the deductions and their types instead of one each.
+        return self.prefetch_related(
+            Prefetch('deductions_applied', queryset=PayslipDeduction.objects.select_related('deduction_type'))
+        )
+
+
 class Payslip(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     pay_run = models.ForeignKey(PayRun, on_delete=models.CASCADE, related_name='payslips')
     employee = models.ForeignKey(Employee, on_delete=models.PROTECT, related_name='payslips')
 
@@ -505,26 +759,35 @@ class Payslip(models.Model):
 
     total_deductions = models.DecimalField(max_digits=19, decimal_places=2, default=Decimal('0.00'))
 
-    net_pay = models.DecimalField(max_digits=19, decimal_places=2)
+    net_pay = models.GeneratedField(
+        expression=F('gross_pay') - F('total_deductions'),
+        output_field=models.DecimalField(max_digits=19, decimal_places=2),
+        db_persist=True,
+    )
 
     notes = models.TextField(blank=True, null=True, help_text='e.g., hours worked if hourly')
 
     created_at = models.DateTimeField(auto_now_add=True)
+    DISPLAY_RELATED = ('employee__organization',)  # Employee.__str__ reads its organization
+    BULKY_FIELDS = ('notes',)
+    objects = PayslipQuerySet.as_manager()
 
     class Meta:
-        unique_together = ('pay_run', 'employee')
+        constraints = [models.UniqueConstraint(fields=['pay_run', 'employee'], name='uq_payslip_run_employee')]
         ordering = ['pay_run', 'employee__last_name']
         app_label = 'api'
 
     def __str__(self):
-        return f'Payslip for {self.employee} - PayRun {self.pay_run.id}'
+        return f'Payslip for {self.employee} - PayRun {self.pay_run_id}'
 
 
 class PayslipDeduction(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     payslip = models.ForeignKey(Payslip, on_delete=models.CASCADE, related_name='deductions_applied')
     deduction_type = models.ForeignKey(DeductionType, on_delete=models.PROTECT)
     amount = models.DecimalField(max_digits=19, decimal_places=2)
+    DISPLAY_RELATED = ('deduction_type', 'payslip__employee__organization')
+    objects = DisplayQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.deduction_type.name}: {self.amount} for {self.payslip.employee}'
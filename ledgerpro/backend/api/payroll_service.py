@@ -1,7 +1,10 @@
 import logging
+import uuid
+from collections import defaultdict
 from .models import (
     Employee, PayRun, Payslip, PayslipDeduction, DeductionType,
-    Account, Transaction, JournalEntry  # Added Account, Transaction, JournalEntry
+    Account, Transaction, JournalEntry,  # Added Account, Transaction, JournalEntry
+    from_cents, to_cents,
 )
 from decimal import Decimal
 from django.utils import timezone
@@ -13,19 +16,35 @@ logger = logging.getLogger(__name__)
 
 # _get_or_create_payroll_account method removed, will use centralized utility
 
+def _as_uuid(value):
+    '''Parses an id from request data; malformed ids become None and are treated as not found.'''
+    try:
+        return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+PAY_PERIODS_PER_YEAR = 26  # Bi-weekly
+
+
+def _divide_half_even(numerator: int, denominator: int) -> int:
+    '''Integer division rounded half-to-even, matching Decimal.quantize() under the default context.'''
+    quotient, remainder = divmod(numerator, denominator)
+    if 2 * remainder > denominator or (2 * remainder == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+
 def calculate_gross_pay(employee: Employee, pay_period_start_date, pay_period_end_date, hours_worked=None):
+    # Computed in integer cents; only the result is turned back into a Decimal.
     if employee.pay_type == Employee.SALARY:
-        num_pay_periods_in_year = 26
-        gross = employee.pay_rate / Decimal(str(num_pay_periods_in_year))
-        return Decimal(gross).quantize(Decimal('0.01'))
+        return from_cents(_divide_half_even(to_cents(employee.pay_rate), PAY_PERIODS_PER_YEAR))
     elif employee.pay_type == Employee.HOURLY:
         if hours_worked is None:
             logger.warning(f"Hours worked not provided for hourly employee {employee.id}. Assuming 0 hours for safety.")
-            hours_worked = Decimal('0.00')  # Default to 0 if not provided.
-        else:
-            hours_worked = Decimal(str(hours_worked))
-        gross = employee.pay_rate * hours_worked
-        return Decimal(gross).quantize(Decimal('0.01'))
+            return Decimal('0.00')  # Default to 0 hours if not provided.
+        hours_numerator, hours_denominator = Decimal(str(hours_worked)).as_integer_ratio()
+        return from_cents(_divide_half_even(to_cents(employee.pay_rate) * hours_numerator, hours_denominator))
     return Decimal('0.00')
 
 
@@ -38,42 +57,65 @@ def process_pay_run(pay_run: PayRun, employee_inputs: list, user):
     pay_run.status = PayRun.PROCESSING
     pay_run.save(update_fields=['status'])
 
-    total_run_gross_pay = Decimal('0.00')
-    total_run_net_pay = Decimal('0.00')
-    aggregated_deductions = {}
+    # Every employee and deduction type the inputs mention, fetched in one query each instead of one per row.
+    # Employees join their organization, which the warnings below read through Employee.__str__, and load
+    # only the columns pay calculation and __str__ use.
+    organization = pay_run.organization
+    employees = Employee.objects.filter(organization=organization, is_active=True).select_related('organization').only(
+        'first_name', 'last_name', 'pay_type', 'pay_rate', 'organization__name'
+    ).in_bulk(
+        {_as_uuid(emp_input.get('employee_id')) for emp_input in employee_inputs} - {None}
+    )
+    deduction_types = DeductionType.objects.filter(organization=organization, is_active=True).in_bulk({
+        _as_uuid(ded_input.get('deduction_type_id'))
+        for emp_input in employee_inputs for ded_input in emp_input.get('manual_deductions', [])
+    } - {None})
+
+    # Payslips from an earlier attempt at this run keep their ids and are upserted with the new ones after the loop.
+    existing_payslips = {payslip.employee_id: payslip for payslip in Payslip.objects.filter(pay_run=pay_run)}
+    payslips = []
+    deductions_to_create = []
+
+    # Run totals are kept in integer cents and converted back once, for the GL entries.
+    total_run_gross_cents = 0
+    total_run_net_cents = 0
+    aggregated_deduction_cents = defaultdict(int)
     processed_payslips_for_gl = []
+    processed_employee_ids = set()
 
     for emp_input in employee_inputs:
         employee_id = emp_input.get('employee_id')
         if not employee_id:
             logger.warning(f"Skipping employee input due to missing 'employee_id': {emp_input}")
             continue  # Or handle error more strictly
-        try:
-            employee = Employee.objects.get(id=employee_id, organization=pay_run.organization, is_active=True)
-        except Employee.DoesNotExist:
+        employee = employees.get(_as_uuid(employee_id))
+        if employee is None:
             logger.warning(f'Active employee with ID {employee_id} not found. Skipping.')
             continue
+        if employee.id in processed_employee_ids:
+            logger.warning(f'Employee {employee_id} appears more than once in the inputs. Skipping the repeat.')
+            continue
+        processed_employee_ids.add(employee.id)
 
         hours = emp_input.get('hours_worked')
         gross_pay = calculate_gross_pay(employee, pay_run.pay_period_start_date, pay_run.pay_period_end_date, hours)
-        current_payslip_total_deductions = Decimal('0.00')
-
-        payslip, created = Payslip.objects.update_or_create(
-            pay_run=pay_run, employee=employee,
-            defaults={'gross_pay': gross_pay}  # Only gross_pay in defaults initially
-        )
+        payslip_deduction_cents = 0
 
+        payslip = existing_payslips.get(employee.id)
+        if payslip is None and gross_pay == 0 and not emp_input.get('manual_deductions'):
+            # Nothing to pay or withhold; an existing payslip is still reprocessed so it doesn't go stale.
+            logger.info(f'No pay or deductions for {employee} in this run. No payslip created.')
+            continue
+        if payslip is None:
+            payslip = Payslip(pay_run=pay_run, employee=employee, gross_pay=gross_pay, notes='')
+        else:  # Reprocessing: its previous deductions are replaced below
+            payslip.gross_pay = gross_pay
+        payslips.append(payslip)
         if hours is not None:
             payslip.notes = f'Hours: {hours}'
-            payslip.save(update_fields=['notes'])  # Save if hours were provided
-        elif created:  # No hours provided, and it's a new payslip
-            payslip.notes = ''  # Default for new payslips
-            payslip.save(update_fields=['notes'])
-        # If 'not created' (updated) and 'hours is None', we don't touch 'payslip.notes', preserving its value.
+        # Without hours, a reprocessed payslip keeps its notes.
 
         logger.info(f'Payslip {payslip.id} processed.')  # Comment spacing fixed
-        if not created:  # Clear previous deductions if reprocessing
-            payslip.deductions_applied.all().delete()
 
         manual_deductions_data = emp_input.get('manual_deductions', [])
         for ded_input in manual_deductions_data:
@@ -82,28 +124,35 @@ def process_pay_run(pay_run: PayRun, employee_inputs: list, user):
             if not ded_type_id or ded_amount_str is None:
                 logger.warning(f"Malformed deduction input {ded_input} for {employee}. Skipping.")
                 continue
+            ded_type = deduction_types.get(_as_uuid(ded_type_id))
+            if ded_type is None:
+                logger.warning(f'Deduction type ID {ded_type_id} not found. Skipping for {employee}.')
+                continue
             try:
-                ded_type = DeductionType.objects.get(id=ded_type_id, organization=pay_run.organization, is_active=True)
                 ded_amount = Decimal(str(ded_amount_str)).quantize(Decimal('0.01'))
                 if ded_amount < Decimal('0.00'):
                     logger.warning(f"Negative deduction amount {ded_amount} for {ded_type.name} not allowed. Skipping.")
                     continue
-                PayslipDeduction.objects.create(payslip=payslip, deduction_type=ded_type, amount=ded_amount)
-                current_payslip_total_deductions += ded_amount
-                agg_key = ded_type.name
-                aggregated_deductions[agg_key] = aggregated_deductions.get(agg_key, Decimal('0.00')) + ded_amount
-            except DeductionType.DoesNotExist:
-                logger.warning(f'Deduction type ID {ded_type_id} not found. Skipping for {employee}.')
+                deductions_to_create.append(PayslipDeduction(payslip=payslip, deduction_type=ded_type, amount=ded_amount))
+                payslip_deduction_cents += to_cents(ded_amount)
+                aggregated_deduction_cents[ded_type.name] += to_cents(ded_amount)
             except Exception as e_ded:
                 logger.warning(f'Error processing deduction {ded_input} for {employee}: {e_ded}. Skipping.')
 
-        payslip.total_deductions = current_payslip_total_deductions
-        payslip.net_pay = gross_pay - current_payslip_total_deductions
-        payslip.save()
+        payslip.total_deductions = from_cents(payslip_deduction_cents)  # net_pay is computed by the database
         processed_payslips_for_gl.append(payslip)  # Add to list for GL summary
 
-        total_run_gross_pay += gross_pay
-        total_run_net_pay += payslip.net_pay
+        gross_cents = to_cents(gross_pay)
+        total_run_gross_cents += gross_cents
+        total_run_net_cents += gross_cents - payslip_deduction_cents
+
+    PayslipDeduction.objects.filter(payslip__pay_run=pay_run, payslip__employee_id__in=processed_employee_ids).delete()
+    # One INSERT ... ON CONFLICT DO UPDATE per batch; net_pay is regenerated by the database.
+    Payslip.objects.bulk_create(
+        payslips, update_conflicts=True, unique_fields=['pay_run', 'employee'],
+        update_fields=['gross_pay', 'total_deductions', 'notes'], batch_size=500,
+    )
+    PayslipDeduction.objects.bulk_create(deductions_to_create, batch_size=1000)
 
     if not processed_payslips_for_gl:  # If no employees were processed successfully
         pay_run.status = initial_status  # Revert to original status (e.g. DRAFT)
@@ -112,36 +161,40 @@ def process_pay_run(pay_run: PayRun, employee_inputs: list, user):
         logger.warning(f'PayRun {pay_run.id} processing resulted in no payslips. Status reverted to {initial_status}.')
         raise ValueError('No employee data processed for this pay run.')
 
-    organization = pay_run.organization
     payroll_expense_acc = get_or_create_default_account(organization, Account.EXPENSE, 'Payroll Expense', 'Payroll Expenses (Default)', 'payroll expense')
     wages_payable_acc = get_or_create_default_account(organization, Account.LIABILITY, 'Wages Payable', 'Wages Payable (Default)', 'wages payable')
     generic_deductions_payable_acc = get_or_create_default_account(organization, Account.LIABILITY, 'Deductions Payable', 'Deductions Payable (Default)', 'deductions payable')
 
+    # Check balance from the running totals before writing anything to the GL. On PostgreSQL the
+    # je_transaction_balanced trigger (migration 0014) enforces the same invariant at commit.
+    total_aggregated_deduction_cents = sum(aggregated_deduction_cents.values())
+    debits_cents = total_run_gross_cents
+    credits_cents = total_run_net_cents + total_aggregated_deduction_cents
+    if debits_cents != credits_cents:
+        logger.error(f'GL Transaction for PayRun {pay_run.id} is unbalanced! Debits: {from_cents(debits_cents)}, Credits: {from_cents(credits_cents)}. Rolling back.')
+        raise ValueError(f'Failed to create a balanced GL transaction for the pay run. Difference: {from_cents(debits_cents - credits_cents)}')
+
     gl_transaction = Transaction.objects.create(
         organization=organization, date=pay_run.payment_date,
         description=f'Payroll for period {pay_run.pay_period_start_date} to {pay_run.pay_period_end_date}',
         created_by=user
     )
-    JournalEntry.objects.create(
-        transaction=gl_transaction, account=payroll_expense_acc, debit_amount=total_run_gross_pay,
-        description='Total gross payroll expense for pay run.'
-    )
-    JournalEntry.objects.create(
-        transaction=gl_transaction, account=wages_payable_acc, credit_amount=total_run_net_pay,
-        description='Total net wages payable to employees.'
-    )
-    total_aggregated_deductions_amount = sum(aggregated_deductions.values())
-    if total_aggregated_deductions_amount > Decimal('0.00'):
-        JournalEntry.objects.create(
-            transaction=gl_transaction, account=generic_deductions_payable_acc, credit_amount=total_aggregated_deductions_amount,
+    entries = [
+        JournalEntry(
+            transaction=gl_transaction, account=payroll_expense_acc, debit_amount=from_cents(total_run_gross_cents),
+            description='Total gross payroll expense for pay run.'
+        ),
+        JournalEntry(
+            transaction=gl_transaction, account=wages_payable_acc, credit_amount=from_cents(total_run_net_cents),
+            description='Total net wages payable to employees.'
+        ),
+    ]
+    if total_aggregated_deduction_cents > 0:
+        entries.append(JournalEntry(
+            transaction=gl_transaction, account=generic_deductions_payable_acc, credit_amount=from_cents(total_aggregated_deduction_cents),
             description='Total employee deductions payable.'
-        )
-
-    current_debits = sum(je.debit_amount for je in gl_transaction.journal_entries_set.all())
-    current_credits = sum(je.credit_amount for je in gl_transaction.journal_entries_set.all())
-    if abs(current_debits - current_credits) > Decimal('0.005'):  # Tolerance for small rounding
-        logger.error(f'GL Transaction for PayRun {pay_run.id} is unbalanced! Debits: {current_debits}, Credits: {current_credits}. Rolling back.')
-        raise ValueError(f'Failed to create a balanced GL transaction for the pay run. Difference: {current_debits - current_credits}')
+        ))
+    JournalEntry.bulk_create_validated(entries)
 
     pay_run.gl_transaction = gl_transaction
     pay_run.status = PayRun.COMPLETED
@@ -7,7 +7,9 @@ from plaid.model.transactions_sync_request import TransactionsSyncRequest
 from plaid.model.country_code import CountryCode as PlaidCountryCode
 from plaid.model.products import Products as PlaidProducts
 from django.conf import settings
+from django.db import transaction as db_transaction
 from django.utils import timezone  # Added for timezone.now()
+import functools
 import logging
 from .models import PlaidItem, StagedBankTransaction, Organization
 
@@ -37,10 +39,16 @@ def get_plaid_client():
         logger.error("Plaid Client ID or Secret is not configured.")
         raise ValueError("Plaid Client ID or Secret is not configured.")
 
+    return _build_plaid_client(plaid_host, settings.PLAID_CLIENT_ID, plaid_secret)
+
+
+@functools.lru_cache(maxsize=4)
+def _build_plaid_client(plaid_host, client_id, plaid_secret):
+    '''One client per host and credentials per process, so its urllib3 connection pool (and TLS sessions) are reused.'''
     configuration = plaid_api.Configuration(
         host=plaid_host,
         api_key={
-            'clientId': settings.PLAID_CLIENT_ID,
+            'clientId': client_id,
             'secret': plaid_secret,
         }
     )
@@ -48,12 +56,20 @@ def get_plaid_client():
     return plaid_api.PlaidApi(api_client)
 
 
+@functools.lru_cache(maxsize=4)
+def _link_token_options(products, country_codes):
+    '''Parses the configured products and country codes into Plaid enums once per distinct setting, not per request.'''
+    return (
+        [PlaidProducts(p.strip()) for p in products if p.strip()],
+        [PlaidCountryCode(cc.strip()) for cc in country_codes if cc.strip()],
+    )
+
+
 def create_link_token(user_id_str: str, organization: Organization):
     '''Generates a link_token for the Plaid Link frontend component.'''
     try:
         client = get_plaid_client()
-        request_products = [PlaidProducts(p.strip()) for p in settings.PLAID_PRODUCTS if p.strip()]
-        request_country_codes = [PlaidCountryCode(cc.strip()) for cc in settings.PLAID_COUNTRY_CODES if cc.strip()]
+        request_products, request_country_codes = _link_token_options(tuple(settings.PLAID_PRODUCTS), tuple(settings.PLAID_COUNTRY_CODES))
 
         if not request_products:
             logger.error(f"PLAID_PRODUCTS not configured for org {organization.name}")
@@ -93,14 +109,13 @@ def exchange_public_token(public_token: str, user, organization: Organization, i
         access_token = response['access_token']
         item_id = response['item_id']
 
-        # Store the PlaidItem
-        # Ensure access_token is encrypted before saving in a real application
+        # Store the PlaidItem; the access_token property encrypts it
         plaid_item, created = PlaidItem.objects.update_or_create(
             organization=organization,
             item_id=item_id,
             defaults={
                 'user': user,
-                'access_token': access_token,  # IMPORTANT: Encrypt this in a real app
+                'access_token': access_token,
                 'institution_id': institution_id,
                 'institution_name': institution_name,
                 'last_successful_sync': None,  # Initialize sync time
@@ -120,56 +135,90 @@ def exchange_public_token(public_token: str, user, organization: Organization, i
         return None
 
 
+# Fields refreshed on rows that already exist; reconciliation state and imported_at are left alone.
+STAGED_TRANSACTION_SYNC_FIELDS = [
+    'plaid_item', 'account_id_source', 'date', 'posted_date', 'name', 'merchant_name', 'amount',
+    'currency_code', 'category_source', 'status_source', 'raw_data_zstd', 'source',
+]
+
+
+def _plaid_raw_data(tx_data):
+    '''The raw_data kept for a synced transaction; copying the whole Plaid model is opt-in via PLAID_PERSIST_RAW.'''
+    if settings.PLAID_PERSIST_RAW:
+        return tx_data.to_dict() if hasattr(tx_data, 'to_dict') else tx_data
+    return {'category': tx_data.get('category'), 'pending': tx_data.get('pending', False)}
+
+
+def _persist_plaid_transactions(plaid_item: PlaidItem, transactions_data):
+    '''Upserts a page of Plaid transactions in bulk and returns how many of them were new.'''
+    staged_by_source_id = {}
+    for tx_data in transactions_data:
+        # Ensure amount is a Decimal
+        amount = tx_data.get('amount')
+        if amount is None:
+            logger.warning(f"Skipping transaction with no amount: {tx_data.get('transaction_id')}")
+            continue
+
+        # Map Plaid pending status to our StagedBankTransaction status
+        status_source = StagedBankTransaction.PENDING if tx_data.get('pending', False) else StagedBankTransaction.POSTED
+
+        # Keyed by Plaid's transaction ID: a row may only be upserted once per statement.
+        staged_by_source_id[tx_data['transaction_id']] = StagedBankTransaction(
+            organization=plaid_item.organization,
+            transaction_id_source=tx_data['transaction_id'],  # Plaid's unique transaction ID
+            plaid_item=plaid_item,
+            account_id_source=tx_data['account_id'],
+            date=tx_data['date'],
+            posted_date=tx_data.get('authorized_date'),  # Or use 'datetime'
+            name=tx_data['name'],
+            merchant_name=tx_data.get('merchant_name'),
+            amount=amount,
+            currency_code=tx_data['iso_currency_code'],
+            category_source=', '.join(tx_data.get('category', [])) if tx_data.get('category') else None,
+            status_source=status_source,
+            raw_data=_plaid_raw_data(tx_data),
+            source='PLAID',
+            # reconciliation_status defaults to UNMATCHED
+        )
+    if not staged_by_source_id:
+        return 0
+
+    existing_count = StagedBankTransaction.objects.filter(
+        organization=plaid_item.organization, transaction_id_source__in=staged_by_source_id
+    ).count()
+    StagedBankTransaction.objects.bulk_create(
+        staged_by_source_id.values(), update_conflicts=True, unique_fields=['organization', 'transaction_id_source'],
+        update_fields=STAGED_TRANSACTION_SYNC_FIELDS, batch_size=500,
+    )
+    return len(staged_by_source_id) - existing_count
+
+
 def fetch_plaid_transactions(plaid_item: PlaidItem):
-    '''Fetches transactions for a given PlaidItem.'''
+    '''
+    Fetches transactions for a given PlaidItem, following transactions_sync pages until has_more is false.
+    Each page is written and its cursor saved before the next is requested, so memory stays flat
+    and a failed sync resumes from the last stored page.
+    '''
     try:
         client = get_plaid_client()
         added_count = 0
 
-        request = TransactionsSyncRequest(
-            access_token=plaid_item.access_token,
-            cursor=plaid_item.sync_cursor if plaid_item.sync_cursor else None  # Pass None if cursor is empty/null
-        )
-        response = client.transactions_sync(request)
-
-        transactions_data = response.get('added', [])
-        # TODO: Handle 'modified' and 'removed' transactions for full sync
-
-        for tx_data in transactions_data:
-            # Ensure amount is a Decimal
-            amount = tx_data.get('amount')
-            if amount is None:
-                logger.warning(f"Skipping transaction with no amount: {tx_data.get('transaction_id')}")
-                continue
-
-            # Map Plaid pending status to our StagedBankTransaction status
-            status_source = StagedBankTransaction.PENDING if tx_data.get('pending', False) else StagedBankTransaction.POSTED
-
-            _, created = StagedBankTransaction.objects.update_or_create(
-                organization=plaid_item.organization,
-                transaction_id_source=tx_data['transaction_id'],  # Plaid's unique transaction ID
-                defaults={
-                    'plaid_item': plaid_item,
-                    'account_id_source': tx_data['account_id'],
-                    'date': tx_data['date'],
-                    'posted_date': tx_data.get('authorized_date'),  # Or use 'datetime'
-                    'name': tx_data['name'],
-                    'merchant_name': tx_data.get('merchant_name'),
-                    'amount': amount,
-                    'currency_code': tx_data['iso_currency_code'],
-                    'category_source': ', '.join(tx_data.get('category', [])) if tx_data.get('category') else None,
-                    'status_source': status_source,
-                    'raw_data': tx_data.to_dict(),
-                    'source': 'PLAID',
-                    # reconciliation_status defaults to UNMATCHED
-                }
-            )
-            if created:
-                added_count += 1
-
-        plaid_item.sync_cursor = response.get('next_cursor')
+        while True:
+            # The first sync has no cursor; the Plaid client rejects cursor=None, so it is left out.
+            cursor_kwargs = {'cursor': plaid_item.sync_cursor} if plaid_item.sync_cursor else {}
+            request = TransactionsSyncRequest(access_token=plaid_item.access_token, **cursor_kwargs)
+            response = client.transactions_sync(request)
+
+            # TODO: Handle 'modified' and 'removed' transactions for full sync
+            with db_transaction.atomic():
+                added_count += _persist_plaid_transactions(plaid_item, response.get('added', []))
+                plaid_item.sync_cursor = response.get('next_cursor')
+                plaid_item.save(update_fields=['sync_cursor'])
+            if not response.get('has_more'):
+                break
+
         plaid_item.last_successful_sync = timezone.now()
-        plaid_item.save(update_fields=['sync_cursor', 'last_successful_sync'])
+        plaid_item.save(update_fields=['last_successful_sync'])
 
         logger.info(f'{added_count} new transactions synced for item {plaid_item.item_id}. Next cursor: {plaid_item.sync_cursor}')
         return added_count
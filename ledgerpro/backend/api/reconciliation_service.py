@@ -1,179 +1,447 @@
+import functools
 import logging
-from .models import StagedBankTransaction, ReconciliationRule, Account, Organization  # Removed unused Transaction, JournalEntry
+import operator as op
+import threading
+import uuid
+from cachetools import LRUCache
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection, models
+from django.db import transaction as db_transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Abs
+from collections import defaultdict
+from .models import StagedBankTransaction, ReconciliationRule, Account, Organization, Transaction, JournalEntry
+from datetime import timedelta
 from decimal import Decimal
 # django.utils.timezone is Not explicitly used in this snippet but good for date operations
-# Q and F removed as they are not used
 
 logger = logging.getLogger(__name__)
 
+# Compiled rules keyed by (rule id, updated_at); saving a rule bumps updated_at, so stale entries are never hit.
+_compiled_rule_cache = LRUCache(maxsize=1024)
+_compiled_rule_cache_lock = threading.Lock()
+
+# Rows fetched per round trip when streaming unmatched transactions, and ids per matched-rule UPDATE.
+RULE_RUN_CHUNK_SIZE = 2000
+RULE_UPDATE_BATCH_SIZE = 1000
+
+_NUMBER_TYPES = (Decimal, int, float)
+# Operator -> (comparison on the prepared values, whether both sides must be numbers).
+_COMPARISONS = {
+    'contains': (lambda value, needle: needle in str(value).lower(), False),
+    'does_not_contain': (lambda value, needle: needle not in str(value).lower(), False),
+    'equals': (op.eq, False),
+    'not_equals': (op.ne, False),
+    'greater_than': (op.gt, True),
+    'less_than': (op.lt, True),
+}
+# Rough relative cost of each operator's predicate; a rule's conditions are checked cheapest first.
+_CONDITION_COSTS = {'greater_than': 1, 'less_than': 1, 'equals': 2, 'not_equals': 2, 'contains': 5, 'does_not_contain': 5}
+# Operators whose comparison of a decimal column with a number gives the same answer in SQL as in Python.
+_SQL_LOOKUPS = {'greater_than': 'gt', 'less_than': 'lt', 'equals': 'exact', 'not_equals': 'exact'}
+
 
 def evaluate_condition(transaction_value, operator, rule_value):
-    '''Evaluates a single condition.'''
-    # Ensure types are compatible for comparison, especially for numbers
-    if isinstance(transaction_value, (Decimal, int, float)) and isinstance(rule_value, (str, int, float)):
+    '''
+    Evaluates a single condition. The operator is looked up in the _COMPARISONS table and the rule value
+    is coerced by _compile_condition(); rule runs go through compile_rule(), which does that once per rule.
+    '''
+    return _compile_condition(operator, rule_value)(transaction_value)
+
+
+def _compile_condition(operator, rule_value, field=None):
+    '''
+    Builds a predicate over a transaction value that gives the same result as evaluate_condition(),
+    with the rule-side conversions (Decimal parsing, str(), lower-casing) done once up front.
+    When the model field is given, the predicate is specialized to the Python type that column holds.
+    '''
+    comparison, numbers_only = _COMPARISONS.get(operator, (None, False))
+    if comparison is None:
+        logger.debug('Unsupported operator: %s for rule value: %s', operator, rule_value)
+        return lambda transaction_value: False
+
+    rule_decimal = None
+    if isinstance(rule_value, (str, int, float)):
         try:
-            transaction_value_decimal = Decimal(str(transaction_value))
-            rule_value_decimal = Decimal(str(rule_value))
-            # If both are successfully converted to Decimal, use them for comparison
-            transaction_value = transaction_value_decimal
-            rule_value = rule_value_decimal
-        except Exception:  # Specified exception
-            # Could not convert both to Decimal, fall back to string or original type comparison
+            rule_decimal = Decimal(str(rule_value))
+        except Exception:
             pass
-    elif isinstance(transaction_value, str):  # Ensure rule_value is also string for string operations
-        rule_value = str(rule_value)
-
-    if operator == 'contains':
-        return str(rule_value).lower() in str(transaction_value).lower()
-    elif operator == 'does_not_contain':
-        return str(rule_value).lower() not in str(transaction_value).lower()
-    elif operator == 'equals':
-        # Handle case where one is Decimal and other is int/float after conversion attempt
-        if isinstance(transaction_value, Decimal) and isinstance(rule_value, (int, float)):
-            return transaction_value == Decimal(str(rule_value))
-        return transaction_value == rule_value
-    elif operator == 'not_equals':
-        if isinstance(transaction_value, Decimal) and isinstance(rule_value, (int, float)):
-            return transaction_value != Decimal(str(rule_value))
-        return transaction_value != rule_value
-    elif operator == 'greater_than':
-        if isinstance(transaction_value, (Decimal, int, float)) and isinstance(rule_value, (Decimal, int, float)):
-            return transaction_value > rule_value
-    elif operator == 'less_than':
-        if isinstance(transaction_value, (Decimal, int, float)) and isinstance(rule_value, (Decimal, int, float)):
-            return transaction_value < rule_value
-    # Add more operators: starts_with, ends_with, is_empty, etc.
-    logger.debug(f"Unsupported operator: {operator} or incompatible types for value: {transaction_value} and rule value: {rule_value}")
-    return False
+    # The rule value as evaluate_condition() sees it against a number, a string, or anything else.
+    numeric_operand = rule_decimal if rule_decimal is not None else rule_value
+    string_operand = str(rule_value)
+    if comparison in (op.eq, op.ne, op.gt, op.lt):
+        numeric_rhs, string_rhs, other_rhs = numeric_operand, string_operand, rule_value
+    else:
+        numeric_rhs, string_rhs, other_rhs = str(numeric_operand).lower(), string_operand.lower(), string_operand.lower()
 
+    def predicate(transaction_value):
+        if isinstance(transaction_value, _NUMBER_TYPES):
+            rhs = numeric_rhs
+            if rule_decimal is not None:
+                try:
+                    transaction_value = Decimal(str(transaction_value))
+                except Exception:  # e.g. a bool; both sides are then compared unconverted
+                    rhs = other_rhs
+        elif isinstance(transaction_value, str):
+            rhs = string_rhs
+        else:
+            rhs = other_rhs
+        if numbers_only and not (isinstance(transaction_value, _NUMBER_TYPES) and isinstance(rhs, _NUMBER_TYPES)):
+            return False
+        return comparison(transaction_value, rhs)
 
-def check_rule_conditions(staged_tx: StagedBankTransaction, rule: ReconciliationRule):
-    '''Checks if a staged transaction matches all conditions of a rule.'''
+    # Decimal and text columns skip the type dispatch above for their usual values; anything else
+    # (e.g. NULL) still takes the general path. Decimal(str(d)) == d, so the Decimal case needs no copy,
+    # and a rule value that is already a Decimal is compared as is.
+    if isinstance(field, models.DecimalField) and (rule_decimal is not None or isinstance(rule_value, Decimal)):
+        return lambda transaction_value: (
+            comparison(transaction_value, numeric_rhs) if transaction_value.__class__ is Decimal else predicate(transaction_value)
+        )
+    if isinstance(field, (models.CharField, models.TextField)) and not numbers_only:
+        return lambda transaction_value: (
+            comparison(transaction_value, string_rhs) if transaction_value.__class__ is str else predicate(transaction_value)
+        )
+    return predicate
+
+
+def compile_rule(rule: ReconciliationRule):
+    '''
+    Turns a rule's JSON conditions into a list of (field_name, getter, predicate) triples, cheapest first,
+    or None if the rule can never match. getter is an operator.attrgetter for the field, bound once here.
+    Saved rules are cached by (id, updated_at), so each rule's JSON is walked once rather than once per transaction.
+    '''
+    key = (rule.id, rule.updated_at) if rule.updated_at else None
+    if key is not None:
+        with _compiled_rule_cache_lock:
+            if key in _compiled_rule_cache:
+                return _compiled_rule_cache[key]
+
+    compiled = []
+    costs = []
     if not rule.conditions or not isinstance(rule.conditions, list):
         logger.warning(f"Rule {rule.name} (ID: {rule.id}) has no conditions or conditions are malformed.")
+        compiled = None
+    else:
+        for condition in rule.conditions:  # conditions is a list of dicts
+            field_name = condition.get('field')
+            operator = condition.get('operator')
+
+            if not field_name or not operator:
+                logger.warning(f"Skipping malformed condition in Rule {rule.name}: {condition}")
+                continue  # Or treat as failure for the rule? For now, skip malformed condition.
+
+            if not hasattr(StagedBankTransaction, field_name):
+                logger.warning(f'Rule {rule.name} references invalid field \'{field_name}\' on StagedBankTransaction.')
+                compiled = None
+                break
+
+            try:
+                field = StagedBankTransaction._meta.get_field(field_name)
+            except FieldDoesNotExist:  # A property or other attribute rather than a column
+                field = None
+            compiled.append((field_name, op.attrgetter(field_name), _compile_condition(operator, condition.get('value'), field)))
+            costs.append(_CONDITION_COSTS.get(operator, 0))  # Unsupported operators never match, so they go first
+
+    if compiled:
+        # The conditions are ANDed and have no side effects, so checking them cheapest first
+        # gives the same result while rejecting non-matching transactions sooner.
+        compiled = [condition for _, condition in sorted(zip(costs, compiled), key=lambda pair: pair[0])]
+    if key is not None:
+        with _compiled_rule_cache_lock:
+            _compiled_rule_cache[key] = compiled
+    return compiled
+
+
+def _condition_q(field_name, operator, rule_value):
+    '''
+    The condition as a database filter when it compares a non-null decimal column with a number, else None.
+    The filter selects exactly the rows the compiled predicate accepts.
+    '''
+    lookup = _SQL_LOOKUPS.get(operator)
+    if lookup is None or not field_name or isinstance(rule_value, bool) or not isinstance(rule_value, (str, int, float, Decimal)):
+        return None
+    try:
+        field = StagedBankTransaction._meta.get_field(field_name)
+        threshold = Decimal(str(rule_value))
+    except (FieldDoesNotExist, ArithmeticError):
+        return None
+    if not isinstance(field, models.DecimalField) or field.null or not threshold.is_finite():
+        return None
+    condition_q = models.Q(**{f'{field.name}__{lookup}': threshold})
+    return ~condition_q if operator == 'not_equals' else condition_q
+
+
+def _rules_prefilter(rules):
+    '''
+    A filter outside of which no row can match any of the rules, built from their amount comparisons,
+    or None if some rule has none. Rows are still checked against the rules in Python, so it may let extra rows through.
+    '''
+    combined = models.Q()
+    for rule in rules:
+        rule_q = models.Q()
+        for condition in rule.conditions:
+            condition_q = _condition_q(condition.get('field'), condition.get('operator'), condition.get('value'))
+            if condition_q is not None:
+                rule_q &= condition_q
+        if not rule_q:
+            return None
+        combined |= rule_q
+    return combined
+
+
+def check_rule_conditions(staged_tx: StagedBankTransaction, rule: ReconciliationRule):
+    '''Checks if a staged transaction matches all conditions of a rule.'''
+    compiled = compile_rule(rule)
+    if compiled is None:
         return False
+    return all(predicate(getter(staged_tx)) for _, getter, predicate in compiled)
 
-    for condition in rule.conditions:  # conditions is a list of dicts
-        field_name = condition.get('field')
-        operator = condition.get('operator')
-        value = condition.get('value')
 
-        if not field_name or not operator:
-            logger.warning(f"Skipping malformed condition in Rule {rule.name}: {condition}")
-            continue  # Or treat as failure for the rule? For now, skip malformed condition.
+def _as_uuid(value):
+    '''Parses an id from rule JSON; malformed ids become None and are treated as not found.'''
+    try:
+        return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def load_rule_accounts(organization_id, rules):
+    '''Every account the rules' categorize actions name (target and bank side), fetched in one query and keyed by id.'''
+    account_ids = {
+        _as_uuid(action_def.get(key))
+        for rule in rules if isinstance(rule.actions, list)
+        for action_def in rule.actions if action_def.get('action_type') == 'categorize'
+        for key in ('account_id', 'bank_account_id')
+    } - {None}
+    return Account.objects.filter(organization_id=organization_id).in_bulk(account_ids)
 
-        if not hasattr(staged_tx, field_name):
-            logger.warning(f'Rule {rule.name} references invalid field \'{field_name}\' on StagedBankTransaction.')
-            return False
 
-        transaction_value = getattr(staged_tx, field_name)
+def _rules_post_to_ledger(rules):
+    '''Whether any of the rules' categorize actions names a bank account, i.e. creates ledger entries.'''
+    return any(
+        action_def.get('action_type') == 'categorize' and action_def.get('bank_account_id')
+        for rule in rules if isinstance(rule.actions, list)
+        for action_def in rule.actions
+    )
 
-        if not evaluate_condition(transaction_value, operator, value):
-            return False  # One condition failed, rule does not match
-    return True  # All conditions passed
 
+def build_ledger_entries(staged_tx: StagedBankTransaction, rule: ReconciliationRule, bank_gl_account, target_account, user):
+    '''
+    The ledger Transaction and its debit and credit JournalEntry for a categorized bank transaction, unsaved,
+    so callers can write many with write_ledger_entries(). Reads staged_tx's organization_id, date, name and amount.
+    '''
+    if staged_tx.amount < 0:  # Money out: an expense or asset purchase
+        debit_account, credit_account = target_account, bank_gl_account
+    else:  # Money in: income or a liability increase
+        debit_account, credit_account = bank_gl_account, target_account
+    amount = abs(staged_tx.amount)
+    ledger_tx = Transaction(
+        organization_id=staged_tx.organization_id, date=staged_tx.date, created_by=user,
+        description=f'Auto-created by rule: {rule.name} for bank tx: {staged_tx.name}',
+    )
+    return (
+        ledger_tx,
+        JournalEntry(transaction=ledger_tx, account=debit_account, debit_amount=amount),
+        JournalEntry(transaction=ledger_tx, account=credit_account, credit_amount=amount),
+    )
 
-def apply_rule_actions(staged_tx: StagedBankTransaction, rule: ReconciliationRule, user):
-    '''Applies the actions of a matched rule to a staged transaction.'''
-    organization = staged_tx.organization
+
+def write_ledger_entries(postings):
+    '''
+    Saves build_ledger_entries() output and links each staged transaction to its new ledger Transaction,
+    with one batched INSERT per table and one batched UPDATE. postings holds (staged tx id, entries) pairs.
+    '''
+    if not postings:
+        return
+    with db_transaction.atomic():
+        Transaction.objects.bulk_create([ledger_tx for _, (ledger_tx, _, _) in postings], batch_size=1000)
+        JournalEntry.bulk_create_validated([entry for _, (_, *entries) in postings for entry in entries])
+        StagedBankTransaction.objects.bulk_update(
+            [StagedBankTransaction(id=staged_tx_id, linked_transaction=ledger_tx) for staged_tx_id, (ledger_tx, _, _) in postings],
+            ['linked_transaction'], batch_size=1000,
+        )
+
+
+def apply_rule_actions(staged_tx: StagedBankTransaction, rule: ReconciliationRule, user, accounts=None, postings=None):
+    '''
+    Works out the actions of a matched rule for a staged transaction and returns the field updates to write,
+    or an empty dict if no action applies. The updates are not saved here; callers batch the writes per rule.
+    accounts is load_rule_accounts() output; it is loaded for this rule alone when not given. staged_tx may be a
+    model instance or a named-tuple row; only its id, organization_id and the compared fields are read, plus its
+    date, name and amount when a categorize action names a bank_account_id to post against.
+    Those ledger postings are appended to postings for the caller to write with write_ledger_entries(),
+    or written here when no postings list is given.
+    '''
     if not rule.actions or not isinstance(rule.actions, list):
         logger.warning(f"Rule {rule.name} (ID: {rule.id}) has no actions or actions are malformed.")
-        return
+        return {}
+    if accounts is None:
+        accounts = load_rule_accounts(staged_tx.organization_id, [rule])
+    pending_postings = [] if postings is None else postings
 
+    updates = {}
     for action_def in rule.actions:
         action_type = action_def.get('action_type')
 
         if action_type == 'categorize':
             account_id = action_def.get('account_id')
-            try:
-                target_account = Account.objects.get(id=account_id, organization=organization)
-                logger.info(f'Rule action for TX {staged_tx.id}: Categorize to account {target_account.name} based on rule {rule.name}')
-                staged_tx.reconciliation_status = StagedBankTransaction.RECON_RULE_APPLIED
-                staged_tx.applied_rule = rule
-                # Placeholder for creating actual Transaction and JournalEntry
-                # This part is complex and involves significant accounting logic:
-                # 1. Determine the other side of the entry (e.g., a bank account linked to PlaidItem)
-                # 2. Create a Transaction
-                # 3. Create JournalEntry for debit and credit
-                # For example:
-                # bank_gl_account = ...  # logic to find the GL account representing the bank account of staged_tx
-                # if staged_tx.amount < 0:  # Expense or Asset use
-                #    debit_account, credit_account = target_account, bank_gl_account
-                # else:  # Income or Liability increase
-                #    debit_account, credit_account = bank_gl_account, target_account
-                # ledger_tx = Transaction.objects.create(organization=organization, date=staged_tx.date, description=f"Auto-created by rule: {rule.name} for bank tx: {staged_tx.name}", created_by=user)
-                # JournalEntry.objects.create(transaction=ledger_tx, account=debit_account, debit_amount=abs(staged_tx.amount))
-                # JournalEntry.objects.create(transaction=ledger_tx, account=credit_account, credit_amount=abs(staged_tx.amount))
-                # staged_tx.linked_transaction = ledger_tx
-                staged_tx.save()
-
-            except Account.DoesNotExist:
-                logger.error(f'Account ID {account_id} in rule {rule.name} not found for org {organization.name}.')
+            target_account = accounts.get(_as_uuid(account_id))
+            if target_account is None:
+                logger.error(f'Account ID {account_id} in rule {rule.name} not found for org {staged_tx.organization_id}.')
+                continue
+            logger.info(f'Rule action for TX {staged_tx.id}: Categorize to account {target_account.name} based on rule {rule.name}')
+            updates['reconciliation_status'] = StagedBankTransaction.RECON_RULE_APPLIED
+            updates['applied_rule'] = rule
+
+            # With the GL account representing the bank account, the categorization is also posted to the ledger.
+            bank_account_id = action_def.get('bank_account_id')
+            if not bank_account_id:
+                continue
+            bank_gl_account = accounts.get(_as_uuid(bank_account_id))
+            if bank_gl_account is None:
+                logger.error(f'Bank account ID {bank_account_id} in rule {rule.name} not found for org {staged_tx.organization_id}.')
+            elif staged_tx.amount:  # A zero amount has nothing to post
+                pending_postings.append((staged_tx.id, build_ledger_entries(staged_tx, rule, bank_gl_account, target_account, user)))
 
         # Add other action_types: 'match_to_vendor', 'set_status', etc.
+    if postings is None:
+        write_ledger_entries(pending_postings)
     logger.info(f'Actions from rule \'{rule.name}\' processed for staged transaction {staged_tx.id}')
+    return updates
+
+
+def _columns_read_by(compiled_rules):
+    '''The StagedBankTransaction columns the compiled rules compare, or None if any rule reads a non-column attribute.'''
+    columns = {field.name for field in StagedBankTransaction._meta.concrete_fields}
+    fields_read = {field_name for _, compiled in compiled_rules for field_name, _, _ in compiled}
+    return fields_read if fields_read <= columns else None
+
+
+@functools.lru_cache(maxsize=256)
+def _compiled_rules_for(organization_id, rule_count, last_updated):
+    '''
+    The organization's active rules in priority order, paired with their compiled conditions; rules that can never
+    match are dropped. Keyed by the active rules' count and latest updated_at, which change whenever a rule is
+    added, saved or deleted, so a run reads the rules themselves only when they have changed.
+    '''
+    rules = ReconciliationRule.objects.filter(organization_id=organization_id, is_active=True).order_by('priority')
+    return tuple((rule, compiled) for rule in rules if (compiled := compile_rule(rule)) is not None)
 
 
 def run_reconciliation_rules_for_organization(organization: Organization, user):
     '''Runs all active reconciliation rules for an organization on unmatched transactions.'''
-    rules = ReconciliationRule.objects.filter(organization=organization, is_active=True).order_by('priority')
-    # Process only a subset to avoid long transactions, or use background tasks for full processing
-    unmatched_transactions = StagedBankTransaction.objects.filter(
+    active_rules = ReconciliationRule.objects.filter(organization=organization, is_active=True)
+    version = active_rules.aggregate(count=Count('id'), last_updated=Max('updated_at'))
+    compiled_rules = _compiled_rules_for(organization.id, version['count'], version['last_updated'])
+
+    unmatched_transactions = StagedBankTransaction.objects.without_bulky().filter(
         organization=organization,
         reconciliation_status=StagedBankTransaction.RECON_UNMATCHED
-    )[:100]  # Example: Limit to 100 per run to avoid timeouts in web requests
+    )
+    # Amount comparisons are evaluated by the database, so rows no rule can match are never fetched.
+    prefilter = _rules_prefilter([rule for rule, _ in compiled_rules])
+    if prefilter is not None:
+        unmatched_transactions = unmatched_transactions.filter(prefilter)
+    # Matches are written by UPDATE, not by saving these rows, so when the rules only compare plain columns the rows
+    # are read as named tuples of those columns; rules reading anything else get (narrowed) model instances.
+    columns_read = _columns_read_by(compiled_rules)
+    if columns_read is not None and _rules_post_to_ledger(rule for rule, _ in compiled_rules):
+        columns_read |= {'date', 'name', 'amount'}  # Read by build_ledger_entries()
+    if columns_read is not None and not any(StagedBankTransaction._meta.get_field(name).is_relation for name in columns_read):
+        unmatched_transactions = unmatched_transactions.values_list(
+            'id', 'organization_id', *sorted(columns_read - {'id', 'organization_id'}), named=True
+        )
+    elif columns_read is not None:
+        unmatched_transactions = unmatched_transactions.only('organization', *columns_read)
+    # Streamed in chunks rather than capped, so one run covers every unmatched transaction.
+    unmatched_transactions = unmatched_transactions.order_by().iterator(chunk_size=RULE_RUN_CHUNK_SIZE)
+
+    accounts = load_rule_accounts(organization.id, [rule for rule, _ in compiled_rules])
 
+    # Matches are collected first and written with one UPDATE per rule (and id batch) instead of a save() per transaction.
+    updates_by_rule = {}
+    tx_ids_by_rule = defaultdict(list)
+    postings = []
     applied_count = 0
     for tx in unmatched_transactions:
-        for rule in rules:
-            if check_rule_conditions(tx, rule):
-                apply_rule_actions(tx, rule, user)
+        for rule, compiled in compiled_rules:
+            if all(predicate(getter(tx)) for _, getter, predicate in compiled):
+                updates = apply_rule_actions(tx, rule, user, accounts, postings)
+                if updates:
+                    updates_by_rule[rule.id] = updates
+                    tx_ids_by_rule[rule.id].append(tx.id)
                 applied_count += 1
                 break  # Move to next transaction once a rule has been applied
 
+    # Ledger postings and status updates land together, so a failed run leaves nothing to post twice.
+    if tx_ids_by_rule:
+        with db_transaction.atomic():
+            # Rows are claimed before anything is written: a run that overlaps this one has either locked them
+            # (and they are skipped) or already matched them (and they are no longer unmatched), so each row is
+            # posted once.
+            matched_ids = [tx_id for tx_ids in tx_ids_by_rule.values() for tx_id in tx_ids]
+            claimed_ids = set()
+            for start in range(0, len(matched_ids), RULE_UPDATE_BATCH_SIZE):
+                claimed_ids.update(StagedBankTransaction.objects.select_for_update(skip_locked=True).filter(
+                    id__in=matched_ids[start:start + RULE_UPDATE_BATCH_SIZE],
+                    reconciliation_status=StagedBankTransaction.RECON_UNMATCHED,
+                ).order_by().values_list('id', flat=True))
+            applied_count -= len(matched_ids) - len(claimed_ids)
+
+            write_ledger_entries([posting for posting in postings if posting[0] in claimed_ids])
+            for rule_id, tx_ids in tx_ids_by_rule.items():
+                tx_ids = [tx_id for tx_id in tx_ids if tx_id in claimed_ids]
+                for start in range(0, len(tx_ids), RULE_UPDATE_BATCH_SIZE):
+                    StagedBankTransaction.objects.filter(id__in=tx_ids[start:start + RULE_UPDATE_BATCH_SIZE]).update(**updates_by_rule[rule_id])
+
     logger.info(f'{applied_count} rules applied for organization {organization.name}.')
     return applied_count
 
 
-def find_suggested_matches(staged_tx: StagedBankTransaction, threshold_days=7, amount_tolerance_percent=1.0):
-    '''Suggests potential matches from existing LedgerPro Transactions.'''
-    # This is a placeholder and needs significant refinement.
-    # Matching criteria:
-    # - Date proximity
-    # - Amount similarity (absolute or percentage)
-    # - Description similarity (e.g., using text matching algorithms if needed)
-    # - Avoiding matching already matched transactions
+def find_suggested_matches(staged_tx: StagedBankTransaction, threshold_days=7, amount_tolerance_percent=1.0, limit=10):
+    '''
+    Suggests existing LedgerPro Transactions a staged transaction could be matched to: ones within threshold_days of it
+    whose total is within amount_tolerance_percent of its amount and that no bank transaction is linked to yet.
+    Candidates are found and ranked in one query; on PostgreSQL the best description match (by trigram similarity to
+    the bank transaction's name) comes first, then the closest amount and date.
+    '''
+    date_from = staged_tx.date - timedelta(days=threshold_days)
+    date_to = staged_tx.date + timedelta(days=threshold_days)
+    amount_abs = abs(staged_tx.amount)
+    tolerance = amount_abs * Decimal(str(amount_tolerance_percent / 100.0))
+
+    # A balanced transaction's total is the sum of its debits.
+    transaction_total = JournalEntry.objects.filter(transaction=OuterRef('pk')).order_by().values('transaction').annotate(
+        total=Sum('debit_amount')
+    ).values('total')
+    candidates = Transaction.objects.filter(
+        organization_id=staged_tx.organization_id, date__range=[date_from, date_to]
+    ).annotate(
+        total=Subquery(transaction_total),
+        amount_difference=Abs(F('total') - amount_abs),
+    ).filter(
+        total__range=[amount_abs - tolerance, amount_abs + tolerance]
+    ).filter(
+        ~Exists(StagedBankTransaction.objects.filter(linked_transaction=OuterRef('pk')))
+    )
+    ordering = ['amount_difference', '-date']
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity  # Needs the pg_trgm extension, enabled by migration 0002
+        candidates = candidates.annotate(similarity=TrigramSimilarity('description', staged_tx.name or ''))
+        ordering.insert(0, '-similarity')
+    candidates = candidates.order_by(*ordering)[:limit]
 
     suggestions = []
-    # Example:
-    # date_from = staged_tx.date - timedelta(days=threshold_days)
-    # date_to = staged_tx.date + timedelta(days=threshold_days)
-    # amount_abs = abs(staged_tx.amount)
-    # amount_lower_bound = amount_abs * Decimal(str(1 - (amount_tolerance_percent / 100.0)))
-    # amount_upper_bound = amount_abs * Decimal(str(1 + (amount_tolerance_percent / 100.0)))
-
-    # potential_gl_txs = Transaction.objects.filter(
-    #    organization=staged_tx.organization,
-    #    date__range=[date_from, date_to],
-    #    # This query is tricky because GL transactions store debits/credits in JournalEntry.
-    #    # We need to check if any JE total matches the bank transaction amount.
-    #    # This might require querying JournalEntry sums grouped by Transaction.
-    #    # Or, if Transaction model stores a total_amount (which it doesn't currently by default for GL)
-    # ).exclude(matched_bank_transactions__isnull=False) # Exclude already matched GL transactions
-
-    # For each potential_gl_tx:
-    #   Calculate a match_score based on date difference, amount difference, description similarity.
-    #   If score > a certain threshold, add to suggestions.
-
-    # Example dummy suggestion:
-    # suggestions.append({
-    #    'ledger_pro_transaction_id': 'some_uuid',
-    #    'date': 'YYYY-MM-DD',
-    #    'description': 'Example GL Transaction',
-    #    'amount': staged_tx.amount, # Or the amount from GL transaction
-    #    'match_score': 0.85, # Arbitrary score
-    #    'reason': 'Close date and amount'
-    # })
+    for gl_tx in candidates:
+        similarity = getattr(gl_tx, 'similarity', None)
+        suggestions.append({
+            'ledger_pro_transaction_id': str(gl_tx.id),
+            'date': gl_tx.date.isoformat(),
+            'description': gl_tx.description,
+            'amount': gl_tx.total,
+            'match_score': round(similarity, 2) if similarity is not None else None,
+            'reason': f'Within {abs((gl_tx.date - staged_tx.date).days)} days and {gl_tx.amount_difference} of the bank amount',
+        })
 
     logger.info(f'Found {len(suggestions)} potential matches for staged transaction {staged_tx.id}')
     return suggestions
@@ -0,0 +1,21 @@
+import orjson
+from rest_framework import renderers
+from rest_framework.utils.encoders import JSONEncoder
+
+# Dates, Decimals, lazy strings and querysets go through DRF's encoder, so the output matches JSONRenderer's.
+_ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+_drf_default = JSONEncoder().default
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    '''JSONRenderer with the encoding done by orjson, which renders large list responses several times faster.'''
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            # Indented output is for people reading it; the stdlib encoder handles any indent width.
+            return super().render(data, accepted_media_type, renderer_context)
+        rendered = orjson.dumps(data, default=_drf_default, option=_ORJSON_OPTIONS)
+        # Escaped like JSONRenderer does, so the output is also valid JavaScript.
+        return rendered.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
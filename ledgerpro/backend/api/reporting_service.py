@@ -1,11 +1,49 @@
 import logging
-from .models import Account, Organization  # Removed unused Transaction, JournalEntry here for now
+from django.db.models import F, OuterRef, Subquery, Sum
+from .models import Account, AccountBalanceSnapshot, JournalEntry, Organization
 from decimal import Decimal
-from datetime import date  # Added timedelta, Sum removed as unused
+from datetime import date  # Added timedelta
 
 logger = logging.getLogger(__name__)
 
 
+def _period_activity_by_account(organization: Organization, account_types, date_from: date, date_to: date):
+    '''
+    Period activity of every active account of the given types, from one GROUP BY over the journal entries.
+    Yields (account name, account type, activity) in account name order; accounts without entries are left out.
+    Activity is signed as in Account.get_period_activity.
+    '''
+    rows = JournalEntry.objects.filter(
+        organization=organization, account__type__in=account_types, account__is_active=True,
+        transaction_date__gte=date_from, transaction_date__lte=date_to,
+    ).values('account_id', 'account__name', 'account__type').annotate(
+        net_debit=Sum(F('debit_amount') - F('credit_amount'))
+    ).order_by('account__name')
+    for row in rows:
+        net_debit = row['net_debit'] or Decimal('0.00')
+        activity = net_debit if row['account__type'] in [Account.ASSET, Account.EXPENSE] else Decimal('0.00') - net_debit
+        yield row['account__name'], row['account__type'], activity
+
+
+def _balances_by_account(organization: Organization, account_types, as_of_date: date):
+    '''
+    Balance as of as_of_date of every active account of the given types, in one query.
+    Each account's latest running-total snapshot is read by correlated subqueries (served by the
+    snapshot index), as Account.get_balance does per account. Yields (name, type, balance) in name order.
+    '''
+    latest_snapshot = AccountBalanceSnapshot.objects.filter(
+        account=OuterRef('pk'), as_of_date__lte=as_of_date
+    ).order_by('-as_of_date')
+    accounts = Account.objects.filter(organization=organization, type__in=account_types, is_active=True).annotate(
+        running_debit=Subquery(latest_snapshot.values('running_debit')[:1]),
+        running_credit=Subquery(latest_snapshot.values('running_credit')[:1]),
+    ).values_list('name', 'type', 'running_debit', 'running_credit').order_by('name')
+    for name, account_type, running_debit, running_credit in accounts:
+        net_debit = (running_debit or Decimal('0.00')) - (running_credit or Decimal('0.00'))
+        balance = net_debit if account_type in [Account.ASSET, Account.EXPENSE] else Decimal('0.00') - net_debit
+        yield name, account_type, balance
+
+
 def get_profit_and_loss_data(organization: Organization, date_from: date, date_to: date):
     '''
     Generates data for a Profit & Loss statement for a given organization and date range.
@@ -27,27 +65,22 @@ def get_profit_and_loss_data(organization: Organization, date_from: date, date_t
 
     logger.info(f"Generating P&L report for organization '{organization.name}' from {date_from} to {date_to}.")
 
-    revenue_accounts = Account.objects.filter(organization=organization, type=Account.REVENUE, is_active=True)
-    expense_accounts = Account.objects.filter(organization=organization, type=Account.EXPENSE, is_active=True)
-
     total_revenue = Decimal('0.00')
     revenues_breakdown = []
-    for acc in revenue_accounts:
-        # Using the new get_period_activity method if available and confirmed working,
-        # otherwise using the direct query logic as fallback.
-        # Assuming get_period_activity is now part of Account model.
-        period_activity = acc.get_period_activity(date_from, date_to)
-        if period_activity != Decimal('0.00'):  # Only include accounts with activity
-            revenues_breakdown.append({'account_name': acc.name, 'amount': period_activity})
-        total_revenue += period_activity
-
     total_expenses = Decimal('0.00')
     expenses_breakdown = []
-    for acc in expense_accounts:
-        period_activity = acc.get_period_activity(date_from, date_to)
-        if period_activity != Decimal('0.00'):
-            expenses_breakdown.append({'account_name': acc.name, 'amount': period_activity})
-        total_expenses += period_activity
+    # One aggregate query for all revenue and expense accounts rather than one per account.
+    for account_name, account_type, period_activity in _period_activity_by_account(
+        organization, [Account.REVENUE, Account.EXPENSE], date_from, date_to
+    ):
+        if period_activity == Decimal('0.00'):  # Only include accounts with activity
+            continue
+        if account_type == Account.REVENUE:
+            revenues_breakdown.append({'account_name': account_name, 'amount': period_activity})
+            total_revenue += period_activity
+        else:
+            expenses_breakdown.append({'account_name': account_name, 'amount': period_activity})
+            total_expenses += period_activity
 
     net_income = total_revenue - total_expenses
 
@@ -73,24 +106,23 @@ def get_balance_sheet_data(organization: Organization, as_of_date: date):
     if not as_of_date:
         raise ValueError('as_of_date is required for Balance Sheet.')
 
-    asset_accounts = Account.objects.filter(organization=organization, type=Account.ASSET, is_active=True)
-    liability_accounts = Account.objects.filter(organization=organization, type=Account.LIABILITY, is_active=True)
-    equity_accounts = Account.objects.filter(organization=organization, type=Account.EQUITY, is_active=True)
+    # Asset, liability and equity balances come from one query; breakdowns are filled per type below.
+    balances = {Account.ASSET: [], Account.LIABILITY: [], Account.EQUITY: []}
+    for account_name, account_type, balance in _balances_by_account(organization, list(balances), as_of_date):
+        balances[account_type].append((account_name, balance))
 
     total_assets = Decimal('0.00')
     assets_breakdown = []
-    for acc in asset_accounts:
-        balance = acc.get_balance(date_to=as_of_date)
+    for account_name, balance in balances[Account.ASSET]:
         if balance != Decimal('0.00'):
-            assets_breakdown.append({'account_name': acc.name, 'balance': balance})
+            assets_breakdown.append({'account_name': account_name, 'balance': balance})
         total_assets += balance
 
     total_liabilities = Decimal('0.00')
     liabilities_breakdown = []
-    for acc in liability_accounts:
-        balance = acc.get_balance(date_to=as_of_date)
+    for account_name, balance in balances[Account.LIABILITY]:
         if balance != Decimal('0.00'):
-            liabilities_breakdown.append({'account_name': acc.name, 'balance': balance})
+            liabilities_breakdown.append({'account_name': account_name, 'balance': balance})
         total_liabilities += balance
 
     # Calculate Retained Earnings / Current Year Net Income component for Equity
@@ -110,18 +142,19 @@ def get_balance_sheet_data(organization: Organization, as_of_date: date):
 
     total_explicit_equity = Decimal('0.00')
     equity_breakdown = []
-    for acc in equity_accounts:
-        balance = acc.get_balance(date_to=as_of_date)
+    for account_name, balance in balances[Account.EQUITY]:
         if balance != Decimal('0.00'):
-            equity_breakdown.append({'account_name': acc.name, 'balance': balance})
+            equity_breakdown.append({'account_name': account_name, 'balance': balance})
         total_explicit_equity += balance
 
-    # Calculate Current Year Net Income (assuming calendar year for simplicity)
+    # Calculate Current Year Net Income (assuming calendar year for simplicity) from the same
+    # aggregate the P&L uses, rather than building a whole P&L report.
     current_year_start = date(as_of_date.year, 1, 1)
     current_year_net_income = Decimal('0.00')
-    if as_of_date >= current_year_start:
-        pnl_for_current_year_equity = get_profit_and_loss_data(organization, current_year_start, as_of_date)
-        current_year_net_income = pnl_for_current_year_equity['net_income']
+    for _, account_type, activity in _period_activity_by_account(
+        organization, [Account.REVENUE, Account.EXPENSE], current_year_start, as_of_date
+    ):
+        current_year_net_income += activity if account_type == Account.REVENUE else -activity
 
     # Add calculated current year net income to equity breakdown
     if current_year_net_income != Decimal('0.00') or not any(e['account_name'] == 'Current Year Net Income (Calculated)' for e in equity_breakdown):
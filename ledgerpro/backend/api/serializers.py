@@ -1,17 +1,48 @@
 from .models import (
     User, Organization, Membership, Role, Account, Transaction, JournalEntry, AuditLog,
     Customer, Invoice, InvoiceItem, Vendor, PlaidItem, StagedBankTransaction,
-    ReconciliationRule, Employee, PayRun, Payslip, DeductionType, PayslipDeduction
+    ReconciliationRule, Employee, PayRun, Payslip, DeductionType, PayslipDeduction, from_cents, to_cents
 )
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction as db_transaction
 from rest_framework import serializers
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
 import logging
 from .account_utils import get_or_create_default_account
+from . import audit
 
 logger = logging.getLogger(__name__)
 
 
+def request_membership(request):
+    '''
+    The requesting user's first membership, with its organization, or None. Looked up once per request and kept
+    on it, since the view and its serializer's validation and save each need it.
+    '''
+    if '_cached_membership' not in request.__dict__:
+        request._cached_membership = request.user.membership_set.select_related('organization').first()
+    return request._cached_membership
+
+
+# The Admin role's id, stored once the transaction that read or created it commits, so a rolled-back
+# create is never served. Cleared whenever a role is saved or deleted (see signals.py).
+_admin_role_id_cache = {}
+
+
+def invalidate_admin_role_cache():
+    _admin_role_id_cache.clear()
+
+
+def _admin_role_id():
+    '''The id of the Admin role new organizations' founders get, created on first use.'''
+    role_id = _admin_role_id_cache.get('Admin')
+    if role_id is None:
+        role, _ = Role.objects.get_or_create(name='Admin', defaults={'description': 'Administrator with full access'})
+        role_id = role.id
+        db_transaction.on_commit(lambda: _admin_role_id_cache.setdefault('Admin', role_id))
+    return role_id
+
+
 # User related serializers (from previous steps)
 
 
@@ -35,24 +66,24 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         model = User
         fields = ('id', 'email', 'password', 'first_name', 'last_name', 'organization_name')
         read_only_fields = ('id',)
-
-    def validate_email(self, value):
-        if User.objects.filter(email=value).exists():
-            raise serializers.ValidationError('A user with this email address already exists.')
-        return value
+        # No pre-insert SELECT: the case-insensitive unique constraint decides, race-free, in create().
+        extra_kwargs = {'email': {'validators': []}}
 
     def create(self, validated_data):
         organization_name = validated_data.pop('organization_name', None)
-        user = User.objects.create_user(
-            email=validated_data['email'],
-            password=validated_data['password'],
-            first_name=validated_data.get('first_name', ''),
-            last_name=validated_data.get('last_name', '')
-        )
+        try:
+            with db_transaction.atomic():
+                user = User.objects.create_user(
+                    email=validated_data['email'],
+                    password=validated_data['password'],
+                    first_name=validated_data.get('first_name', ''),
+                    last_name=validated_data.get('last_name', '')
+                )
+        except IntegrityError:
+            raise serializers.ValidationError({'email': ['A user with this email address already exists.']})
         if organization_name:
             organization, created = Organization.objects.get_or_create(name=organization_name)
-            admin_role, _ = Role.objects.get_or_create(name='Admin', defaults={'description': 'Administrator with full access'})
-            Membership.objects.create(user=user, organization=organization, role=admin_role)
+            Membership.objects.create(user=user, organization=organization, role_id=_admin_role_id())
         return user
 
 
@@ -78,7 +109,8 @@ class AccountSerializer(serializers.ModelSerializer):
 
 
 class JournalEntrySerializer(serializers.ModelSerializer):
-    account = serializers.PrimaryKeyRelatedField(queryset=Account.objects.all())
+    # Only what the organization check and the entry insert read.
+    account = serializers.PrimaryKeyRelatedField(queryset=Account.objects.only('id', 'organization_id', 'name'))
 
     class Meta:
         model = JournalEntry
@@ -100,35 +132,56 @@ class TransactionSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('A transaction must have at least two journal entries.')
         return journal_entries_data
 
+    def validate(self, attrs):
+        # Balanced at validation time, in cents, so an unbalanced request never reaches create().
+        journal_entries_data = attrs.get('journal_entries_set', [])
+        total_debit_cents = sum(to_cents(entry_data.get('debit_amount', 0)) for entry_data in journal_entries_data)
+        total_credit_cents = sum(to_cents(entry_data.get('credit_amount', 0)) for entry_data in journal_entries_data)
+        if total_debit_cents != total_credit_cents:
+            raise serializers.ValidationError('Debits must equal Credits.')
+        return attrs
+
+    def _validate_entries(self, organization, journal_entries_data):
+        '''
+        Rejects entries whose accounts belong to another organization, naming all of them at once. The accounts were
+        loaded when the entries were parsed, so this compares ids rather than querying again.
+        '''
+        foreign_accounts = {
+            entry_data['account'] for entry_data in journal_entries_data if entry_data['account'].organization_id != organization.id
+        }
+        if foreign_accounts:
+            names = ', '.join(sorted(account.name for account in foreign_accounts))
+            raise serializers.ValidationError(f'Accounts invalid for org: {names}.')
+
     def create(self, validated_data):
         journal_entries_data = validated_data.pop('journal_entries_set')
         request = self.context.get('request')
-        organization = request.user.membership_set.first().organization
-        transaction = Transaction.objects.create(organization=organization, created_by=request.user, **validated_data)
-        total_debits = Decimal('0.00')
-        total_credits = Decimal('0.00')
-        try:
-            for entry_data in journal_entries_data:
-                account = entry_data['account']
-                if account.organization != organization:
-                    raise serializers.ValidationError(f'Account {account.name} invalid for org.')
-                JournalEntry.objects.create(transaction=transaction, **entry_data)
-                total_debits += entry_data.get('debit_amount', Decimal('0.00'))
-                total_credits += entry_data.get('credit_amount', Decimal('0.00'))
-            if total_debits != total_credits:
-                raise serializers.ValidationError('Debits must equal Credits.')
-        except serializers.ValidationError as e:
-            transaction.delete()
-            raise e
-        AuditLog.objects.create(
-            organization=organization,
-            user=request.user,
-            action='created_transaction',
-            details={'transaction_id': str(transaction.id)}
-        )
+        # perform_create() passes the organization to save(); other callers get it from the request.
+        organization = validated_data.pop('organization', None) or request_membership(request).organization
+        # Checked before anything is written, so a rejected request leaves nothing behind to delete.
+        self._validate_entries(organization, journal_entries_data)
+        with db_transaction.atomic():
+            transaction = Transaction.objects.create(organization=organization, created_by=request.user, **validated_data)
+            JournalEntry.bulk_create_validated(JournalEntry(transaction=transaction, **entry_data) for entry_data in journal_entries_data)
+            audit.queue(
+                request,
+                organization=organization,
+                user=request.user,
+                action='created_transaction',
+                details={'transaction_id': str(transaction.id)}
+            )
         return transaction
 
 
+class TransactionSummarySerializer(serializers.ModelSerializer):
+    '''A transaction without its journal entries, for embedding in other resources' listings.'''
+
+    class Meta:
+        model = Transaction
+        fields = ['id', 'date', 'description', 'reference_number', 'created_at']
+        read_only_fields = fields
+
+
 class AuditLogSerializer(serializers.ModelSerializer):
     user = UserDetailSerializer(read_only=True)
     organization = serializers.StringRelatedField(read_only=True)
@@ -148,26 +201,23 @@ class CustomerSerializer(serializers.ModelSerializer):
 
 
 class InvoiceItemSerializer(serializers.ModelSerializer):
+    # Writable so an invoice update can name the items it keeps; ignored when creating.
+    id = serializers.UUIDField(required=False)
 
     class Meta:
         model = InvoiceItem
         fields = ['id', 'description', 'quantity', 'unit_price', 'amount', 'tax_amount']
-        read_only_fields = ['id', 'amount']
+        read_only_fields = ['amount']
 
-    def validate(self, data):
-        if 'quantity' in data and 'unit_price' in data:
-            data['amount'] = data['quantity'] * data['unit_price']
-        elif self.instance:
-            quantity = data.get('quantity', self.instance.quantity)
-            unit_price = data.get('unit_price', self.instance.unit_price)
-            data['amount'] = quantity * unit_price
-        return data
+
+DEFAULT_ITEM_QUANTITY = InvoiceItem._meta.get_field('quantity').default
 
 
 class InvoiceSerializer(serializers.ModelSerializer):
     organization = serializers.PrimaryKeyRelatedField(read_only=True)
     created_by = UserDetailSerializer(read_only=True)
-    customer = serializers.PrimaryKeyRelatedField(queryset=Customer.objects.all())
+    # Only what validate_customer() and the GL posting's description read.
+    customer = serializers.PrimaryKeyRelatedField(queryset=Customer.objects.only('id', 'organization_id', 'name'))
     items = InvoiceItemSerializer(many=True)
     transaction = serializers.PrimaryKeyRelatedField(read_only=True)
 
@@ -198,74 +248,93 @@ class InvoiceSerializer(serializers.ModelSerializer):
             sales_tax_payable_acc = get_or_create_default_account(
                 organization, Account.LIABILITY, 'Sales Tax Payable', 'Sales Tax Payable (Default)', 'sales tax payable'
             )
+        # Amounts come from the invoice's own totals, in cents. The A/R debit is subtotal + total_tax, the
+        # expression behind the generated total_amount, which after a save would otherwise cost a query to reload.
+        # Totals are rounded to cents the way the columns store them.
+        subtotal_cents = to_cents(Decimal(invoice.subtotal).quantize(Decimal('0.01')))
+        total_tax_cents = to_cents(Decimal(invoice.total_tax).quantize(Decimal('0.01')))
+        debit_cents = subtotal_cents + total_tax_cents
+
         gl_transaction = Transaction.objects.create(
             organization=organization, date=invoice.issue_date,
             description=f'Invoice {invoice.invoice_number} to {invoice.customer.name}', created_by=user
         )
-        JournalEntry.objects.create(
-            transaction=gl_transaction, account=accounts_receivable_acc,
-            debit_amount=invoice.total_amount, description=f'A/R for Invoice {invoice.invoice_number}'
-        )
-        JournalEntry.objects.create(
-            transaction=gl_transaction, account=sales_revenue_acc,
-            credit_amount=invoice.subtotal, description=f'Sales revenue for Invoice {invoice.invoice_number}'
-        )
+        entries = [
+            JournalEntry(
+                transaction=gl_transaction, account=accounts_receivable_acc,
+                debit_amount=from_cents(debit_cents), description=f'A/R for Invoice {invoice.invoice_number}'
+            ),
+            JournalEntry(
+                transaction=gl_transaction, account=sales_revenue_acc,
+                credit_amount=from_cents(subtotal_cents), description=f'Sales revenue for Invoice {invoice.invoice_number}'
+            ),
+        ]
         if sales_tax_payable_acc and invoice.total_tax > Decimal('0.00'):
-            JournalEntry.objects.create(
+            entries.append(JournalEntry(
                 transaction=gl_transaction, account=sales_tax_payable_acc,
-                credit_amount=invoice.total_tax, description=f'Sales tax for Invoice {invoice.invoice_number}'
-            )
-        current_debits = sum(je.debit_amount for je in gl_transaction.journal_entries_set.all())
-        current_credits = sum(je.credit_amount for je in gl_transaction.journal_entries_set.all())
-        if current_debits != current_credits:
-            logger.error(f'GL Transaction for Invoice {invoice.id} unbalanced! Debits: {current_debits}, Credits: {current_credits}. Deleting GL transaction.')
-            gl_transaction.delete()
-            raise serializers.ValidationError('Failed to create a balanced GL transaction for the invoice.')
+                credit_amount=from_cents(total_tax_cents), description=f'Sales tax for Invoice {invoice.invoice_number}'
+            ))
+        JournalEntry.bulk_create_validated(entries)
         return gl_transaction
 
+    @staticmethod
+    def _item_totals(items_data):
+        '''Subtotal and total tax of the submitted items, in one pass; the same sums calculate_totals() reads back.'''
+        subtotal = Decimal('0.00')
+        total_tax = Decimal('0.00')
+        for item_data in items_data:
+            # quantity is optional; an item without one is saved with the model default, so it counts at that.
+            # Each line is rounded to cents the way the InvoiceItem.amount column rounds it, halves away from zero.
+            amount = item_data.get('quantity', DEFAULT_ITEM_QUANTITY) * item_data['unit_price']
+            subtotal += amount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            total_tax += item_data.get('tax_amount', Decimal('0.00'))
+        return subtotal, total_tax
+
     def validate_customer(self, customer):
         request = self.context.get('request')
         if request and hasattr(request, 'user') and request.user.is_authenticated:
-            membership = request.user.membership_set.first()
-            if membership and customer.organization != membership.organization:
+            membership = request_membership(request)
+            if membership and customer.organization_id != membership.organization_id:
                 raise serializers.ValidationError(f"Customer '{customer.name}' does not belong to your organization.")
         return customer
 
     def create(self, validated_data):
-        items_data = validated_data.pop('items')
+        items_data = [{field: value for field, value in item_data.items() if field != 'id'} for item_data in validated_data.pop('items')]
         request = self.context.get('request')
-        membership = request.user.membership_set.first()
-        if not membership:
-            raise serializers.ValidationError('User is not associated with any organization.')
-        organization = membership.organization
-        subtotal = sum(item['quantity'] * item['unit_price'] for item in items_data)
-        total_tax = sum(item.get('tax_amount', Decimal('0.00')) for item in items_data)
-        total_amount = subtotal + total_tax
-        invoice = Invoice.objects.create(
-            organization=organization, created_by=request.user,
-            subtotal=subtotal, total_tax=total_tax, total_amount=total_amount,
-            **validated_data
-        )
-        for item_data in items_data:
-            InvoiceItem.objects.create(invoice=invoice, **item_data)
-        if invoice.status == Invoice.SENT:
-            try:
-                gl_transaction = self._create_invoice_gl_transaction(invoice, request.user)
-                invoice.transaction = gl_transaction
-                invoice.save(update_fields=['transaction'])
-            except serializers.ValidationError as e:
-                invoice.delete()
-                raise e
-            except Exception as e:
-                invoice.delete()
-                logger.error(f'Unexpected error creating GL for invoice {invoice.id}: {e}')
-                raise serializers.ValidationError(f'Failed to create GL transaction for invoice: {str(e)}')
-        AuditLog.objects.create(
-            organization=organization,
-            user=request.user,
-            action='created_invoice',
-            details={'invoice_id': str(invoice.id), 'invoice_number': invoice.invoice_number, 'status': invoice.status}
-        )
+        # The views' perform_create() passes these to save(); other callers get them from the request.
+        organization = validated_data.pop('organization', None)
+        created_by = validated_data.pop('created_by', request.user)
+        if organization is None:
+            membership = request_membership(request)
+            if not membership:
+                raise serializers.ValidationError('User is not associated with any organization.')
+            organization = membership.organization
+        subtotal, total_tax = self._item_totals(items_data)
+        # One database transaction: if posting to the GL fails, the invoice and its items are rolled back with it.
+        with db_transaction.atomic():
+            invoice = Invoice.objects.create(
+                organization=organization, created_by=created_by,
+                subtotal=subtotal, total_tax=total_tax,
+                **validated_data
+            )
+            InvoiceItem.bulk_create_for_invoice(invoice, items_data)
+            if invoice.status == Invoice.SENT:
+                try:
+                    gl_transaction = self._create_invoice_gl_transaction(invoice, request.user)
+                    invoice.transaction = gl_transaction
+                    invoice.save(update_fields=['transaction'])
+                except serializers.ValidationError:
+                    raise
+                except Exception as e:
+                    logger.error(f'Unexpected error creating GL for invoice {invoice.id}: {e}')
+                    raise serializers.ValidationError(f'Failed to create GL transaction for invoice: {str(e)}')
+            audit.queue(
+                request,
+                organization=organization,
+                user=request.user,
+                action='created_invoice',
+                details={'invoice_id': str(invoice.id), 'invoice_number': invoice.invoice_number, 'status': invoice.status}
+            )
         return invoice
 
     def update(self, instance, validated_data):
@@ -278,34 +347,31 @@ class InvoiceSerializer(serializers.ModelSerializer):
         instance.due_date = validated_data.get('due_date', instance.due_date)
         instance.status = new_status
         instance.notes = validated_data.get('notes', instance.notes)
-        if items_data is not None:
-            instance.items.all().delete()
-            current_subtotal = Decimal('0.00')
-            current_total_tax = Decimal('0.00')
-            for item_data in items_data:
-                item_data['amount'] = item_data['quantity'] * item_data['unit_price']
-                current_subtotal += item_data['amount']
-                current_total_tax += item_data.get('tax_amount', Decimal('0.00'))
-                InvoiceItem.objects.create(invoice=instance, **item_data)
-            instance.subtotal = current_subtotal
-            instance.total_tax = current_total_tax
-            instance.total_amount = current_subtotal + current_total_tax
-        else:
-            instance.calculate_totals()
-        instance.save()
-        if original_status == Invoice.DRAFT and new_status == Invoice.SENT:
-            if not instance.transaction:
-                try:
-                    gl_transaction = self._create_invoice_gl_transaction(instance, self.context['request'].user)
-                    instance.transaction = gl_transaction
-                    instance.save(update_fields=['transaction'])
-                except Exception as e:
-                    logger.error(f'Failed to create GL transaction for invoice {instance.id} on status change to SENT: {e}')
-                    pass
-        AuditLog.objects.create(
-            organization=instance.organization, user=self.context['request'].user, action='updated_invoice',
-            details={'invoice_id': str(instance.id), 'invoice_number': instance.invoice_number, 'new_status': new_status}
-        )
+        with db_transaction.atomic():
+            if items_data is not None:
+                InvoiceItem.replace_for_invoice(instance, items_data)
+                instance.subtotal, instance.total_tax = self._item_totals(items_data)
+            else:
+                instance.calculate_totals()
+            instance.save(update_fields=[
+                'customer', 'invoice_number', 'issue_date', 'due_date', 'status', 'notes', 'subtotal', 'total_tax', 'updated_at'
+            ])
+            if original_status == Invoice.DRAFT and new_status == Invoice.SENT:
+                if not instance.transaction:
+                    try:
+                        # A savepoint, so a failed posting is undone on its own and the update still saves.
+                        with db_transaction.atomic():
+                            gl_transaction = self._create_invoice_gl_transaction(instance, self.context['request'].user)
+                            instance.transaction = gl_transaction
+                            instance.save(update_fields=['transaction'])
+                    except Exception as e:
+                        instance.transaction = None
+                        logger.error(f'Failed to create GL transaction for invoice {instance.id} on status change to SENT: {e}')
+            audit.queue(
+                self.context['request'],
+                organization=instance.organization, user=self.context['request'].user, action='updated_invoice',
+                details={'invoice_id': str(instance.id), 'invoice_number': instance.invoice_number, 'new_status': new_status}
+            )
         return instance
 
 
@@ -359,7 +425,7 @@ class ReconciliationRuleSerializer(serializers.ModelSerializer):
 class StagedBankTransactionSerializer(serializers.ModelSerializer):
     organization = serializers.PrimaryKeyRelatedField(read_only=True)
     plaid_item = PlaidItemSerializer(read_only=True, allow_null=True)
-    linked_transaction = TransactionSerializer(read_only=True, allow_null=True)
+    linked_transaction = TransactionSummarySerializer(read_only=True, allow_null=True)
     applied_rule = ReconciliationRuleSerializer(read_only=True, allow_null=True)
     suggested_matches = serializers.JSONField(read_only=True, allow_null=True)
 
@@ -375,6 +441,12 @@ class StagedBankTransactionSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'organization', 'plaid_item', 'imported_at', 'raw_data', 'applied_rule', 'suggested_matches']
 
+
+class StagedBankTransactionListSerializer(StagedBankTransactionSerializer):
+    '''StagedBankTransactionSerializer for listings: the Plaid item and applied rule are ids, not nested objects.'''
+    plaid_item = serializers.PrimaryKeyRelatedField(read_only=True)
+    applied_rule = serializers.PrimaryKeyRelatedField(read_only=True)
+
 # Payroll Serializers
 
 
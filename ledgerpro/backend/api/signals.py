@@ -0,0 +1,63 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from .models import Account, JournalEntry, Role, Transaction
+from .account_utils import apply_journal_entry_to_snapshots, invalidate_default_account_cache
+from .serializers import invalidate_admin_role_cache
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def invalidate_default_accounts_on_change(sender, instance, **kwargs):
+    # Renames, deactivations and deletes can change which account is the default.
+    invalidate_default_account_cache(instance.organization_id)
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def invalidate_admin_role_on_change(sender, instance, **kwargs):
+    # A rename or delete can change which role, if any, is named Admin.
+    invalidate_admin_role_cache()
+
+
+@receiver(pre_save, sender=JournalEntry)
+def remember_previous_journal_entry(sender, instance, **kwargs):
+    # The UUID pk is set before the first save, so _state.adding tells inserts from updates.
+    instance._snapshot_previous = None
+    if not instance._state.adding:
+        instance._snapshot_previous = (
+            JournalEntry.objects.filter(pk=instance.pk)
+            .values_list('account_id', 'transaction_date', 'debit_amount', 'credit_amount')
+            .first()
+        )
+
+
+@receiver(post_save, sender=JournalEntry)
+def update_balance_snapshots_on_entry_save(sender, instance, **kwargs):
+    previous = getattr(instance, '_snapshot_previous', None)
+    if previous is not None:
+        account_id, entry_date, debit_amount, credit_amount = previous
+        apply_journal_entry_to_snapshots(account_id, entry_date, -debit_amount, -credit_amount)
+    apply_journal_entry_to_snapshots(instance.account_id, instance.transaction_date, instance.debit_amount, instance.credit_amount)
+
+
+@receiver(pre_delete, sender=JournalEntry)
+def update_balance_snapshots_on_entry_delete(sender, instance, **kwargs):
+    apply_journal_entry_to_snapshots(instance.account_id, instance.transaction_date, -instance.debit_amount, -instance.credit_amount)
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_previous_transaction_date(sender, instance, **kwargs):
+    instance._snapshot_previous_date = None
+    if not instance._state.adding:
+        instance._snapshot_previous_date = Transaction.objects.filter(pk=instance.pk).values_list('date', flat=True).first()
+
+
+@receiver(post_save, sender=Transaction)
+def move_balance_snapshots_on_date_change(sender, instance, **kwargs):
+    previous_date = getattr(instance, '_snapshot_previous_date', None)
+    if previous_date is None or previous_date == instance.date:
+        return
+    instance.journal_entries_set.update(transaction_date=instance.date)
+    for account_id, debit_amount, credit_amount in instance.journal_entries_set.values_list('account_id', 'debit_amount', 'credit_amount'):
+        apply_journal_entry_to_snapshots(account_id, previous_date, -debit_amount, -credit_amount)
+        apply_journal_entry_to_snapshots(account_id, instance.date, debit_amount, credit_amount)
@@ -0,0 +1,80 @@
+from celery import group, shared_task
+from .models import Invoice, AuditLog, PlaidItem
+from . import email_utils, plaid_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InvoiceEmailDeliveryError(Exception):
+    '''Raised when SendGrid does not accept an invoice email, so the task is retried.'''
+
+
+class PlaidSyncError(Exception):
+    '''Raised when a Plaid transactions sync fails, so the task is retried.'''
+
+
+@shared_task(bind=True, autoretry_for=(InvoiceEmailDeliveryError,), retry_backoff=True, max_retries=5)
+def send_invoice_email_task(self, invoice_id, user_id=None):
+    '''
+    Sends an invoice email in a worker, then marks a draft invoice as sent and records an audit log.
+    Takes ids rather than model instances so nothing stale crosses the broker.
+    '''
+    # Items are streamed while rendering rather than prefetched; one invoice may have thousands of lines.
+    invoice = email_utils.prepare_invoices_for_email(Invoice.objects.filter(id=invoice_id), prefetch_items=False).first()
+    if invoice is None:
+        logger.warning('Invoice %s no longer exists. Email not sent.', invoice_id)
+        return False
+    if invoice.status in (Invoice.PAID, Invoice.VOID):
+        logger.info('Invoice %s is %s. Email not sent.', invoice.invoice_number, invoice.status)
+        return False
+    if not invoice.customer.email:
+        logger.warning('Customer %s has no email address. Invoice %s not sent.', invoice.customer.name, invoice.invoice_number)
+        return False
+
+    if not email_utils.send_invoice_email(invoice):
+        raise InvoiceEmailDeliveryError(f'SendGrid did not accept invoice {invoice.invoice_number}.')
+
+    if invoice.status == Invoice.DRAFT:
+        invoice.status = Invoice.SENT
+        invoice.save(update_fields=['status'])
+
+    AuditLog.objects.create(
+        organization=invoice.organization,
+        user_id=user_id,
+        action='sent_invoice_email',
+        details={'invoice_id': str(invoice.id), 'invoice_number': invoice.invoice_number, 'customer_email': invoice.customer.email}
+    )
+    return True
+
+
+def queue_invoice_emails(invoice_ids, user_id=None):
+    '''Fans out one send_invoice_email_task per invoice id across the workers.'''
+    return group(send_invoice_email_task.s(str(invoice_id), user_id) for invoice_id in invoice_ids).apply_async()
+
+
+@shared_task(bind=True, autoretry_for=(PlaidSyncError,), retry_backoff=True, max_retries=5)
+def sync_plaid_item_task(self, plaid_item_id):
+    '''Syncs one PlaidItem's transactions in a worker; routed to the plaid_sync queue since it mostly waits on Plaid.'''
+    plaid_item = PlaidItem.objects.select_related('organization').filter(id=plaid_item_id).first()
+    if plaid_item is None:
+        logger.warning('PlaidItem %s no longer exists. Sync skipped.', plaid_item_id)
+        return None
+    added_count = plaid_service.fetch_plaid_transactions(plaid_item)
+    if added_count < 0:
+        raise PlaidSyncError(f'Plaid sync failed for item {plaid_item.item_id}.')
+    return added_count
+
+
+def queue_plaid_syncs(plaid_item_ids):
+    '''Fans out one sync_plaid_item_task per PlaidItem id, so an organization's items sync in parallel.'''
+    return group(sync_plaid_item_task.s(str(plaid_item_id)) for plaid_item_id in plaid_item_ids).apply_async()
+
+
+@shared_task
+def sync_all_plaid_items_task():
+    '''Periodic (beat) entry point that queues a sync for every linked PlaidItem.'''
+    plaid_item_ids = list(PlaidItem.objects.values_list('id', flat=True))
+    if plaid_item_ids:
+        queue_plaid_syncs(plaid_item_ids)
+    return len(plaid_item_ids)
@@ -0,0 +1,71 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from api.account_utils import get_or_create_default_account, invalidate_default_account_cache
+from api.models import Organization, Account
+
+
+class GetOrCreateDefaultAccountTests(TestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(name='Account Utils Org')
+
+    def test_exact_name_wins_over_substring_match(self):
+        Account.objects.create(organization=self.organization, name='Old Wages Payable', type=Account.LIABILITY)
+        exact = Account.objects.create(organization=self.organization, name='Wages Payable (Default)', type=Account.LIABILITY)
+
+        with self.assertNumQueries(1):
+            account = get_or_create_default_account(self.organization, Account.LIABILITY, 'Wages Payable', 'Wages Payable (Default)')
+        self.assertEqual(account, exact)
+        self.assertIn('description', account.get_deferred_fields())
+
+    def test_substring_match_is_used_when_no_exact_name(self):
+        existing = Account.objects.create(organization=self.organization, name='Trade Accounts Receivable', type=Account.ASSET)
+
+        account = get_or_create_default_account(self.organization, Account.ASSET, 'Accounts Receivable', 'Accounts Receivable (Default)')
+        self.assertEqual(account, existing)
+
+    def test_inactive_and_other_type_accounts_are_ignored(self):
+        Account.objects.create(organization=self.organization, name='Legacy Sales Revenue', type=Account.REVENUE, is_active=False)
+        Account.objects.create(organization=self.organization, name='Sales Revenue', type=Account.EXPENSE)
+
+        account = get_or_create_default_account(self.organization, Account.REVENUE, 'Sales Revenue', 'Sales Revenue (Default)', 'sales revenue')
+        self.assertEqual(account.name, 'Sales Revenue (Default)')
+        self.assertTrue(account.is_active)
+        self.assertEqual(Account.objects.filter(organization=self.organization, type=Account.REVENUE, is_active=True).count(), 1)
+
+    def test_existing_default_name_is_reused_when_create_conflicts(self):
+        inactive = Account.objects.create(organization=self.organization, name='Wages Payable (Default)', type=Account.LIABILITY, is_active=False)
+
+        account = get_or_create_default_account(self.organization, Account.LIABILITY, 'Wages Payable', 'Wages Payable (Default)')
+        self.assertEqual(account, inactive)
+        self.assertEqual(Account.objects.filter(organization=self.organization, type=Account.LIABILITY).count(), 1)
+
+
+class DefaultAccountCacheTests(TestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(name='Account Cache Org')
+        invalidate_default_account_cache()
+
+    def _lookup(self):
+        return get_or_create_default_account(self.organization, Account.EXPENSE, 'Payroll Expense', 'Payroll Expenses (Default)', 'payroll expense')
+
+    def test_committed_lookup_is_served_from_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            account = self._lookup()
+
+        with self.assertNumQueries(0):
+            cached = self._lookup()
+        self.assertEqual(cached, account)
+        self.assertEqual(cached.name, 'Payroll Expenses (Default)')
+        self.assertEqual(cached.organization_id, self.organization.id)
+
+    def test_account_change_invalidates_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            account = self._lookup()
+        account.name = 'Payroll Expenses (Renamed)'
+        account.save(update_fields=['name'])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self._lookup().name, 'Payroll Expenses (Renamed)')
+        self.assertGreater(len(queries), 0)
@@ -0,0 +1,62 @@
+from django.db import IntegrityError, connection, transaction as db_transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from api import audit
+from api.models import AuditLog, Customer, Invoice, Membership, Organization, Role, User
+
+
+class AuditQueueTests(TransactionTestCase):  # Queued entries wait for real commits
+    def setUp(self):
+        self.user = User.objects.create_user(email='audituser@example.com', password='password123')
+        self.organization = Organization.objects.create(name='Audit Org')
+
+    def _respond(self, view):
+        return audit.AuditLogMiddleware(view)(RequestFactory().post('/api/example/'))
+
+    def test_entries_are_written_in_one_insert_after_the_response(self):
+        def view(request):
+            with db_transaction.atomic():
+                audit.queue(request, organization=self.organization, user=self.user, action='first')
+            audit.queue(request, organization=self.organization, user=self.user, action='second')
+            self.assertFalse(AuditLog.objects.exists())
+            return HttpResponse()
+
+        with CaptureQueriesContext(connection) as queries:
+            self._respond(view)
+        self.assertEqual(sum('INSERT INTO "api_auditlog"' in query['sql'] for query in queries), 1)
+        self.assertCountEqual(AuditLog.objects.values_list('action', flat=True), ['first', 'second'])
+
+    def test_rolled_back_write_leaves_no_entry(self):
+        def view(request):
+            try:
+                with db_transaction.atomic():
+                    audit.queue(request, organization=self.organization, user=self.user, action='rolled_back')
+                    raise IntegrityError('write failed')
+            except IntegrityError:
+                pass
+            return HttpResponse()
+
+        self._respond(view)
+        self.assertFalse(AuditLog.objects.exists())
+
+    def test_entry_is_saved_immediately_outside_a_request(self):
+        audit.queue(None, organization=self.organization, action='from_a_task')
+        self.assertTrue(AuditLog.objects.filter(action='from_a_task').exists())
+
+    def test_api_writes_are_audited(self):
+        Membership.objects.create(user=self.user, organization=self.organization, role=Role.objects.create(name='Clerk'))
+        customer = Customer.objects.create(organization=self.organization, name='Audited Customer')
+        client = APIClient()
+        client.force_authenticate(user=self.user)  # The API authenticates by JWT only, not by session
+        response = client.post(reverse('invoice-list-create'), {
+            'customer': str(customer.id), 'invoice_number': 'INV-AUDIT-1', 'issue_date': '2024-01-01',
+            'due_date': '2024-01-31', 'status': Invoice.DRAFT,
+            'items': [{'description': 'Audit', 'quantity': '1.00', 'unit_price': '10.00'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        log = AuditLog.objects.get(action='created_invoice')
+        self.assertEqual((log.organization_id, log.user_id), (self.organization.id, self.user.id))
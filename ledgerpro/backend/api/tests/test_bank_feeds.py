@@ -1,3 +1,6 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -6,8 +9,9 @@ from decimal import Decimal
 from datetime import date
 import io  # For creating in-memory file for CSV upload
 
+from api import plaid_service
 from api.models import (
-    User, Organization, Role, Membership, PlaidItem, StagedBankTransaction
+    User, Organization, Role, Membership, PlaidItem, StagedBankTransaction, ReconciliationRule, Transaction
 )
 # Assuming plaid_service.get_plaid_client can be mocked if not already done by other tests
 # from api.plaid_service import get_plaid_client  # Not strictly needed if mocking at service call level
@@ -58,12 +62,12 @@ class MockPlaidTransaction:
 
 
 class MockPlaidTransactionsSyncResponse:
-    def __init__(self, added_txs, next_cursor):
+    def __init__(self, added_txs, next_cursor, has_more=False):
         self.added = added_txs
         self.modified = []
         self.removed = []
         self.next_cursor = next_cursor
-        self.has_more = True
+        self.has_more = has_more
         self.request_id = 'mock_sync_request_id'
 
     def to_dict(self):
@@ -82,7 +86,7 @@ class BankFeedsAPITests(APITestCase):
         self.role = Role.objects.create(name='AccountantBF')
         Membership.objects.create(user=self.user, organization=self.organization, role=self.role)
 
-        self.client.login(email='bankfeeduser@example.com', password='password123')
+        self.client.force_authenticate(user=self.user)  # The API authenticates by JWT only, not by session
 
         self.create_link_token_url = reverse('plaid-create-link-token')
         self.exchange_public_token_url = reverse('plaid-exchange-public-token')
@@ -117,6 +121,7 @@ class BankFeedsAPITests(APITestCase):
         self.assertTrue(PlaidItem.objects.filter(organization=self.organization, item_id='mock_item_id').exists())
         plaid_item = PlaidItem.objects.get(item_id='mock_item_id')
         self.assertEqual(plaid_item.access_token, 'mock_access_token')
+        self.assertNotIn('mock_access_token', plaid_item.access_token_encrypted)
         self.assertEqual(plaid_item.institution_name, 'Mock Bank')
 
     @mock.patch('api.plaid_service.get_plaid_client')
@@ -152,6 +157,42 @@ class BankFeedsAPITests(APITestCase):
         self.assertEqual(plaid_item.sync_cursor, 'new_cursor_123')
         self.assertEqual(plaid_item.last_successful_sync, mock_timezone_now.return_value)
 
+    @override_settings(PLAID_PERSIST_RAW=True)
+    @mock.patch('api.plaid_service.get_plaid_client')
+    def test_fetch_plaid_transactions_follows_has_more(self, mock_get_plaid_client):
+        mock_plaid_api_instance = mock_get_plaid_client.return_value
+        plaid_item = PlaidItem.objects.create(
+            organization=self.organization, user=self.user,
+            access_token='paged_access_token', item_id='paged_item_id'
+        )
+        mock_plaid_api_instance.transactions_sync.side_effect = [
+            MockPlaidTransactionsSyncResponse([MockPlaidTransaction('tx1', 'acc1', 'Rent', -900.00, '2023-10-01')], 'cursor_1', has_more=True).to_dict(),
+            MockPlaidTransactionsSyncResponse([MockPlaidTransaction('tx2', 'acc1', 'Refund', 15.00, '2023-10-02')], 'cursor_2').to_dict(),
+        ]
+
+        self.assertEqual(plaid_service.fetch_plaid_transactions(plaid_item), 2)
+
+        requests = [call.args[0] for call in mock_plaid_api_instance.transactions_sync.call_args_list]
+        self.assertEqual([request.get('cursor') for request in requests], [None, 'cursor_1'])
+        plaid_item.refresh_from_db()
+        self.assertEqual(plaid_item.sync_cursor, 'cursor_2')
+        self.assertEqual(StagedBankTransaction.objects.get(transaction_id_source='tx1').raw_data['date'], '2023-10-01')
+
+    @override_settings(PLAID_PERSIST_RAW=False)
+    @mock.patch('api.plaid_service.get_plaid_client')
+    def test_fetch_plaid_transactions_keeps_slim_raw_data_by_default(self, mock_get_plaid_client):
+        plaid_item = PlaidItem.objects.create(
+            organization=self.organization, user=self.user,
+            access_token='slim_access_token', item_id='slim_item_id'
+        )
+        mock_get_plaid_client.return_value.transactions_sync.return_value = MockPlaidTransactionsSyncResponse(
+            [MockPlaidTransaction('tx1', 'acc1', 'Lunch', -12.00, '2023-10-03', pending=True, category=['Food'])], 'cursor_1'
+        ).to_dict()
+
+        response = self.client.post(self.fetch_transactions_url, {'plaid_item_id': str(plaid_item.id)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(StagedBankTransaction.objects.get(transaction_id_source='tx1').raw_data, {'category': ['Food'], 'pending': True})
+
     def test_manual_csv_import_success(self):
         csv_content = (
             'Date,Description,Amount,Currency\n'
@@ -170,6 +211,8 @@ class BankFeedsAPITests(APITestCase):
         tx1 = StagedBankTransaction.objects.get(name='Vendor Payment')
         self.assertEqual(tx1.amount, Decimal('-150.75'))
         self.assertEqual(tx1.date, date(2023, 11, 1))
+        self.assertEqual(tx1.raw_data, {'Date': '2023-11-01', 'Description': 'Vendor Payment', 'Amount': '-150.75', 'Currency': 'USD'})
+        self.assertEqual(StagedBankTransaction.objects.without_bulky().get(pk=tx1.pk).get_deferred_fields(), {'raw_data_zstd'})
 
     def test_manual_csv_import_partial_failure(self):
         csv_content = (
@@ -193,3 +236,33 @@ class BankFeedsAPITests(APITestCase):
         response = self.client.post(self.manual_import_url, {}, format='multipart')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('No file provided', response.data['error'])
+
+    def test_staged_transaction_list_query_count_does_not_grow_with_rows(self):
+        rule = ReconciliationRule.objects.create(organization=self.organization, name='Coffee', conditions=[], actions=[], created_by=self.user)
+        url = reverse('staged-bank-transaction-list')
+
+        def list_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response, len(queries)
+
+        def stage(number):
+            ledger_tx = Transaction.objects.create(organization=self.organization, date=date(2023, 11, 1), description=f'Coffee {number}')
+            StagedBankTransaction.objects.create(
+                organization=self.organization, transaction_id_source=f'csv-{number}', date=date(2023, 11, number),
+                name=f'Coffee {number}', amount=Decimal('-12.50'), source='CSV', applied_rule=rule,
+                linked_transaction=ledger_tx, reconciliation_status=StagedBankTransaction.RECON_MATCHED,
+            )
+
+        stage(1)
+        _, queries_for_one = list_queries()
+        for number in range(2, 5):
+            stage(number)
+        response, queries_for_four = list_queries()
+
+        self.assertEqual(queries_for_four, queries_for_one)
+        self.assertEqual(len(response.data), 4)
+        self.assertEqual(response.data[0]['applied_rule'], rule.id)
+        self.assertIsNone(response.data[0]['plaid_item'])
+        self.assertEqual(response.data[0]['linked_transaction']['description'], 'Coffee 4')
@@ -1,8 +1,14 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction as db_transaction
 from decimal import Decimal
 from datetime import date  # timedelta removed (F401)
-from api.models import Organization, Account, Transaction, JournalEntry, User
+from unittest import mock
+from rest_framework import serializers
+from api.models import Organization, Account, Transaction, JournalEntry, User, Role, Membership, uuid7
+from api import account_utils
+from api.serializers import TransactionSerializer
 
 
 class CoreAccountingModelTests(TestCase):
@@ -72,6 +78,66 @@ class CoreAccountingModelTests(TestCase):
         # Test Asset account activity for January (should be +200 - 30 = 170)
         self.assertEqual(self.asset_acc.get_period_activity(jan_start, jan_end), Decimal('170.00'))
 
+    def test_balance_and_period_activity_use_one_query_each(self):
+        tx = Transaction.objects.create(organization=self.organization, date=date(2023, 3, 1), description='Mar Sale', created_by=self.user)
+        JournalEntry.objects.create(transaction=tx, account=self.asset_acc, debit_amount=Decimal('75.00'))
+        JournalEntry.objects.create(transaction=tx, account=self.revenue_acc, credit_amount=Decimal('75.00'))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.asset_acc.get_balance(), Decimal('75.00'))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revenue_acc.get_period_activity(date(2023, 3, 1), date(2023, 3, 31)), Decimal('75.00'))
+
+    def test_balance_snapshots_follow_entry_and_transaction_changes(self):
+        tx_jan = Transaction.objects.create(organization=self.organization, date=date(2023, 1, 10), description='Jan Sale', created_by=self.user)
+        JournalEntry.objects.create(transaction=tx_jan, account=self.asset_acc, debit_amount=Decimal('100.00'))
+        tx_feb = Transaction.objects.create(organization=self.organization, date=date(2023, 2, 10), description='Feb Refund', created_by=self.user)
+        refund = JournalEntry.objects.create(transaction=tx_feb, account=self.asset_acc, credit_amount=Decimal('40.00'))
+        self.assertEqual(self.asset_acc.get_balance(), Decimal('60.00'))
+        self.assertEqual(self.asset_acc.get_balance(date_to=date(2023, 1, 31)), Decimal('100.00'))
+
+        # Back-dating the refund moves its amounts into January's running totals.
+        tx_feb.date = date(2023, 1, 5)
+        tx_feb.save()
+        self.assertEqual(self.asset_acc.get_balance(date_to=date(2023, 1, 5)), Decimal('-40.00'))
+        self.assertEqual(self.asset_acc.get_balance(date_to=date(2023, 1, 31)), Decimal('60.00'))
+        self.assertEqual(self.asset_acc.get_period_activity(date(2023, 2, 1), date(2023, 2, 28)), Decimal('0.00'))
+
+        refund.credit_amount = Decimal('25.00')
+        refund.save()
+        self.assertEqual(self.asset_acc.get_balance(), Decimal('75.00'))
+
+        tx_jan.delete()
+        self.assertEqual(self.asset_acc.get_balance(), Decimal('-25.00'))
+        self.assertEqual(self.asset_acc.get_balance(date_to=date(2022, 12, 31)), Decimal('0.00'))
+
+    def test_bulk_created_entries_are_validated_and_reach_balances(self):
+        tx = Transaction.objects.create(organization=self.organization, date=date(2023, 4, 1), description='Bulk', created_by=self.user)
+        with self.assertRaises(ValidationError):
+            JournalEntry.bulk_create_validated([
+                JournalEntry(transaction=tx, account=self.asset_acc, debit_amount=Decimal('10.00')),
+                JournalEntry(transaction=tx, account=self.revenue_acc),
+            ])
+        self.assertFalse(JournalEntry.objects.filter(transaction=tx).exists())
+
+        JournalEntry.bulk_create_validated([
+            JournalEntry(transaction=tx, account=self.asset_acc, debit_amount=Decimal('10.00')),
+            JournalEntry(transaction=tx, account=self.asset_acc, debit_amount=Decimal('5.00')),
+            JournalEntry(transaction=tx, account=self.revenue_acc, credit_amount=Decimal('15.00')),
+        ])
+        self.assertEqual(self.asset_acc.get_balance(), Decimal('15.00'))
+        self.assertEqual(self.revenue_acc.get_balance(date_to=date(2023, 4, 1)), Decimal('15.00'))
+        self.assertEqual(JournalEntry.objects.filter(organization=self.organization, transaction=tx).count(), 3)
+
+    def test_journal_entry_ids_are_time_ordered(self):
+        tx = Transaction.objects.create(organization=self.organization, date=date(2023, 5, 1), description='Ids', created_by=self.user)
+        entry = JournalEntry.objects.create(transaction=tx, account=self.asset_acc, debit_amount=Decimal('1.00'))
+
+        self.assertEqual(entry.organization_id, self.organization.id)
+        self.assertEqual(entry.transaction_date, tx.date)
+        self.assertEqual(entry.id.version, 7)
+        self.assertLessEqual(entry.id.int >> 80, uuid7().int >> 80)  # timestamp prefix never goes backwards
+
     def test_journal_entry_validation(self):
         tx = Transaction.objects.create(organization=self.organization, date=date.today(), description='Test JE Validation', created_by=self.user)
 
@@ -89,6 +155,14 @@ class CoreAccountingModelTests(TestCase):
         with self.assertRaises(ValidationError):
             JournalEntry(transaction=tx, account=self.asset_acc, debit_amount=0, credit_amount=0).clean()
 
+    def test_journal_entry_constraints_enforced_on_save(self):
+        tx = Transaction.objects.create(organization=self.organization, date=date.today(), description='Test JE Constraints', created_by=self.user)
+
+        for amounts in ({'debit_amount': 10, 'credit_amount': 10}, {'debit_amount': -10}, {'credit_amount': -10}, {}):
+            with self.subTest(**amounts), self.assertRaises(IntegrityError), db_transaction.atomic():
+                JournalEntry.objects.create(transaction=tx, account=self.asset_acc, **amounts)
+        self.assertFalse(JournalEntry.objects.filter(transaction=tx).exists())
+
     def test_transaction_double_entry_validation_in_model_clean(self):
         ''' Test Transaction.clean() method for double-entry integrity. '''
         tx = Transaction(organization=self.organization, date=date.today(), description='Balanced TX', created_by=self.user)
@@ -98,7 +172,8 @@ class CoreAccountingModelTests(TestCase):
         JournalEntry.objects.create(transaction=tx, account=self.revenue_acc, credit_amount=Decimal('100.00'))
 
         try:
-            tx.clean()
+            with self.assertNumQueries(1):
+                tx.clean()
         except ValidationError:
             self.fail('Transaction.clean() raised ValidationError unexpectedly for balanced transaction.')
 
@@ -109,3 +184,65 @@ class CoreAccountingModelTests(TestCase):
 
         with self.assertRaisesRegex(ValidationError, 'Debits must equal Credits for the transaction.'):
             tx_unbalanced.clean()
+
+    def test_unbalanced_transaction_is_rejected_at_validation(self):
+        Membership.objects.create(user=self.user, organization=self.organization, role=Role.objects.create(name='Bookkeeper'))
+        serializer = TransactionSerializer(data={
+            'date': '2024-01-15', 'description': 'Unbalanced',
+            'journal_entries_set': [
+                {'account': str(self.asset_acc.id), 'debit_amount': '100.00'},
+                {'account': str(self.revenue_acc.id), 'credit_amount': '90.00'},
+            ],
+        }, context={'request': mock.Mock(user=self.user)})
+
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['non_field_errors'], ['Debits must equal Credits.'])
+        self.assertFalse(Transaction.objects.filter(description='Unbalanced').exists())
+
+    def test_transaction_entries_from_another_organization_are_all_named(self):
+        Membership.objects.create(user=self.user, organization=self.organization, role=Role.objects.create(name='Clerk'))
+        other_org = Organization.objects.create(name='Other Org')
+        other_bank = Account.objects.create(organization=other_org, name='Other Bank', type=Account.ASSET)
+        other_sales = Account.objects.create(organization=other_org, name='Other Sales', type=Account.REVENUE)
+        serializer = TransactionSerializer(data={
+            'date': '2024-01-15', 'description': 'Cross-org',
+            'journal_entries_set': [
+                {'account': str(other_bank.id), 'debit_amount': '10.00'},
+                {'account': str(other_sales.id), 'credit_amount': '10.00'},
+            ],
+        }, context={'request': mock.Mock(user=self.user)})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+        with self.assertRaisesRegex(serializers.ValidationError, 'Other Bank, Other Sales'):
+            serializer.save()
+
+
+class AccountBalanceCacheTests(TransactionTestCase):
+    # Balances are only cached outside a transaction, which TestCase always wraps tests in.
+    def test_balance_cached_until_next_entry(self):
+        organization = Organization.objects.create(name='Balance Cache Org')
+        bank = Account.objects.create(organization=organization, name='Bank', type=Account.ASSET)
+        sales = Account.objects.create(organization=organization, name='Sales', type=Account.REVENUE)
+        tx = Transaction.objects.create(organization=organization, date=date(2023, 6, 1), description='Sale')
+        JournalEntry.objects.create(transaction=tx, account=bank, debit_amount=Decimal('20.00'))
+
+        self.assertEqual(bank.get_balance(), Decimal('20.00'))
+        with self.assertNumQueries(0):
+            self.assertEqual(bank.get_balance(), Decimal('20.00'))
+
+        JournalEntry.objects.create(transaction=tx, account=bank, debit_amount=Decimal('5.00'))
+        JournalEntry.objects.create(transaction=tx, account=sales, credit_amount=Decimal('25.00'))
+        self.assertEqual(bank.get_balance(), Decimal('25.00'))
+        self.assertEqual(bank.get_balance(date_to=date(2023, 5, 31)), Decimal('0.00'))
+
+    def test_balance_cache_follows_versions_bumped_by_other_workers(self):
+        organization = Organization.objects.create(name='Shared Version Org')
+        bank = Account.objects.create(organization=organization, name='Bank', type=Account.ASSET)
+        tx = Transaction.objects.create(organization=organization, date=date(2023, 6, 1), description='Sale')
+        JournalEntry.objects.create(transaction=tx, account=bank, debit_amount=Decimal('20.00'))
+        self.assertEqual(bank.get_balance(), Decimal('20.00'))
+
+        # What a posting in another process does: only the shared cache changes, not this process's memo.
+        cache.incr(account_utils._balance_version_key(bank.id))
+        with self.assertNumQueries(1):
+            self.assertEqual(bank.get_balance(), Decimal('20.00'))
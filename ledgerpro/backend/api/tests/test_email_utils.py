@@ -0,0 +1,160 @@
+from django.test import TestCase, override_settings
+from unittest import mock
+from decimal import Decimal
+from datetime import date
+import json
+import httpx
+
+from api import email_utils
+from api.models import Organization, Customer, Invoice, InvoiceItem
+
+
+@override_settings(SENDGRID_API_KEY='SG.test-key')
+class BulkEmailTests(TestCase):
+    def setUp(self):
+        email_utils._SG_CLIENT = None
+
+    def _messages(self, count):
+        return [
+            {'to_email': f'customer{i}@example.com', 'subject': f'Invoice {i}', 'html_content': f'<p>Invoice {i}</p>'}
+            for i in range(count)
+        ]
+
+    def _mock_sendgrid(self, handler):
+        '''Routes the bulk sender's async client through handler instead of the network; returns the captured requests.'''
+        requests = []
+
+        def record(request):
+            requests.append(request)
+            return handler(request)
+
+        def client():
+            return httpx.AsyncClient(transport=httpx.MockTransport(record), headers={'Authorization': 'Bearer SG.test-key'})
+
+        patcher = mock.patch('api.email_utils._sendgrid_async_client', client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return requests
+
+    def test_send_bulk_email_batches_personalizations(self):
+        requests = self._mock_sendgrid(lambda request: httpx.Response(202))
+
+        results = email_utils.send_bulk_email(self._messages(email_utils.BULK_EMAIL_BATCH_SIZE + 1))
+
+        self.assertEqual(results, [True] * (email_utils.BULK_EMAIL_BATCH_SIZE + 1))
+        sent_mails = [json.loads(request.content) for request in requests]
+        self.assertEqual(sorted(len(m['personalizations']) for m in sent_mails), [1, email_utils.BULK_EMAIL_BATCH_SIZE])
+        self.assertEqual(sent_mails[0]['content'][0]['value'], email_utils.HTML_BODY_SUBSTITUTION_TAG)
+        self.assertEqual(str(requests[0].url), email_utils.SENDGRID_MAIL_SEND_URL)
+
+    @mock.patch('api.email_utils.SendGridAPIClient')
+    def test_sendgrid_client_is_reused_across_sends(self, mock_client_cls):
+        mock_client_cls.return_value.send.return_value = mock.Mock(status_code=202)
+
+        email_utils.send_email('a@example.com', 'One', '<p>1</p>')
+        email_utils.send_email('b@example.com', 'Two', '<p>2</p>')
+
+        mock_client_cls.assert_called_once_with('SG.test-key')
+        self.assertEqual(mock_client_cls.return_value.send.call_count, 2)
+
+    def test_send_bulk_email_reports_failed_batch(self):
+        def fail(request):
+            raise httpx.ConnectError('boom')
+
+        self._mock_sendgrid(fail)
+        self.assertEqual(email_utils.send_bulk_email(self._messages(2)), [False, False])
+
+    def test_oversized_body_is_sent_individually(self):
+        requests = self._mock_sendgrid(lambda request: httpx.Response(202))
+        messages = self._messages(1)
+        messages[0]['html_content'] = 'x' * (email_utils.MAX_SUBSTITUTION_BYTES + 1)
+
+        self.assertEqual(email_utils.send_bulk_email(messages), [True])
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(json.loads(requests[0].content)['content'][0]['value'], messages[0]['html_content'])
+
+
+class InvoiceEmailTests(TestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(name='Email Test Org')
+        self.customer = Customer.objects.create(organization=self.organization, name='Email Cust', email='cust@example.com')
+        self.no_email_customer = Customer.objects.create(organization=self.organization, name='No Email Cust')
+        self.invoice = Invoice.objects.create(
+            organization=self.organization, customer=self.customer, invoice_number='INV-E-1',
+            issue_date=date(2023, 11, 1), due_date=date(2023, 11, 30), subtotal=Decimal('100.00')
+        )
+        InvoiceItem.objects.create(invoice=self.invoice, description='Widget & Co', quantity=Decimal('2.00'), unit_price=Decimal('50.00'))
+
+    @mock.patch('api.email_utils.send_bulk_email')
+    def test_send_invoice_emails_bulk_skips_customers_without_email(self, mock_send_bulk_email):
+        mock_send_bulk_email.return_value = [True]
+        no_email_invoice = Invoice.objects.create(
+            organization=self.organization, customer=self.no_email_customer, invoice_number='INV-E-2',
+            issue_date=date(2023, 11, 1), due_date=date(2023, 11, 30)
+        )
+
+        with mock.patch('api.email_utils._build_invoice_email', wraps=email_utils._build_invoice_email) as mock_build:
+            results = email_utils.send_invoice_emails_bulk([no_email_invoice, self.invoice])
+
+        mock_build.assert_called_once_with(self.invoice)
+
+        self.assertEqual(results, [False, True])
+        messages = mock_send_bulk_email.call_args.args[0]
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['to_email'], 'cust@example.com')
+        self.assertEqual(messages[0]['subject'], 'Invoice INV-E-1 from Email Test Org')
+        self.assertIn('Widget &amp; Co', messages[0]['html_content'])
+
+    @mock.patch('api.email_utils.send_bulk_email')
+    def test_prepared_invoices_render_without_per_invoice_queries(self, mock_send_bulk_email):
+        mock_send_bulk_email.side_effect = lambda messages: [True] * len(messages)
+        for i in range(3):
+            invoice = Invoice.objects.create(
+                organization=self.organization, customer=self.customer, invoice_number=f'INV-Q-{i}',
+                issue_date=date(2023, 11, 1), due_date=date(2023, 11, 30)
+            )
+            InvoiceItem.objects.create(invoice=invoice, description='Item', quantity=Decimal('1.00'), unit_price=Decimal('5.00'))
+
+        with self.assertNumQueries(2):  # invoices with customer/organization, then their items
+            results = email_utils.send_invoice_emails_bulk(email_utils.prepare_invoices_for_email(Invoice.objects.all()))
+        self.assertEqual(results, [True] * 4)
+
+    def test_values_payloads_match_instance_rendering(self):
+        with self.assertNumQueries(2):
+            payloads = list(email_utils.iter_invoice_email_payloads([self.invoice.id]))
+
+        self.assertEqual(len(payloads), 1)
+        subject, html_content = email_utils._build_invoice_email(self.invoice)
+        self.assertEqual(payloads[0]['invoice_id'], self.invoice.id)
+        self.assertEqual(payloads[0]['to_email'], 'cust@example.com')
+        self.assertEqual(payloads[0]['subject'], subject)
+        self.assertEqual(payloads[0]['html_content'], html_content)
+
+    @mock.patch('api.email_utils.send_bulk_email')
+    def test_send_invoice_emails_by_id_reports_per_invoice(self, mock_send_bulk_email):
+        mock_send_bulk_email.side_effect = lambda messages: [True] * len(messages)
+        no_email_invoice = Invoice.objects.create(
+            organization=self.organization, customer=self.no_email_customer, invoice_number='INV-E-3',
+            issue_date=date(2023, 11, 1), due_date=date(2023, 11, 30)
+        )
+
+        results = email_utils.send_invoice_emails_by_id([self.invoice.id, no_email_invoice.id])
+
+        self.assertEqual(results, {self.invoice.id: True, no_email_invoice.id: False})
+
+    def test_unprefetched_items_are_streamed_into_the_email(self):
+        invoice = email_utils.prepare_invoices_for_email(Invoice.objects.filter(id=self.invoice.id), prefetch_items=False).get()
+
+        with self.assertNumQueries(1):
+            subject, html_content = email_utils._build_invoice_email(invoice)
+        self.assertIn('Widget &amp; Co', html_content)
+
+    def test_header_fields_are_escaped_exactly_once(self):
+        subject, html_content = email_utils._render_invoice_email(
+            self.invoice.id, 'INV<1>', date(2023, 11, 1), date(2023, 11, 30), Decimal('1.00'), 'Smith & Sons', 'Acme & Co', []
+        )
+
+        self.assertEqual(subject, 'Invoice INV<1> from Acme & Co')
+        self.assertIn('Dear Smith &amp; Sons,', html_content)
+        self.assertIn('Invoice Number: INV&lt;1&gt;', html_content)
+        self.assertIn('The Acme &amp; Co Team', html_content)
@@ -2,6 +2,7 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from decimal import Decimal
+from unittest import mock
 from api.models import (
     User, Organization, Role, Membership, Account, Customer, Invoice, Transaction, JournalEntry  # InvoiceItem removed F401
 )
@@ -158,7 +159,18 @@ class InvoiceGLTests(APITestCase):
         self.assertEqual(tax_entry.credit_amount, Decimal('12.00'))
 
     def test_create_invoice_gl_failure_rolls_back_invoice(self):
-        self.skipTest("Skipping GL failure rollback test; requires advanced mocking or specific setup.")
+        invoice_data = {
+            'customer': str(self.customer.id), 'invoice_number': 'INV-GL-FAIL', 'issue_date': '2023-10-01',
+            'due_date': '2023-10-31', 'status': Invoice.SENT,
+            'items': [{'description': 'Product A', 'quantity': Decimal('1.00'), 'unit_price': Decimal('100.00')}]
+        }
+        with mock.patch.object(JournalEntry, 'bulk_create_validated', side_effect=RuntimeError('entries rejected')):
+            response = self.client.post(self.invoices_url, invoice_data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # The GL transaction header was written before the entries failed; it is rolled back with the invoice.
+        self.assertFalse(Invoice.objects.filter(invoice_number='INV-GL-FAIL').exists())
+        self.assertFalse(Transaction.objects.filter(organization=self.organization).exists())
 
     def test_create_invoice_no_tax(self):
         '''Test invoice creation with no tax items still creates balanced GL.'''
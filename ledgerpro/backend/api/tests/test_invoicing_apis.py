@@ -1,11 +1,13 @@
 from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APITestCase
 from decimal import Decimal
 from unittest import mock  # For mocking email sending
 
 from api.models import (
-    User, Organization, Role, Membership, Customer, Invoice, Account  # InvoiceItem removed F401
+    User, Organization, Role, Membership, Customer, Invoice, InvoiceItem, Account
 )
 
 
@@ -16,7 +18,7 @@ class InvoicingAPITests(APITestCase):
         self.role = Role.objects.create(name='BillingClerk')
         Membership.objects.create(user=self.user, organization=self.organization, role=self.role)
 
-        self.client.login(email='invoiceuser@example.com', password='password123')
+        self.client.force_authenticate(user=self.user)  # The API authenticates by JWT only, not by session
 
         self.customer1 = Customer.objects.create(organization=self.organization, name='Cust A Inc.')
         self.customer2 = Customer.objects.create(organization=self.organization, name='Cust B Ltd.')
@@ -86,6 +88,67 @@ class InvoicingAPITests(APITestCase):
         self.assertEqual(created_invoice.total_tax, Decimal('20.00'))
         self.assertEqual(created_invoice.total_amount, Decimal('220.00'))
 
+    def test_create_invoice_item_without_quantity_counts_once(self):
+        invoice_data = {
+            'customer': str(self.customer1.id), 'invoice_number': 'INV-API-003',
+            'issue_date': '2023-11-01', 'due_date': '2023-11-30', 'status': Invoice.DRAFT,
+            'items': [{'description': 'Item Z', 'unit_price': Decimal('75.00')}]
+        }
+        response = self.client.post(self.invoices_url, invoice_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        invoice = Invoice.objects.get(invoice_number='INV-API-003')
+        self.assertEqual(invoice.subtotal, Decimal('75.00'))
+        self.assertEqual(invoice.items.get().amount, Decimal('75.00'))
+
+    def test_create_invoice_subtotal_sums_rounded_item_amounts(self):
+        invoice_data = {
+            'customer': str(self.customer1.id), 'invoice_number': 'INV-API-004',
+            'issue_date': '2023-11-01', 'due_date': '2023-11-30', 'status': Invoice.DRAFT,
+            'items': [
+                {'description': 'Part 1', 'quantity': Decimal('1.50'), 'unit_price': Decimal('0.33')},
+                {'description': 'Part 2', 'quantity': Decimal('1.50'), 'unit_price': Decimal('0.33')},
+            ]
+        }
+        response = self.client.post(self.invoices_url, invoice_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        invoice = Invoice.objects.get(invoice_number='INV-API-004')
+        # Each line is 0.495, stored as 0.50; the subtotal is their sum, not 0.99.
+        self.assertEqual(list(invoice.items.values_list('amount', flat=True)), [Decimal('0.50'), Decimal('0.50')])
+        self.assertEqual(invoice.subtotal, Decimal('1.00'))
+
+    def test_update_invoice_items_keeps_named_items(self):
+        invoice = Invoice.objects.create(organization=self.organization, customer=self.customer1, invoice_number='INV-DIFF', issue_date='2023-05-01', due_date='2023-05-31', created_by=self.user)
+        kept = InvoiceItem.objects.create(invoice=invoice, description='Kept', quantity=Decimal('2.00'), unit_price=Decimal('10.00'))
+        changed = InvoiceItem.objects.create(invoice=invoice, description='Changed', unit_price=Decimal('30.00'))
+        removed = InvoiceItem.objects.create(invoice=invoice, description='Removed', unit_price=Decimal('99.00'))
+
+        response = self.client.patch(self.invoice_detail_url(invoice.id), {'items': [
+            {'id': str(kept.id), 'description': 'Kept', 'quantity': Decimal('2.00'), 'unit_price': Decimal('10.00')},
+            {'id': str(changed.id), 'description': 'Changed', 'unit_price': Decimal('35.00'), 'tax_amount': Decimal('3.50')},
+            {'description': 'Added', 'unit_price': Decimal('5.00')},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        items = {item.description: item for item in invoice.items.all()}
+        self.assertEqual(set(items), {'Kept', 'Changed', 'Added'})
+        self.assertEqual((items['Kept'].id, items['Changed'].id), (kept.id, changed.id))
+        self.assertEqual(items['Changed'].amount, Decimal('35.00'))
+        self.assertFalse(InvoiceItem.objects.filter(id=removed.id).exists())
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.subtotal, invoice.total_tax), (Decimal('60.00'), Decimal('3.50')))
+
+    def test_create_invoice_looks_up_membership_once(self):
+        invoice_data = {
+            'customer': str(self.customer1.id), 'invoice_number': 'INV-API-002',
+            'issue_date': '2023-11-01', 'due_date': '2023-11-30', 'status': Invoice.DRAFT,
+            'items': [{'description': 'Item Y', 'quantity': Decimal('1.00'), 'unit_price': Decimal('50.00')}]
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.invoices_url, invoice_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        # Looked up once, shared by validate_customer() and the view; create() gets the organization from save().
+        self.assertEqual(sum('FROM "api_membership"' in query['sql'] for query in queries), 1)
+
     def test_create_invoice_missing_required_fields(self):
         invoice_data = {'customer': str(self.customer1.id)}  # Missing many fields
         response = self.client.post(self.invoices_url, invoice_data, format='json')
@@ -93,48 +156,100 @@ class InvoicingAPITests(APITestCase):
 
     def test_list_invoices(self):
         # Create some invoices
-        Invoice.objects.create(organization=self.organization, customer=self.customer1, invoice_number='INV001', issue_date='2023-01-01', due_date='2023-01-31', total_amount=100, created_by=self.user)
-        Invoice.objects.create(organization=self.organization, customer=self.customer2, invoice_number='INV002', issue_date='2023-02-01', due_date='2023-02-28', total_amount=200, created_by=self.user)
+        Invoice.objects.create(organization=self.organization, customer=self.customer1, invoice_number='INV001', issue_date='2023-01-01', due_date='2023-01-31', subtotal=100, created_by=self.user)
+        Invoice.objects.create(organization=self.organization, customer=self.customer2, invoice_number='INV002', issue_date='2023-02-01', due_date='2023-02-28', subtotal=200, created_by=self.user)
 
         response = self.client.get(self.invoices_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 2)
 
-    @mock.patch('api.email_utils.send_invoice_email')
-    def test_send_invoice_email_action(self, mock_send_invoice_email):
-        mock_send_invoice_email.return_value = True
+    def test_list_invoices_query_count_does_not_grow_with_invoices(self):
+        def list_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.invoices_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        for number in range(2):
+            invoice = Invoice.objects.create(organization=self.organization, customer=self.customer1, invoice_number=f'INV-N1-{number}', issue_date='2023-03-01', due_date='2023-03-31', created_by=self.user)
+            InvoiceItem.objects.create(invoice=invoice, description='Item', unit_price=Decimal('10.00'))
+        queries_for_two = list_queries()
+        for number in range(3):
+            invoice = Invoice.objects.create(organization=self.organization, customer=self.customer2, invoice_number=f'INV-N2-{number}', issue_date='2023-04-01', due_date='2023-04-30', created_by=self.user)
+            InvoiceItem.objects.create(invoice=invoice, description='Item', unit_price=Decimal('10.00'))
+        self.assertEqual(list_queries(), queries_for_two)
+
+    def test_calculate_totals_sums_items_in_one_query(self):
+        invoice = Invoice.objects.create(
+            organization=self.organization, customer=self.customer1, created_by=self.user,
+            invoice_number='INV-TOTALS-01', issue_date='2023-11-05', due_date='2023-12-05'
+        )
+        InvoiceItem.objects.create(invoice=invoice, description='A', quantity=Decimal('2.00'), unit_price=Decimal('10.00'), tax_amount=Decimal('1.50'))
+        InvoiceItem.objects.create(invoice=invoice, description='B', quantity=Decimal('1.00'), unit_price=Decimal('5.00'))
+
+        with self.assertNumQueries(1):
+            invoice.calculate_totals()
+        self.assertEqual(invoice.subtotal, Decimal('25.00'))
+        self.assertEqual(invoice.total_tax, Decimal('1.50'))
+        invoice.save()
+        self.assertEqual(invoice.total_amount, Decimal('26.50'))  # computed by the database
+
+    def test_item_amount_rounds_halves_away_from_zero(self):
+        invoice = Invoice.objects.create(
+            organization=self.organization, customer=self.customer1, created_by=self.user,
+            invoice_number='INV-ROUND-01', issue_date='2023-11-05', due_date='2023-12-05'
+        )
+        InvoiceItem.objects.create(invoice=invoice, description='Charge', quantity=Decimal('0.50'), unit_price=Decimal('0.25'))
+        InvoiceItem.objects.create(invoice=invoice, description='Credit', quantity=Decimal('0.50'), unit_price=Decimal('-0.25'))
 
+        # 0.125 either way; rounding halves to even would give 0.12.
+        amounts = dict(invoice.items.values_list('description', 'amount'))
+        self.assertEqual(amounts, {'Charge': Decimal('0.13'), 'Credit': Decimal('-0.13')})
+
+    def test_update_without_items_totals_the_prefetched_items(self):
+        invoice = Invoice.objects.create(
+            organization=self.organization, customer=self.customer1, created_by=self.user,
+            invoice_number='INV-TOTALS-02', issue_date='2023-11-05', due_date='2023-12-05'
+        )
+        InvoiceItem.objects.create(invoice=invoice, description='A', quantity=Decimal('3.00'), unit_price=Decimal('10.00'), tax_amount=Decimal('2.00'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.invoice_detail_url(invoice.id), {'notes': 'Net 30'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertFalse(any('SUM(' in query['sql'] for query in queries))
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.notes, invoice.subtotal, invoice.total_amount), ('Net 30', Decimal('30.00'), Decimal('32.00')))
+
+    @mock.patch('api.tasks.send_invoice_email_task.delay')
+    def test_send_invoice_email_action(self, mock_delay):
         invoice = Invoice.objects.create(
             organization=self.organization, customer=self.customer1, created_by=self.user,
             invoice_number='INV-EMAIL-01', issue_date='2023-11-05', due_date='2023-12-05',
-            status=Invoice.DRAFT, total_amount=500, subtotal=450, total_tax=50
+            status=Invoice.DRAFT, subtotal=450, total_tax=50
         )
         self.customer1.email = 'customer@example.com'
         self.customer1.save()
 
         response = self.client.post(self.invoice_send_email_url(invoice.id))
-        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
-        self.assertEqual(response.data['message'], 'Invoice sent successfully.')
-
-        invoice.refresh_from_db()
-        self.assertEqual(invoice.status, Invoice.SENT)
-        mock_send_invoice_email.assert_called_once_with(invoice)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED, response.data)
+        self.assertEqual(response.data['message'], 'Invoice email queued for sending.')
+        mock_delay.assert_called_once_with(str(invoice.id), str(self.user.id))
 
-    @mock.patch('api.email_utils.send_invoice_email')
-    def test_send_invoice_email_failure(self, mock_send_invoice_email):
-        mock_send_invoice_email.return_value = False
+    @mock.patch('api.tasks.send_invoice_email_task.delay')
+    def test_send_invoice_email_failure(self, mock_delay):
+        mock_delay.side_effect = Exception('broker unavailable')
 
         invoice = Invoice.objects.create(
             organization=self.organization, customer=self.customer1, created_by=self.user,
             invoice_number='INV-EMAIL-02', issue_date='2023-11-06', due_date='2023-12-06',
-            status=Invoice.DRAFT, total_amount=300, subtotal=270, total_tax=30
+            status=Invoice.DRAFT, subtotal=270, total_tax=30
         )
         self.customer1.email = 'customer@example.com'
         self.customer1.save()
 
         response = self.client.post(self.invoice_send_email_url(invoice.id))
-        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR, response.data)
-        self.assertIn('Failed to send invoice email', response.data.get('error', ''))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE, response.data)
+        self.assertIn('Failed to queue invoice email', response.data.get('error', ''))
 
         invoice.refresh_from_db()
         self.assertEqual(invoice.status, Invoice.DRAFT)
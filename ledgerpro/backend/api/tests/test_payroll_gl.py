@@ -1,10 +1,15 @@
 from decimal import Decimal
 from api.models import (
-    User, Organization, Role, Membership, Account, Employee, DeductionType, PayRun, Transaction, JournalEntry, Payslip
+    User, Organization, Role, Membership, Account, Employee, DeductionType, PayRun, Transaction, JournalEntry, Payslip,
+    PayslipDeduction
 )
 from api.payroll_service import process_pay_run, calculate_gross_pay  # For direct service testing
 from datetime import date  # Added for date objects in new tests
-from django.test import TestCase  # Moved APITestCase to TestCase as no API calls are made directly here for now
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from django.urls import reverse  # Moved APITestCase to TestCase as no API calls are made directly here for now
 # from unittest import mock # For mocking, if needed for service calls - F401 unused
 
 
@@ -175,6 +180,85 @@ class PayrollGLTests(TestCase):  # Changed to TestCase
         self.assertEqual(journal_entries.get(account=self.wages_payable_account).credit_amount, Decimal('2000.00'))
         self.assertFalse(JournalEntry.objects.filter(transaction=gl_transaction, account=self.deductions_payable_account).exists())
 
+    def test_pay_run_with_payslips_loads_nested_data_in_three_queries(self):
+        pay_run = PayRun.objects.create(
+            organization=self.organization, pay_period_start_date='2023-10-16',
+            pay_period_end_date='2023-10-31', payment_date='2023-11-05', status=PayRun.DRAFT
+        )
+        employee_inputs = [
+            {'employee_id': str(self.employee1.id), 'manual_deductions': [{'deduction_type_id': str(self.health_deduction_type.id), 'amount': '100.00'}]},
+            {'employee_id': str(self.employee2.id), 'hours_worked': '10', 'manual_deductions': [{'deduction_type_id': str(self.health_deduction_type.id), 'amount': '20.00'}]},
+        ]
+        process_pay_run(pay_run, employee_inputs, self.user)
+
+        with self.assertNumQueries(3):
+            loaded = PayRun.objects.with_payslips().get(pk=pay_run.pk)
+            deductions = [
+                (payslip.employee.last_name, deduction.deduction_type.name, deduction.amount)
+                for payslip in loaded.payslips.all() for deduction in payslip.deductions_applied.all()
+            ]
+            self.assertEqual(loaded.processed_by, self.user)
+        self.assertCountEqual(deductions, [('Doe', 'Health Insurance', Decimal('100.00')), ('Smith', 'Health Insurance', Decimal('20.00'))])
+
+    def test_pay_run_update_query_count_does_not_grow_with_payslips(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)  # The API authenticates by JWT only, not by session
+        deduction = {'deduction_type_id': str(self.health_deduction_type.id), 'amount': '10.00'}
+
+        def update_queries(employees):
+            pay_run = PayRun.objects.create(
+                organization=self.organization, pay_period_start_date='2023-09-01',
+                pay_period_end_date='2023-09-15', payment_date='2023-09-20', status=PayRun.DRAFT
+            )
+            process_pay_run(pay_run, [
+                {'employee_id': str(employee.id), 'hours_worked': '8', 'manual_deductions': [deduction]} for employee in employees
+            ], self.user)
+            with CaptureQueriesContext(connection) as queries:
+                response = client.patch(reverse('payrun-detail', args=[pay_run.id]), {'notes': 'Checked'}, format='json')
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertEqual(len(response.data['payslips']), len(employees))
+            self.assertEqual(response.data['notes'], 'Checked')
+            return len(queries)
+
+        self.assertEqual(update_queries([self.employee1, self.employee2]), update_queries([self.employee1]))
+
+    def test_process_pay_run_reprocessing_upserts_existing_payslip(self):
+        pay_run = PayRun.objects.create(
+            organization=self.organization, pay_period_start_date='2023-06-01',
+            pay_period_end_date='2023-06-15', payment_date='2023-06-20', status=PayRun.PROCESSING
+        )
+        stale_payslip = Payslip.objects.create(
+            pay_run=pay_run, employee=self.employee1, gross_pay=Decimal('1500.00'), total_deductions=Decimal('50.00'), notes='Earlier attempt'
+        )
+        PayslipDeduction.objects.create(payslip=stale_payslip, deduction_type=self.health_deduction_type, amount=Decimal('50.00'))
+        employee_inputs = [
+            {'employee_id': str(self.employee1.id), 'manual_deductions': [{'deduction_type_id': str(self.health_deduction_type.id), 'amount': '80.00'}]},
+            {'employee_id': str(self.employee2.id), 'hours_worked': '8'},
+        ]
+
+        process_pay_run(pay_run, employee_inputs, self.user)
+
+        john_payslip = Payslip.objects.get(pay_run=pay_run, employee=self.employee1)
+        self.assertEqual(john_payslip.id, stale_payslip.id)
+        self.assertEqual(john_payslip.gross_pay, Decimal('2000.00'))
+        self.assertEqual(john_payslip.net_pay, Decimal('1920.00'))
+        self.assertEqual(john_payslip.notes, 'Earlier attempt')
+        self.assertEqual(list(john_payslip.deductions_applied.values_list('amount', flat=True)), [Decimal('80.00')])
+        self.assertEqual(Payslip.objects.get(pay_run=pay_run, employee=self.employee2).gross_pay, Decimal('200.00'))
+
+    def test_process_pay_run_skips_zero_pay_employees(self):
+        pay_run = PayRun.objects.create(
+            organization=self.organization, pay_period_start_date='2023-05-01',
+            pay_period_end_date='2023-05-15', payment_date='2023-05-20', status=PayRun.DRAFT
+        )
+        employee_inputs = [
+            {'employee_id': str(self.employee1.id)},
+            {'employee_id': str(self.employee2.id), 'hours_worked': '0'},
+        ]
+
+        process_pay_run(pay_run, employee_inputs, self.user)
+        self.assertEqual(list(Payslip.objects.filter(pay_run=pay_run).values_list('employee_id', flat=True)), [self.employee1.id])
+
     def test_process_pay_run_employee_not_found(self):  # Replaces previous test_payrun_with_no_employees_processed
         pay_run = PayRun.objects.create(
             organization=self.organization, pay_period_start_date='2023-09-01',
@@ -196,6 +280,16 @@ class PayrollGLTests(TestCase):  # Changed to TestCase
         self.assertIsNone(pay_run.gl_transaction)
         self.assertEqual(Transaction.objects.count(), initial_tx_count)
 
+    def test_process_pay_run_skips_malformed_employee_id(self):
+        pay_run = PayRun.objects.create(
+            organization=self.organization, pay_period_start_date='2023-07-01',
+            pay_period_end_date='2023-07-15', payment_date='2023-07-20', status=PayRun.DRAFT
+        )
+        employee_inputs = [{'employee_id': 'not-a-uuid'}, {'employee_id': str(self.employee1.id), 'manual_deductions': []}]
+
+        process_pay_run(pay_run, employee_inputs, self.user)
+        self.assertEqual(list(Payslip.objects.filter(pay_run=pay_run).values_list('employee_id', flat=True)), [self.employee1.id])
+
     def test_process_pay_run_invalid_deduction_type(self):
         pay_run = PayRun.objects.create(
             organization=self.organization, pay_period_start_date='2023-08-01',
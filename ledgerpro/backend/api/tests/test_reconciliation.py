@@ -7,10 +7,11 @@ from decimal import Decimal
 from datetime import date
 
 from api.models import (
-    User, Organization, Role, Membership, Account, StagedBankTransaction, ReconciliationRule  # Transaction removed F401
+    User, Organization, Role, Membership, Account, StagedBankTransaction, ReconciliationRule, Transaction, JournalEntry
 )
 from api.reconciliation_service import (
-    evaluate_condition, check_rule_conditions, apply_rule_actions, run_reconciliation_rules_for_organization
+    evaluate_condition, check_rule_conditions, apply_rule_actions, run_reconciliation_rules_for_organization, compile_rule,
+    _rules_prefilter, find_suggested_matches
 )
 
 
@@ -52,27 +53,62 @@ class ReconciliationServiceTests(TestCase):
         rule_no_match_amount = ReconciliationRule(conditions=rule_conditions_no_match_amount, name="No Match Amount", organization=self.organization)
         self.assertFalse(check_rule_conditions(staged_tx, rule_no_match_amount))
 
-    @mock.patch('api.reconciliation_service.Account.objects.get')
-    def test_apply_rule_actions_categorize(self, mock_account_get):
-        mock_account_get.return_value = self.expense_account
+    def test_compiled_conditions_agree_with_evaluate_condition(self):
+        conditions = [
+            {'field': 'amount', 'operator': 'greater_than', 'value': '-20'},
+            {'field': 'amount', 'operator': 'contains', 'value': '12'},
+            {'field': 'name', 'operator': 'contains', 'value': 'STARBUCKS'},
+            {'field': 'name', 'operator': 'greater_than', 'value': '5'},
+            {'field': 'merchant_name', 'operator': 'equals', 'value': 'None'},
+        ]
+        staged_tx = StagedBankTransaction(organization=self.organization, name='Starbucks 123', amount=Decimal('-12.50'), merchant_name=None)
+        for condition in conditions:
+            rule = ReconciliationRule(organization=self.organization, name='Single', conditions=[condition])
+            expected = evaluate_condition(getattr(staged_tx, condition['field']), condition['operator'], condition['value'])
+            self.assertEqual(check_rule_conditions(staged_tx, rule), expected, condition)
+
+    def test_compiled_rule_is_reused_until_the_rule_changes(self):
+        rule = ReconciliationRule.objects.create(
+            organization=self.organization, name='Cached Rule',
+            conditions=[{'field': 'amount', 'operator': 'less_than', 'value': '-10'}], actions=[]
+        )
+        compiled = compile_rule(rule)
+        self.assertIs(compile_rule(rule), compiled)
 
+        rule.conditions = [{'field': 'no_such_field', 'operator': 'equals', 'value': 'x'}]
+        rule.save()
+        self.assertIsNone(compile_rule(rule))
+
+    def test_compiled_conditions_are_ordered_cheapest_first(self):
+        rule = ReconciliationRule(organization=self.organization, name='Mixed Rule', conditions=[
+            {'field': 'name', 'operator': 'contains', 'value': 'starbucks'},
+            {'field': 'currency_code', 'operator': 'equals', 'value': 'USD'},
+            {'field': 'amount', 'operator': 'less_than', 'value': '-10'},
+        ])
+        self.assertEqual([field_name for field_name, _, _ in compile_rule(rule)], ['amount', 'currency_code', 'name'])
+
+    def test_apply_rule_actions_categorize(self):
         staged_tx = StagedBankTransaction.objects.create(
             organization=self.organization, date=date.today(), name='Misc Purchase',
             amount=Decimal('-50.00'), transaction_id_source='recon_tx_2',
             reconciliation_status=StagedBankTransaction.RECON_UNMATCHED
         )
-        # Ensure applied_rule field exists on StagedBankTransaction for this test to pass fully
-        # If not, the save() call in apply_rule_actions might error or not set it.
-        # The previous model update step should have added this.
         rule_actions = [{'action_type': 'categorize', 'account_id': str(self.expense_account.id)}]
         rule = ReconciliationRule.objects.create(actions=rule_actions, name='Test Categorize Rule', organization=self.organization, conditions=[{'field': 'name', 'operator': 'contains', 'value': 'Misc'}])
 
-        apply_rule_actions(staged_tx, rule, self.user)
+        updates = apply_rule_actions(staged_tx, rule, self.user)
+
+        self.assertEqual(updates, {'reconciliation_status': StagedBankTransaction.RECON_RULE_APPLIED, 'applied_rule': rule})
         staged_tx.refresh_from_db()
+        self.assertEqual(staged_tx.reconciliation_status, StagedBankTransaction.RECON_UNMATCHED)  # Callers write the updates
 
-        self.assertEqual(staged_tx.reconciliation_status, StagedBankTransaction.RECON_RULE_APPLIED)
-        self.assertEqual(staged_tx.applied_rule, rule)
-        mock_account_get.assert_called_once_with(id=str(self.expense_account.id), organization=self.organization)
+    def test_apply_rule_actions_ignores_unknown_account(self):
+        staged_tx = StagedBankTransaction(organization=self.organization, name='Misc Purchase', amount=Decimal('-5.00'))
+        rule = ReconciliationRule(
+            organization=self.organization, name='Bad Account Rule', conditions=[],
+            actions=[{'action_type': 'categorize', 'account_id': 'not-a-uuid'}]
+        )
+        self.assertEqual(apply_rule_actions(staged_tx, rule, self.user, accounts={}), {})
 
     def test_run_reconciliation_rules_for_organization(self):
         StagedBankTransaction.objects.create(organization=self.organization, date=date.today(), name='Starbucks Coffee', amount=Decimal('-5.00'), transaction_id_source='unmatched1', reconciliation_status=StagedBankTransaction.RECON_UNMATCHED)
@@ -92,13 +128,146 @@ class ReconciliationServiceTests(TestCase):
             created_by=self.user
         )
 
-        applied_count = run_reconciliation_rules_for_organization(self.organization, self.user)
+        # The rules' version, the rules, their accounts, the unmatched transactions,
+        # then the claim of the matched rows and one UPDATE per matched rule inside a savepoint.
+        with self.assertNumQueries(9):
+            applied_count = run_reconciliation_rules_for_organization(self.organization, self.user)
         self.assertEqual(applied_count, 2)
 
         self.assertEqual(StagedBankTransaction.objects.get(transaction_id_source='unmatched1').reconciliation_status, StagedBankTransaction.RECON_RULE_APPLIED)
+        self.assertEqual(StagedBankTransaction.objects.get(transaction_id_source='unmatched1').applied_rule.name, 'Starbucks Rule')
         self.assertEqual(StagedBankTransaction.objects.get(transaction_id_source='unmatched2').reconciliation_status, StagedBankTransaction.RECON_RULE_APPLIED)
         self.assertEqual(StagedBankTransaction.objects.get(transaction_id_source='unmatched3').reconciliation_status, StagedBankTransaction.RECON_UNMATCHED)
 
+    def test_run_posts_categorized_transactions_to_the_ledger(self):
+        bank = Account.objects.create(organization=self.organization, name='Checking', type=Account.ASSET)
+        StagedBankTransaction.objects.create(organization=self.organization, date=date(2024, 5, 2), name='Staples', amount=Decimal('-50.00'), transaction_id_source='post1')
+        StagedBankTransaction.objects.create(organization=self.organization, date=date(2024, 5, 3), name='Staples refund', amount=Decimal('20.00'), transaction_id_source='post2')
+        ReconciliationRule.objects.create(
+            organization=self.organization, name='Staples Rule', priority=1, is_active=True,
+            conditions=[{'field': 'name', 'operator': 'contains', 'value': 'staples'}],
+            actions=[{'action_type': 'categorize', 'account_id': str(self.expense_account.id), 'bank_account_id': str(bank.id)}],
+            created_by=self.user
+        )
+
+        self.assertEqual(run_reconciliation_rules_for_organization(self.organization, self.user), 2)
+
+        purchase = StagedBankTransaction.objects.get(transaction_id_source='post1')
+        self.assertEqual(purchase.linked_transaction.date, date(2024, 5, 2))
+        self.assertEqual(
+            {(je.account_id, je.debit_amount, je.credit_amount) for je in purchase.linked_transaction.journal_entries_set.all()},
+            {(self.expense_account.id, Decimal('50.00'), Decimal('0.00')), (bank.id, Decimal('0.00'), Decimal('50.00'))}
+        )
+        refund = StagedBankTransaction.objects.get(transaction_id_source='post2')
+        self.assertEqual(refund.linked_transaction.journal_entries_set.get(account=bank).debit_amount, Decimal('20.00'))
+        self.assertEqual(refund.reconciliation_status, StagedBankTransaction.RECON_RULE_APPLIED)
+
+    def test_running_the_rules_twice_posts_each_transaction_once(self):
+        bank = Account.objects.create(organization=self.organization, name='Checking', type=Account.ASSET)
+        staged_tx = StagedBankTransaction.objects.create(organization=self.organization, date=date(2024, 5, 2), name='Staples', amount=Decimal('-50.00'), transaction_id_source='twice1')
+        ReconciliationRule.objects.create(
+            organization=self.organization, name='Staples Rule', priority=1, is_active=True,
+            conditions=[{'field': 'name', 'operator': 'contains', 'value': 'staples'}],
+            actions=[{'action_type': 'categorize', 'account_id': str(self.expense_account.id), 'bank_account_id': str(bank.id)}],
+            created_by=self.user
+        )
+
+        self.assertEqual(run_reconciliation_rules_for_organization(self.organization, self.user), 1)
+        self.assertEqual(run_reconciliation_rules_for_organization(self.organization, self.user), 0)
+
+        staged_tx.refresh_from_db()
+        self.assertEqual(Transaction.objects.filter(organization=self.organization).count(), 1)
+        self.assertEqual(staged_tx.linked_transaction.journal_entries_set.count(), 2)
+
+    def test_rows_matched_by_an_overlapping_run_are_not_posted_again(self):
+        bank = Account.objects.create(organization=self.organization, name='Checking', type=Account.ASSET)
+        StagedBankTransaction.objects.create(organization=self.organization, date=date(2024, 5, 2), name='Staples', amount=Decimal('-50.00'), transaction_id_source='overlap1')
+        ReconciliationRule.objects.create(
+            organization=self.organization, name='Staples Rule', priority=1, is_active=True,
+            conditions=[{'field': 'name', 'operator': 'contains', 'value': 'staples'}],
+            actions=[{'action_type': 'categorize', 'account_id': str(self.expense_account.id), 'bank_account_id': str(bank.id)}],
+            created_by=self.user
+        )
+
+        def apply_and_overlap(staged_tx, *args, **kwargs):
+            # Another run matches and posts the same row after this run has read it.
+            StagedBankTransaction.objects.filter(id=staged_tx.id).update(reconciliation_status=StagedBankTransaction.RECON_RULE_APPLIED)
+            return apply_rule_actions(staged_tx, *args, **kwargs)
+
+        with mock.patch('api.reconciliation_service.apply_rule_actions', side_effect=apply_and_overlap):
+            self.assertEqual(run_reconciliation_rules_for_organization(self.organization, self.user), 0)
+        self.assertFalse(Transaction.objects.filter(organization=self.organization).exists())
+
+    def test_rules_are_reloaded_only_when_they_change(self):
+        rule = ReconciliationRule.objects.create(
+            organization=self.organization, name='Coffee Rule', priority=1, is_active=True,
+            conditions=[{'field': 'name', 'operator': 'contains', 'value': 'coffee'}],
+            actions=[{'action_type': 'categorize', 'account_id': str(self.expense_account.id)}],
+            created_by=self.user
+        )
+        run_reconciliation_rules_for_organization(self.organization, self.user)
+
+        StagedBankTransaction.objects.create(organization=self.organization, date=date.today(), name='Tea House', amount=Decimal('-3.00'), transaction_id_source='tea1')
+        # The rules' version, their accounts and the unmatched transactions; the rules themselves come from the cache.
+        with self.assertNumQueries(3):
+            self.assertEqual(run_reconciliation_rules_for_organization(self.organization, self.user), 0)
+
+        rule.conditions = [{'field': 'name', 'operator': 'contains', 'value': 'tea'}]
+        rule.save()
+        self.assertEqual(run_reconciliation_rules_for_organization(self.organization, self.user), 1)
+
+    def test_amount_rules_skip_rows_they_cannot_match(self):
+        StagedBankTransaction.objects.create(organization=self.organization, date=date.today(), name='Coffee', amount=Decimal('-4.50'), transaction_id_source='small1')
+        large = StagedBankTransaction.objects.create(organization=self.organization, date=date.today(), name='Equipment', amount=Decimal('-2500.00'), transaction_id_source='large1')
+        amount_rule = ReconciliationRule(organization=self.organization, name='Large Purchase Rule', conditions=[
+            {'field': 'name', 'operator': 'contains', 'value': 'equip'},
+            {'field': 'amount', 'operator': 'less_than', 'value': '-1000'},
+        ])
+        text_rule = ReconciliationRule(organization=self.organization, name='Coffee Rule', conditions=[{'field': 'name', 'operator': 'contains', 'value': 'coffee'}])
+
+        prefilter = _rules_prefilter([amount_rule])
+        self.assertEqual(list(StagedBankTransaction.objects.filter(prefilter)), [large])
+        # A rule without an amount condition could match any row.
+        self.assertIsNone(_rules_prefilter([amount_rule, text_rule]))
+
+    def test_run_covers_more_than_one_chunk(self):
+        StagedBankTransaction.objects.bulk_create([
+            StagedBankTransaction(organization=self.organization, date=date.today(), name=f'Coffee {i}', amount=Decimal('-4.50'), transaction_id_source=f'coffee{i}')
+            for i in range(150)
+        ])
+        ReconciliationRule.objects.create(
+            organization=self.organization, name='Coffee Rule', priority=1, is_active=True,
+            conditions=[{'field': 'name', 'operator': 'contains', 'value': 'coffee'}],
+            actions=[{'action_type': 'categorize', 'account_id': str(self.expense_account.id)}],
+            created_by=self.user
+        )
+
+        with mock.patch('api.reconciliation_service.RULE_RUN_CHUNK_SIZE', 40), mock.patch('api.reconciliation_service.RULE_UPDATE_BATCH_SIZE', 100):
+            self.assertEqual(run_reconciliation_rules_for_organization(self.organization, self.user), 150)
+        self.assertFalse(StagedBankTransaction.objects.filter(reconciliation_status=StagedBankTransaction.RECON_UNMATCHED).exists())
+
+    def test_find_suggested_matches(self):
+        bank = Account.objects.create(organization=self.organization, name='Bank', type=Account.ASSET)
+
+        def post(on, description, amount):
+            tx = Transaction.objects.create(organization=self.organization, date=on, description=description)
+            JournalEntry.objects.create(transaction=tx, account=self.expense_account, debit_amount=Decimal(amount))
+            JournalEntry.objects.create(transaction=tx, account=bank, credit_amount=Decimal(amount))
+            return tx
+
+        staged_tx = StagedBankTransaction.objects.create(organization=self.organization, date=date(2024, 3, 10), name='OFFICE DEPOT #42', amount=Decimal('-75.00'), transaction_id_source='suggest1')
+        close = post(date(2024, 3, 9), 'Office Depot supplies', '75.00')
+        near = post(date(2024, 3, 12), 'Printer paper', '75.50')
+        post(date(2024, 3, 11), 'Lunch', '40.00')  # Amount too far off
+        post(date(2024, 4, 30), 'Office Depot supplies', '75.00')  # Too late
+        matched = post(date(2024, 3, 10), 'Office Depot supplies', '75.00')
+        StagedBankTransaction.objects.create(organization=self.organization, date=date(2024, 3, 10), name='OFFICE DEPOT #41', amount=Decimal('-75.00'), transaction_id_source='suggest2', linked_transaction=matched)
+
+        with self.assertNumQueries(1):
+            suggestions = find_suggested_matches(staged_tx)
+        self.assertEqual([s['ledger_pro_transaction_id'] for s in suggestions], [str(close.id), str(near.id)])
+        self.assertEqual(suggestions[0]['amount'], Decimal('75.00'))
+
 
 class ReconciliationAPITests(APITestCase):
     def setUp(self):
@@ -0,0 +1,22 @@
+import uuid
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from django.test import SimpleTestCase
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+
+from api.renderers import ORJSONRenderer
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    def test_output_matches_json_renderer(self):
+        data = {
+            'id': uuid.UUID('0190f6d4-2c5e-7d3a-9b1e-2f4a6c8e0a1b'), 'amount': Decimal('1234.50'),
+            'issued': date(2024, 1, 31), 'created_at': datetime(2024, 1, 31, 9, 30, 15, 123456, tzinfo=timezone.utc),
+            'label': gettext_lazy('Paid'), 'note': 'Caf\u00e9 \u2028 line', 'items': [{'quantity': 2, 'rate': None}], 2024: True,
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_no_content_renders_empty(self):
+        self.assertEqual(ORJSONRenderer().render(None), b'')
@@ -0,0 +1,53 @@
+from django.test import TestCase
+from decimal import Decimal
+from datetime import date
+from api.models import Organization, Account, Transaction, JournalEntry
+from api.reporting_service import get_balance_sheet_data, get_profit_and_loss_data
+
+
+class ReportingServiceTests(TestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(name='Reporting Org')
+        self.bank = Account.objects.create(organization=self.organization, name='Bank', type=Account.ASSET)
+        self.sales = Account.objects.create(organization=self.organization, name='Sales Revenue', type=Account.REVENUE)
+        self.consulting = Account.objects.create(organization=self.organization, name='Consulting Revenue', type=Account.REVENUE)
+        self.rent = Account.objects.create(organization=self.organization, name='Rent Expense', type=Account.EXPENSE)
+        self.supplies = Account.objects.create(organization=self.organization, name='Supplies Expense', type=Account.EXPENSE)
+
+    def _post(self, on, debit_account, credit_account, amount):
+        tx = Transaction.objects.create(organization=self.organization, date=on, description='Test')
+        JournalEntry.objects.create(transaction=tx, account=debit_account, debit_amount=Decimal(amount))
+        JournalEntry.objects.create(transaction=tx, account=credit_account, credit_amount=Decimal(amount))
+
+    def test_profit_and_loss_sums_accounts_in_one_query(self):
+        self._post(date(2024, 1, 5), self.bank, self.sales, '1000.00')
+        self._post(date(2024, 1, 9), self.bank, self.consulting, '400.00')
+        self._post(date(2024, 1, 10), self.rent, self.bank, '300.00')
+        self._post(date(2024, 1, 12), self.sales, self.bank, '100.00')  # Refund
+        self._post(date(2024, 2, 1), self.supplies, self.bank, '75.00')  # Outside the period
+
+        with self.assertNumQueries(1):
+            report = get_profit_and_loss_data(self.organization, date(2024, 1, 1), date(2024, 1, 31))
+
+        self.assertEqual(report['revenues']['breakdown'], [
+            {'account_name': 'Consulting Revenue', 'amount': Decimal('400.00')},
+            {'account_name': 'Sales Revenue', 'amount': Decimal('900.00')},
+        ])
+        self.assertEqual(report['revenues']['total'], Decimal('1300.00'))
+        self.assertEqual(report['expenses']['breakdown'], [{'account_name': 'Rent Expense', 'amount': Decimal('300.00')}])
+        self.assertEqual(report['net_income'], Decimal('1000.00'))
+
+    def test_balance_sheet_reads_balances_and_net_income_in_two_queries(self):
+        loan = Account.objects.create(organization=self.organization, name='Bank Loan', type=Account.LIABILITY)
+        self._post(date(2023, 12, 20), self.bank, loan, '500.00')
+        self._post(date(2024, 1, 5), self.bank, self.sales, '1000.00')
+        self._post(date(2024, 1, 10), self.rent, self.bank, '300.00')
+        self._post(date(2024, 2, 1), self.bank, self.sales, '50.00')  # After the as-of date
+
+        with self.assertNumQueries(2):
+            report = get_balance_sheet_data(self.organization, date(2024, 1, 31))
+
+        self.assertEqual(report['assets']['breakdown'], [{'account_name': 'Bank', 'balance': Decimal('1200.00')}])
+        self.assertEqual(report['liabilities']['total'], Decimal('500.00'))
+        self.assertEqual(report['equity']['breakdown'], [{'account_name': 'Current Year Net Income (Calculated)', 'balance': Decimal('700.00')}])
+        self.assertTrue(report['verification']['assets_equals_liabilities_plus_equity'])
@@ -0,0 +1,73 @@
+from django.test import TestCase
+from unittest import mock
+from datetime import date
+
+from api import tasks
+from api.models import User, Organization, Customer, Invoice, AuditLog, PlaidItem
+
+
+class SendInvoiceEmailTaskTests(TestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(name='Task Test Org')
+        self.customer = Customer.objects.create(organization=self.organization, name='Task Cust', email='task@example.com')
+        self.invoice = Invoice.objects.create(
+            organization=self.organization, customer=self.customer, invoice_number='INV-T-1',
+            issue_date=date(2023, 11, 1), due_date=date(2023, 11, 30), status=Invoice.DRAFT
+        )
+
+    @mock.patch('api.email_utils.send_invoice_email')
+    def test_task_sends_and_marks_invoice_sent(self, mock_send_invoice_email):
+        mock_send_invoice_email.return_value = True
+
+        self.assertTrue(tasks.send_invoice_email_task(str(self.invoice.id)))
+
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, Invoice.SENT)
+        self.assertTrue(AuditLog.objects.filter(organization=self.organization, action='sent_invoice_email').exists())
+
+    @mock.patch('api.email_utils.send_invoice_email')
+    def test_task_raises_for_retry_when_delivery_fails(self, mock_send_invoice_email):
+        mock_send_invoice_email.return_value = False
+
+        with self.assertRaises(tasks.InvoiceEmailDeliveryError):
+            tasks.send_invoice_email_task(str(self.invoice.id))
+
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, Invoice.DRAFT)
+        self.assertFalse(AuditLog.objects.filter(action='sent_invoice_email').exists())
+
+    @mock.patch('api.email_utils.send_invoice_email')
+    def test_task_skips_void_invoices(self, mock_send_invoice_email):
+        self.invoice.status = Invoice.VOID
+        self.invoice.save(update_fields=['status'])
+
+        self.assertFalse(tasks.send_invoice_email_task(str(self.invoice.id)))
+        mock_send_invoice_email.assert_not_called()
+
+
+class SyncPlaidItemTaskTests(TestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(name='Plaid Task Org')
+        self.user = User.objects.create_user(email='plaidtask@example.com', password='password123')
+        self.plaid_item = PlaidItem.objects.create(
+            organization=self.organization, user=self.user, access_token='task_access_token', item_id='task_item_id'
+        )
+
+    @mock.patch('api.plaid_service.fetch_plaid_transactions')
+    def test_task_syncs_item_by_id(self, mock_fetch_plaid_transactions):
+        mock_fetch_plaid_transactions.return_value = 3
+
+        self.assertEqual(tasks.sync_plaid_item_task(str(self.plaid_item.id)), 3)
+        self.assertEqual(mock_fetch_plaid_transactions.call_args.args[0].id, self.plaid_item.id)
+
+    @mock.patch('api.plaid_service.fetch_plaid_transactions')
+    def test_task_raises_for_retry_when_sync_fails(self, mock_fetch_plaid_transactions):
+        mock_fetch_plaid_transactions.return_value = -1
+
+        with self.assertRaises(tasks.PlaidSyncError):
+            tasks.sync_plaid_item_task(str(self.plaid_item.id))
+
+    @mock.patch('api.tasks.queue_plaid_syncs')
+    def test_periodic_task_queues_every_item(self, mock_queue_plaid_syncs):
+        self.assertEqual(tasks.sync_all_plaid_items_task(), 1)
+        mock_queue_plaid_syncs.assert_called_once_with([self.plaid_item.id])
@@ -1,7 +1,10 @@
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from api.models import User, Organization, Role, Membership
+from api.serializers import _admin_role_id_cache, invalidate_admin_role_cache
 
 
 class UserOrgRoleAPITests(APITestCase):
@@ -43,6 +46,20 @@ class UserOrgRoleAPITests(APITestCase):
         admin_role = Role.objects.get(name='Admin')
         self.assertTrue(Membership.objects.filter(user=user, organization=organization, role=admin_role).exists())
 
+    def test_admin_role_is_looked_up_once_committed(self):
+        self.addCleanup(invalidate_admin_role_cache)  # The cached id outlives this test's rolled-back role
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.register_url, {**self.user_data1, 'organization_name': 'FirstCo'}, format='json')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.register_url, {**self.user_data2, 'organization_name': 'SecondCo'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertFalse(any('"api_role"' in query['sql'] for query in queries))
+        self.assertEqual(Membership.objects.get(user__email=self.user_data2['email']).role.name, 'Admin')
+
+        Role.objects.filter(name='Admin').get().save()  # Any role change drops the cached id
+        self.assertEqual(_admin_role_id_cache, {})
+
     def test_user_login_and_me_endpoint(self):
         # Register user first
         self.client.post(self.register_url, self.user_data1, format='json')
@@ -65,6 +82,9 @@ class UserOrgRoleAPITests(APITestCase):
         self.assertEqual(response_duplicate.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('email', response_duplicate.data.get('errors', response_duplicate.data))  # Check for email error field; structure may vary
 
+        response_case = self.client.post(self.register_url, {**self.user_data1, 'email': 'TestUser1@Example.com'}, format='json')
+        self.assertEqual(response_case.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_role_management_as_admin(self):
         self.client.login(email='admin@example.com', password='adminpassword')
         roles_url = reverse('role-list')
@@ -9,8 +9,9 @@ from .serializers import (
     UserRegistrationSerializer, UserLoginSerializer, UserDetailSerializer, RoleSerializer,
     AccountSerializer, TransactionSerializer, AuditLogSerializer,
     CustomerSerializer, InvoiceSerializer, VendorSerializer,
-    PlaidItemSerializer, StagedBankTransactionSerializer, ReconciliationRuleSerializer,
-    EmployeeSerializer, PayRunSerializer, PayslipSerializer, DeductionTypeSerializer  # Added Payroll serializers
+    PlaidItemSerializer, StagedBankTransactionSerializer, StagedBankTransactionListSerializer, ReconciliationRuleSerializer,
+    EmployeeSerializer, PayRunSerializer, PayslipSerializer, DeductionTypeSerializer,  # Added Payroll serializers
+    request_membership
 )
 from rest_framework import generics, permissions, status, viewsets
 from rest_framework.response import Response
@@ -27,7 +28,8 @@ from . import plaid_service
 from . import reconciliation_service
 from . import reporting_service
 from . import payroll_service
-from . import email_utils  # Ensured email_utils is imported
+from . import audit
+from . import tasks
 from datetime import date
 
 logger = logging.getLogger(__name__)
@@ -96,7 +98,7 @@ class OrganizationScopedViewMixin:
     def get_organization(self):
         if not hasattr(self.request.user, 'membership_set'):
             raise PermissionDenied('User has no membership information.')
-        membership = self.request.user.membership_set.first()
+        membership = request_membership(self.request)
         if not membership:
             raise PermissionDenied('User is not associated with any organization.')
         return membership.organization
@@ -140,13 +142,13 @@ class AccountDetailView(OrganizationScopedViewMixin, generics.RetrieveUpdateDest
 
 
 class TransactionViewSet(OrganizationScopedViewMixin, generics.ListCreateAPIView):
-    queryset = Transaction.objects.all().order_by('-date', '-created_at')
+    queryset = Transaction.objects.prefetch_related('journal_entries_set').order_by('-date', '-created_at')
     serializer_class = TransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 
 class TransactionDetailView(OrganizationScopedViewMixin, generics.RetrieveUpdateDestroyAPIView):
-    queryset = Transaction.objects.all()
+    queryset = Transaction.objects.prefetch_related('journal_entries_set')
     serializer_class = TransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -155,7 +157,8 @@ class TransactionDetailView(OrganizationScopedViewMixin, generics.RetrieveUpdate
 
     def perform_destroy(self, instance):
         organization = self.get_organization()
-        AuditLog.objects.create(
+        audit.queue(
+            self.request,
             organization=organization,
             user=self.request.user,
             action="deleted_transaction",
@@ -182,8 +185,12 @@ class CustomerDetailView(OrganizationScopedViewMixin, generics.RetrieveUpdateDes
     permission_classes = [permissions.IsAuthenticated]
 
 
+# The serializer nests each invoice's creator and items.
+SERIALIZED_INVOICES = Invoice.objects.all().select_related('customer', 'created_by').prefetch_related('items')
+
+
 class InvoiceViewSet(OrganizationScopedViewMixin, generics.ListCreateAPIView):
-    queryset = Invoice.objects.all().select_related('customer').prefetch_related('items')
+    queryset = SERIALIZED_INVOICES
     serializer_class = InvoiceSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -192,12 +199,13 @@ class InvoiceViewSet(OrganizationScopedViewMixin, generics.ListCreateAPIView):
 
 
 class InvoiceDetailView(OrganizationScopedViewMixin, generics.RetrieveUpdateDestroyAPIView):  # send_invoice_email action removed
-    queryset = Invoice.objects.all().select_related('customer').prefetch_related('items')
+    queryset = SERIALIZED_INVOICES
     serializer_class = InvoiceSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def perform_destroy(self, instance):
-        AuditLog.objects.create(
+        audit.queue(
+            self.request,
             organization=instance.organization,
             user=self.request.user,
             action='deleted_invoice',
@@ -208,7 +216,7 @@ class InvoiceDetailView(OrganizationScopedViewMixin, generics.RetrieveUpdateDest
 
 # NEW VIEW FOR SENDING INVOICE EMAIL
 class InvoiceSendEmailView(OrganizationScopedViewMixin, generics.GenericAPIView):
-    queryset = Invoice.objects.all()
+    queryset = Invoice.objects.all().select_related('customer')
     serializer_class = InvoiceSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -217,27 +225,16 @@ class InvoiceSendEmailView(OrganizationScopedViewMixin, generics.GenericAPIView)
         if invoice.status == Invoice.PAID or invoice.status == Invoice.VOID:
             return Response({'error': f'Invoice in {invoice.status} status cannot be sent.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        if not invoice.customer.email:
+            return Response({'error': f'Cannot send email: Customer {invoice.customer.name} has no email address.'}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
-            email_sent_successfully = email_utils.send_invoice_email(invoice)
-            if email_sent_successfully:
-                if invoice.status == Invoice.DRAFT:
-                    invoice.status = Invoice.SENT
-                    invoice.save(update_fields=['status'])
-
-                AuditLog.objects.create(
-                    organization=invoice.organization,
-                    user=request.user,
-                    action='sent_invoice_email',
-                    details={'invoice_id': str(invoice.id), 'invoice_number': invoice.invoice_number, 'customer_email': invoice.customer.email}
-                )
-                return Response({'message': 'Invoice sent successfully.'}, status=status.HTTP_200_OK)
-            else:
-                if not invoice.customer.email:
-                    return Response({'error': f'Cannot send email: Customer {invoice.customer.name} has no email address.'}, status=status.HTTP_400_BAD_REQUEST)
-                return Response({'error': 'Failed to send invoice email. Possible configuration issue or SendGrid error.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        except Exception:  # F841: local variable 'e' is assigned to but never used, so remove 'as e'
-            logger.exception(f'Error in InvoiceSendEmailView for invoice {invoice.id}')  # Removed e from log
-            return Response({'error': 'An unexpected error occurred while sending the email.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            # Rendering and SendGrid I/O happen in a Celery worker; the task marks the invoice sent.
+            tasks.send_invoice_email_task.delay(str(invoice.id), str(request.user.id))
+        except Exception:
+            logger.exception(f'Error queueing invoice email for invoice {invoice.id}')
+            return Response({'error': 'Failed to queue invoice email. Please try again later.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({'message': 'Invoice email queued for sending.'}, status=status.HTTP_202_ACCEPTED)
 
 
 class VendorViewSet(OrganizationScopedViewMixin, generics.ListCreateAPIView):
@@ -257,7 +254,7 @@ class PlaidCreateLinkTokenView(APIView):
 
     def post(self, request, *args, **kwargs):
         user = request.user
-        membership = user.membership_set.first()
+        membership = request_membership(request)
         if not membership:
             return Response({'error': 'User not associated with an organization.'}, status=status.HTTP_400_BAD_REQUEST)
         organization = membership.organization
@@ -282,7 +279,7 @@ class PlaidExchangePublicTokenView(APIView):
         if not public_token:
             return Response({'error': 'Public token not provided.'}, status=status.HTTP_400_BAD_REQUEST)
         user = request.user
-        membership = user.membership_set.first()
+        membership = request_membership(request)
         if not membership:
             return Response({'error': 'User not associated with an organization.'}, status=status.HTTP_400_BAD_REQUEST)
         organization = membership.organization
@@ -300,7 +297,7 @@ class PlaidFetchTransactionsView(APIView):
         if not plaid_item_id:
             return Response({'error': 'Plaid Item ID not provided.'}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            organization = request.user.membership_set.first().organization
+            organization = request_membership(request).organization
             plaid_item = PlaidItem.objects.get(id=plaid_item_id, organization=organization)
         except PlaidItem.DoesNotExist:
             return Response({'error': 'Plaid item not found or access denied.'}, status=status.HTTP_404_NOT_FOUND)
@@ -312,9 +309,17 @@ class PlaidFetchTransactionsView(APIView):
         return Response({'error': 'Failed to fetch transactions from Plaid.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+# The serializer nests each row's Plaid item (with its user), applied rule (with its creator) and a summary of
+# its linked transaction, and never reads the raw data.
+SERIALIZED_STAGED_TRANSACTIONS = StagedBankTransaction.objects.with_display().without_bulky().select_related(
+    'plaid_item__user', 'applied_rule__created_by'
+)
+
+
 class StagedBankTransactionListView(OrganizationScopedViewMixin, generics.ListAPIView):
-    queryset = StagedBankTransaction.objects.all().order_by('-date')
-    serializer_class = StagedBankTransactionSerializer
+    # The list serializer only nests the linked transaction's summary; the Plaid item and rule are ids.
+    queryset = StagedBankTransaction.objects.without_bulky().select_related('linked_transaction').order_by('-date')
+    serializer_class = StagedBankTransactionListSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 
@@ -332,7 +337,7 @@ class ManualBankStatementImportView(APIView):
             reader = csv.DictReader(io_string)
             imported_count = 0
             failed_rows = []
-            membership = request.user.membership_set.first()
+            membership = request_membership(request)
             if not membership:
                 return Response({'error': 'User not associated with an organization.'}, status=status.HTTP_400_BAD_REQUEST)
             organization = membership.organization
@@ -374,7 +379,7 @@ class ApplyReconciliationRulesView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, *args, **kwargs):
-        membership = request.user.membership_set.first()
+        membership = request_membership(request)
         if not membership:
             return Response({'error': 'User not associated with an organization.'}, status=status.HTTP_400_BAD_REQUEST)
         organization = membership.organization
@@ -383,13 +388,13 @@ class ApplyReconciliationRulesView(APIView):
 
 
 class StagedBankTransactionDetailView(OrganizationScopedViewMixin, generics.RetrieveUpdateAPIView):
-    queryset = StagedBankTransaction.objects.all()
+    queryset = SERIALIZED_STAGED_TRANSACTIONS
     serializer_class = StagedBankTransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 
 class StagedBankTransactionSuggestMatchesView(OrganizationScopedViewMixin, generics.GenericAPIView):
-    queryset = StagedBankTransaction.objects.all()
+    queryset = SERIALIZED_STAGED_TRANSACTIONS
     serializer_class = StagedBankTransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -400,7 +405,7 @@ class StagedBankTransactionSuggestMatchesView(OrganizationScopedViewMixin, gener
 
 
 class StagedBankTransactionMatchView(OrganizationScopedViewMixin, generics.GenericAPIView):
-    queryset = StagedBankTransaction.objects.all()
+    queryset = SERIALIZED_STAGED_TRANSACTIONS
     serializer_class = StagedBankTransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -414,7 +419,7 @@ class StagedBankTransactionMatchView(OrganizationScopedViewMixin, generics.Gener
             staged_tx.linked_transaction = target_tx
             staged_tx.reconciliation_status = StagedBankTransaction.RECON_MATCHED
             staged_tx.save(update_fields=['linked_transaction', 'reconciliation_status'])
-            AuditLog.objects.create(organization=staged_tx.organization, user=request.user, action='matched_bank_transaction', details={'staged_tx_id': str(staged_tx.id), 'ledger_tx_id': str(target_tx.id)})
+            audit.queue(request, organization=staged_tx.organization, user=request.user, action='matched_bank_transaction', details={'staged_tx_id': str(staged_tx.id), 'ledger_tx_id': str(target_tx.id)})
             return Response(StagedBankTransactionSerializer(staged_tx).data)
         except Transaction.DoesNotExist:
             return Response({'error': 'Target LedgerPro transaction not found.'}, status=status.HTTP_404_NOT_FOUND)
@@ -424,7 +429,7 @@ class StagedBankTransactionMatchView(OrganizationScopedViewMixin, generics.Gener
 
 
 class StagedBankTransactionCreateLedgerView(OrganizationScopedViewMixin, generics.GenericAPIView):
-    queryset = StagedBankTransaction.objects.all()
+    queryset = SERIALIZED_STAGED_TRANSACTIONS
     serializer_class = StagedBankTransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -435,7 +440,7 @@ class StagedBankTransactionCreateLedgerView(OrganizationScopedViewMixin, generic
         # This is a placeholder action. Actual GL creation is complex.
         staged_tx.reconciliation_status = StagedBankTransaction.RECON_CREATED_TRANSACTION
         staged_tx.save(update_fields=['reconciliation_status'])
-        AuditLog.objects.create(organization=staged_tx.organization, user=request.user, action='created_ledger_tx_from_bank_tx', details={'staged_tx_id': str(staged_tx.id)})
+        audit.queue(request, organization=staged_tx.organization, user=request.user, action='created_ledger_tx_from_bank_tx', details={'staged_tx_id': str(staged_tx.id)})
         logger.info(f'User initiated creation of LedgerPro transaction from staged_tx {staged_tx.id}')
         return Response(StagedBankTransactionSerializer(staged_tx).data)
 
@@ -456,7 +461,7 @@ class StagedBankTransactionCreateLedgerView(OrganizationScopedViewMixin, generic
             staged_tx.linked_transaction = target_tx
             staged_tx.reconciliation_status = StagedBankTransaction.RECON_MATCHED
             staged_tx.save(update_fields=['linked_transaction', 'reconciliation_status'])
-            AuditLog.objects.create(organization=staged_tx.organization, user=request.user, action='matched_bank_transaction', details={'staged_tx_id': str(staged_tx.id), 'ledger_tx_id': str(target_tx.id)})
+            audit.queue(request, organization=staged_tx.organization, user=request.user, action='matched_bank_transaction', details={'staged_tx_id': str(staged_tx.id), 'ledger_tx_id': str(target_tx.id)})
             return Response(StagedBankTransactionSerializer(staged_tx).data)
         except Transaction.DoesNotExist:
             return Response({'error': 'Target LedgerPro transaction not found.'}, status=status.HTTP_404_NOT_FOUND)
@@ -472,7 +477,7 @@ class StagedBankTransactionCreateLedgerView(OrganizationScopedViewMixin, generic
         # Placeholder for actual GL creation
         staged_tx.reconciliation_status = StagedBankTransaction.RECON_CREATED_TRANSACTION
         staged_tx.save(update_fields=['reconciliation_status'])
-        AuditLog.objects.create(organization=staged_tx.organization, user=request.user, action='created_ledger_tx_from_bank_tx', details={'staged_tx_id': str(staged_tx.id)})
+        audit.queue(request, organization=staged_tx.organization, user=request.user, action='created_ledger_tx_from_bank_tx', details={'staged_tx_id': str(staged_tx.id)})
         logger.info(f'User initiated creation of LedgerPro transaction from staged_tx {staged_tx.id}')
         return Response(StagedBankTransactionSerializer(staged_tx).data)
 
@@ -481,7 +486,7 @@ class ProfitAndLossView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        membership = request.user.membership_set.first()
+        membership = request_membership(request)
         if not membership:
             return Response({'error': 'User not associated with an organization.'}, status=status.HTTP_400_BAD_REQUEST)
         organization = membership.organization
@@ -508,7 +513,7 @@ class BalanceSheetView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        membership = request.user.membership_set.first()
+        membership = request_membership(request)
         if not membership:
             return Response({'error': 'User not associated with an organization.'}, status=status.HTTP_400_BAD_REQUEST)
         organization = membership.organization
@@ -530,7 +535,7 @@ class BalanceSheetView(APIView):
 
 
 class EmployeeViewSet(OrganizationScopedViewMixin, viewsets.ModelViewSet):
-    queryset = Employee.objects.all()
+    queryset = Employee.objects.all().select_related('user', 'created_by')
     serializer_class = EmployeeSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -548,7 +553,7 @@ class DeductionTypeViewSet(OrganizationScopedViewMixin, viewsets.ModelViewSet):
 
 
 class PayRunViewSet(OrganizationScopedViewMixin, viewsets.ModelViewSet):
-    queryset = PayRun.objects.all().prefetch_related('payslips', 'payslips__employee', 'payslips__deductions_applied__deduction_type')
+    queryset = PayRun.objects.with_payslips()
     serializer_class = PayRunSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -558,6 +563,15 @@ class PayRunViewSet(OrganizationScopedViewMixin, viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(organization=self.get_organization())
 
+    def update(self, request, *args, **kwargs):
+        # UpdateModelMixin.update() without its prefetch reset: payslips are read-only here, so the ones
+        # get_object() prefetched are still current, and re-reading them lazily costs queries per payslip.
+        partial = kwargs.pop('partial', False)
+        serializer = self.get_serializer(self.get_object(), data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        return Response(serializer.data)
+
     @action(detail=True, methods=['post'], url_path='process')
     def process_pay_run_action(self, request, pk=None):
         pay_run = self.get_object()
@@ -565,6 +579,8 @@ class PayRunViewSet(OrganizationScopedViewMixin, viewsets.ModelViewSet):
 
         try:
             processed_pay_run = payroll_service.process_pay_run(pay_run, employee_inputs_data, request.user)
+            # get_object() prefetched the payslips as they were before processing.
+            processed_pay_run = self.get_queryset().get(pk=processed_pay_run.pk)
             return Response(PayRunSerializer(processed_pay_run, context=self.get_serializer_context()).data)
         except ValueError as ve:
             logger.warning(f'Validation error processing pay run {pay_run.id}: {ve}')
@@ -579,7 +595,7 @@ class PayslipListView(OrganizationScopedViewMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        qs = Payslip.objects.filter(pay_run__organization=self.get_organization())
+        qs = Payslip.objects.with_display().with_deductions().filter(pay_run__organization=self.get_organization())
         employee_id_param = self.request.query_params.get('employee_id')
         if employee_id_param:
             qs = qs.filter(employee_id=employee_id_param)
@@ -591,4 +607,4 @@ class PayslipDetailView(OrganizationScopedViewMixin, generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Payslip.objects.filter(pay_run__organization=self.get_organization())
+        return Payslip.objects.with_display().with_deductions().filter(pay_run__organization=self.get_organization())
@@ -1,7 +1,10 @@
 # Placeholder for Django project settings.py
+import base64
+import hashlib
 import os
 from pathlib import Path
 from datetime import timedelta  # Moved E402
+from django.core.exceptions import ImproperlyConfigured
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -27,6 +30,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.audit.AuditLogMiddleware',
 ]
 ROOT_URLCONF = 'ledgerpro_project.urls'
 TEMPLATES = [
@@ -49,8 +53,18 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',  # Placeholder, will use PostgreSQL
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '600')),  # Reuse connections across requests/tasks instead of reconnecting per query batch
+        'CONN_HEALTH_CHECKS': True,  # Drop a persistent connection that went stale before reusing it
     }
 }
+# Keep ATOMIC_REQUESTS off: the invoice email paths make network sends and should not hold a transaction open across them.
+# Shared by every web and Celery worker so cache invalidations (account balance versions) reach all of them.
+# Required outside DEBUG; local dev runs one process, where the in-memory cache is enough.
+CACHE_URL = os.environ.get('CACHE_URL')
+if CACHE_URL:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}}
+elif not DEBUG:
+    raise ImproperlyConfigured('CACHE_URL must be set when DEBUG is False.')
 # Password validation (kept for now, might be handled by other auth systems later)
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -76,7 +90,11 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 # Simple JWT Settings
@@ -88,6 +106,8 @@ SIMPLE_JWT = {
 # SendGrid Configuration
 SENDGRID_API_KEY = os.environ.get('SENDGRID_API_KEY', 'YOUR_SENDGRID_API_KEY_PLACEHOLDER')
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@ledgerpro.example.com')
+# Where compiled Jinja2 email templates are cached across worker restarts; None uses a per-user temp directory.
+JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR', None)
 
 # Plaid Configuration (Section 7.3)
 PLAID_CLIENT_ID = os.environ.get('PLAID_CLIENT_ID', 'YOUR_PLAID_CLIENT_ID')
@@ -98,3 +118,27 @@ PLAID_PRODUCTS = os.environ.get('PLAID_PRODUCTS', 'transactions').split(',')  #
 PLAID_COUNTRY_CODES = os.environ.get('PLAID_COUNTRY_CODES', 'US').split(',')  # e.g., ['US']
 # Redirect URI for Plaid Link (OAuth) - often handled by frontend, but backend might need to be aware
 PLAID_REDIRECT_URI = os.environ.get('PLAID_REDIRECT_URI', None)
+# Base64 32-byte AES-GCM key for Plaid access tokens at rest. Required outside DEBUG: a key derived from
+# SECRET_KEY would make every stored token undecryptable the moment SECRET_KEY is rotated.
+PLAID_TOKEN_KEY = os.environ.get('PLAID_TOKEN_KEY')
+if not PLAID_TOKEN_KEY:
+    if not DEBUG:
+        raise ImproperlyConfigured('PLAID_TOKEN_KEY must be set when DEBUG is False.')
+    PLAID_TOKEN_KEY = base64.b64encode(hashlib.sha256(SECRET_KEY.encode()).digest()).decode()  # Local dev only
+# Store each synced transaction's full Plaid payload in raw_data; otherwise only a small subset is kept.
+PLAID_PERSIST_RAW = os.environ.get('PLAID_PERSIST_RAW', 'False') == 'True'
+
+# Celery Configuration (background email delivery)
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', None)
+CELERY_TASK_ACKS_LATE = True  # Redeliver tasks if a worker dies mid-send
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', 'False') == 'True'  # Run tasks inline for local dev without a broker
+# Plaid syncs wait on the network; a dedicated queue keeps them from starving email and other workers.
+CELERY_TASK_ROUTES = {'api.tasks.sync_plaid_item_task': {'queue': 'plaid_sync'}}
+CELERY_BEAT_SCHEDULE = {
+    'sync-all-plaid-items': {
+        'task': 'api.tasks.sync_all_plaid_items_task',
+        'schedule': float(os.environ.get('PLAID_SYNC_INTERVAL_SECONDS', '3600')),
+    },
+}